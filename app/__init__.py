@@ -22,6 +22,10 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
     cursor = dbapi_connection.cursor()
     cursor.execute("PRAGMA foreign_keys=ON")
     cursor.close()
+    # the distances are computed in SQL (see InseeCommune.select_insee_codes_near), NULL without coordinates
+    from app.models import distance_km
+    dbapi_connection.create_function("distance_km", 4, lambda *coordinates: None if None in coordinates
+                                     else distance_km(*coordinates), deterministic=True)
 
 
 class PrefixMiddleware(object):
@@ -97,7 +101,7 @@ def create_app(config_name="dev", with_hardcoded_prefix=True):
     from app.api.responsibility.routes import register_responsibility_api_urls
     from app.api.user.routes import register_user_api_urls
 
-    from app.api.decorators import export_to
+    from app.api.place.routes import exports as place_exports
 
     with app.app_context():
         # generate resources endpoints
@@ -113,7 +117,11 @@ def create_app(config_name="dev", with_hardcoded_prefix=True):
         register_user_api_urls(app)
 
         # generate search endpoint
-        app.api_url_registrar.register_search_route(decorators=[export_to('linkedplaces')])
+        app.api_url_registrar.register_search_route(exports=place_exports)
+        # generate map tiles endpoint
+        app.api_url_registrar.register_map_tiles_route()
+        # generate the index queue monitoring endpoint
+        app.api_url_registrar.register_index_queue_route()
 
     app.register_blueprint(app_bp)
     app.register_blueprint(api_bp)
@@ -1,4 +1,7 @@
 from flask import current_app, request
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.interfaces import MANYTOONE
 
 from app import db
 
@@ -12,6 +15,20 @@ class JSONAPIAbstractFacade(object):
 
     ITEMS_PER_PAGE = 1000  # TODO: au delà il faut passer par l'api scroll d'elastic search
 
+    # Eager loading declarations. Paths are dotted model relationship names (eg. 'commune.region')
+    # relationships read by the `resource` getter
+    RESOURCE_LOADS = ()
+    # relationships read by each relationship getter, by relationship name
+    RELATIONSHIP_LOADS = {}
+    # False if the `resource` getter never exposes the relationships data
+    EXPOSES_RELATIONSHIPS = True
+    # relationships read by get_data_to_index_when_added
+    INDEX_LOADS = ()
+
+    # names of the facades whose attributes are stored in the index payload,
+    # so that /search?index-only can make their resources without querying the database
+    INDEXED_FACADES = ()
+
     def __init__(self, url_prefix, obj, with_relationships_links=True, with_relationships_data=True):
         self.obj = obj
         self.url_prefix = url_prefix
@@ -58,6 +75,137 @@ class JSONAPIAbstractFacade(object):
     def meta(self):
         return {}
 
+    @classmethod
+    def get_eager_loading_paths(cls, model, with_relationships_data=True, include=()):
+        """
+        List the relationships read when making the resources of this facade
+        :param model: the model class of the facade objects
+        :param with_relationships_data: will the relationships data be exposed ?
+        :param include: the relationships to be included (?include=rel1,rel2@facade)
+        :return: a list of dotted relationship paths
+        """
+        paths = list(cls.RESOURCE_LOADS)
+        if with_relationships_data and cls.EXPOSES_RELATIONSHIPS:
+            for rel_paths in cls.RELATIONSHIP_LOADS.values():
+                paths.extend(rel_paths)
+        for inclusion in include:
+            rel_name, _, facade_name = inclusion.partition('@')
+            # included resources are made without their relationships data
+            paths.extend(cls.get_related_eager_loading_paths(model, rel_name, facade_name or None, False))
+        return paths
+
+    @classmethod
+    def get_related_eager_loading_paths(cls, model, rel_name, facade_name=None, with_relationships_data=False,
+                                        include=()):
+        """
+        List the relationships read when making the resources of the relationship 'rel_name'
+        :param include: the relationships to be included from the related resources
+        :return: a list of dotted relationship paths
+        """
+        from app.api.facade_manager import JSONAPIFacadeManager
+        paths = []
+        for path in cls.RELATIONSHIP_LOADS.get(rel_name, ()):
+            paths.append(path)
+            related_model = JSONAPIAbstractFacade.get_path_target(model, path)
+            if facade_name:
+                related_facade = JSONAPIFacadeManager.get_facade_class_from_name(rel_name, facade_name)
+            else:
+                related_facade = JSONAPIFacadeManager.get_facade_class(related_model)
+            if related_facade is not None:
+                paths.extend(["%s.%s" % (path, p) for p in
+                              related_facade.get_eager_loading_paths(related_model, with_relationships_data,
+                                                                     include)])
+        return paths
+
+    @staticmethod
+    def get_path_target(model, path):
+        for attr_name in path.split('.'):
+            model = getattr(model, attr_name).property.mapper.class_
+        return model
+
+    @staticmethod
+    def iter_loaded_objects(obj, path):
+        """
+        Iterate over the objects reached from obj through the dotted relationship path, the intermediate ones
+        included. The relationships which are not loaded yet are not followed.
+        """
+        objs = [obj]
+        for attr_name in path.split('.'):
+            reached = []
+            for o in objs:
+                if attr_name in inspect(o).unloaded:
+                    continue
+                value = getattr(o, attr_name)
+                if isinstance(value, list):
+                    reached.extend(value)
+                elif value is not None:
+                    reached.append(value)
+            yield from reached
+            objs = reached
+
+    @staticmethod
+    def make_loader_options(model, paths):
+        """
+        Make the query options eager loading the given relationship paths.
+        Many-to-one relationships are joined, collections are loaded with a second SELECT ... IN query.
+        :param model: the queried model class
+        :param paths: dotted relationship paths
+        :return: a list of loader options to pass to Query.options()
+        """
+        paths = set(paths)
+        options = []
+        # the longest paths load their prefixes too
+        for path in sorted(p for p in paths if not any(o.startswith(p + '.') for o in paths)):
+            option = None
+            current_model = model
+            for attr_name in path.split('.'):
+                attr = getattr(current_model, attr_name)
+                loader = joinedload if attr.property.direction is MANYTOONE else selectinload
+                option = loader(attr) if option is None else getattr(option, loader.__name__)(attr)
+                current_model = attr.property.mapper.class_
+            options.append(option)
+        return options
+
+    @classmethod
+    def get_loader_options(cls, model, with_relationships_data=True, include=()):
+        return JSONAPIAbstractFacade.make_loader_options(
+            model, cls.get_eager_loading_paths(model, with_relationships_data, include)
+        )
+
+    @classmethod
+    def get_index_loader_options(cls, model):
+        """
+        Make the query options eager loading what get_data_to_index_when_added reads
+        """
+        from app.api.facade_manager import JSONAPIFacadeManager
+        paths = list(cls.INDEX_LOADS)
+        for facade_name in cls.INDEXED_FACADES:
+            facade_class = JSONAPIFacadeManager.get_facade_class_from_name(model.__tablename__, facade_name)
+            paths.extend(facade_class.RESOURCE_LOADS)
+        return JSONAPIAbstractFacade.make_loader_options(model, paths)
+
+    @staticmethod
+    def make_location(commune):
+        """
+        :return: the geo_point of the commune for the search index
+        """
+        coordinates = commune.coordinates if commune else None
+        if coordinates is None:
+            return None
+        long, lat = coordinates
+        return {"lon": long, "lat": lat}
+
+    def get_indexed_facades_attributes(self):
+        """
+        :return: the attributes of the INDEXED_FACADES resources, by facade name
+        """
+        from app.api.facade_manager import JSONAPIFacadeManager
+        attributes = {}
+        for facade_name in self.INDEXED_FACADES:
+            facade_class = JSONAPIFacadeManager.get_facade_class_from_name(self.obj.__tablename__, facade_name)
+            attributes[facade_name] = facade_class("", self.obj, False, False).resource["attributes"]
+        return attributes
+
     @staticmethod
     def make_resource_identifier(id, type):
         return {"id": id, "type": type}
@@ -113,14 +261,20 @@ class JSONAPIAbstractFacade(object):
         return resource
 
     @staticmethod
-    def create_resource(model, obj_id, attributes, related_resources):
+    def create_resource(model, obj_id, attributes, related_resources, commit=True):
+        """
+        :param commit: if False the resource is only flushed, to be committed along with the queued index operations
+        """
         errors = None
         resource = None
         try:
             # print("CREATING RESOURCE:", model, obj_id, attributes, related_resources)
             resource = JSONAPIAbstractFacade.post_resource(model, obj_id, attributes, related_resources)
             db.session.add(resource)
-            db.session.commit()
+            if commit:
+                db.session.commit()
+            else:
+                db.session.flush()
         except Exception as e:
             print(e)
             errors = {
@@ -175,7 +329,10 @@ class JSONAPIAbstractFacade(object):
         return obj
 
     @staticmethod
-    def update_resource(obj, obj_type, attributes, related_resources, append=False):
+    def update_resource(obj, obj_type, attributes, related_resources, append=False, commit=True):
+        """
+        :param commit: if False the resource is only flushed, to be committed along with the queued index operations
+        """
         errors = None
         resource = None
         try:
@@ -183,7 +340,10 @@ class JSONAPIAbstractFacade(object):
                 raise Exception("Object is None")
             resource = JSONAPIAbstractFacade.patch_resource(obj, obj_type, attributes, related_resources, append)
             db.session.add(resource)
-            db.session.commit()
+            if commit:
+                db.session.commit()
+            else:
+                db.session.flush()
         except Exception as e:
             print(e)
             errors = {
@@ -196,7 +356,10 @@ class JSONAPIAbstractFacade(object):
         return resource, errors
 
     @staticmethod
-    def delete_related_resources(obj, related_resources):
+    def delete_related_resources(obj, related_resources, commit=True):
+        """
+        :param commit: if False the changes are only flushed, to be committed along with the queued index operations
+        """
         errors = None
         resource = None
         try:
@@ -222,7 +385,10 @@ class JSONAPIAbstractFacade(object):
                     raise AttributeError("Relationship %s does not exist" % rel_name)
 
             db.session.add(obj)
-            db.session.commit()
+            if commit:
+                db.session.commit()
+            else:
+                db.session.flush()
         except Exception as e:
             print(e)
             errors = {
@@ -236,14 +402,20 @@ class JSONAPIAbstractFacade(object):
         return errors
 
     @staticmethod
-    def delete_resource(obj):
+    def delete_resource(obj, commit=True):
+        """
+        :param commit: if False the deletion is only flushed, to be committed along with the queued index operations
+        """
         errors = None
         try:
             if obj is None:
                 raise ValueError("Resource does not exist")
             print("DELETING RESOURCE:", obj)
             db.session.delete(obj)
-            db.session.commit()
+            if commit:
+                db.session.commit()
+            else:
+                db.session.flush()
         except Exception as e:
             errors = {
                 "status": 404 if obj is None else 400,
@@ -253,26 +425,66 @@ class JSONAPIAbstractFacade(object):
             db.session.rollback()
         return errors
 
+    def get_related_query(self, rel_field):
+        """
+        :return: the query of the objects of the relationship rel_field, ordered by id
+        """
+        rel_prop = getattr(type(self.obj), rel_field).property
+        return rel_prop.mapper.class_.query.with_parent(self.obj, rel_field).order_by(*rel_prop.mapper.primary_key)
+
+    def get_related_objects(self, rel_field, limit=None, offset=None, options=()):
+        """
+        :param limit: with offset, the page of the objects to load, ordered by id. The whole relationship is read
+                      if it is already loaded, otherwise only the page is queried
+        :param options: the loader options of the page query
+        :return: the objects of the to-many relationship rel_field
+        """
+        if limit is None and offset is None:
+            return getattr(self.obj, rel_field)
+        offset = offset or 0
+        if rel_field not in inspect(self.obj).unloaded:
+            mapper = getattr(type(self.obj), rel_field).property.mapper
+            objs = sorted(getattr(self.obj, rel_field), key=mapper.primary_key_from_instance)
+            return objs[offset:None if limit is None else offset + limit]
+        query = self.get_related_query(rel_field).options(*options).offset(offset)
+        return query.all() if limit is None else query.limit(limit).all()
+
+    def get_related_count(self, rel_field, to_many=False):
+        def func():
+            if not to_many:
+                return 0 if getattr(self.obj, rel_field) is None else 1
+            if rel_field not in inspect(self.obj).unloaded:
+                return len(getattr(self.obj, rel_field))
+            return self.get_related_query(rel_field).order_by(None).count()
+
+        return func
+
     def get_related_resource_identifiers(self, facade_class, rel_field, to_many=False):
-        def func(f_class=None):
+        def func(f_class=None, limit=None, offset=None):
             f_class = f_class if f_class else facade_class
 
-            field = getattr(self.obj, rel_field)
             if to_many:
+                field = self.get_related_objects(rel_field, limit, offset)
                 return [] if field is None else [
                     f_class.make_resource_identifier(f.id, f_class.TYPE)
                     for f in field
                 ]
             else:
+                field = getattr(self.obj, rel_field)
                 return None if field is None else f_class.make_resource_identifier(field.id, f_class.TYPE)
 
         return func
 
     def get_related_resources(self, facade_class, rel_field, to_many=False):
-        def func(f_class=None):
+        def func(f_class=None, limit=None, offset=None):
             f_class = f_class if f_class else facade_class
-            field = getattr(self.obj, rel_field)
             if to_many:
+                options = ()
+                if limit is not None or offset is not None:
+                    # the page query loads what the related resources read
+                    related_model = getattr(type(self.obj), rel_field).property.mapper.class_
+                    options = f_class.get_loader_options(related_model, self.with_relationships_data)
+                field = self.get_related_objects(rel_field, limit, offset, options)
                 if field is None:
                     return []
                 else:
@@ -282,6 +494,7 @@ class JSONAPIAbstractFacade(object):
                         for rel_obj in field
                     ]
             else:
+                field = getattr(self.obj, rel_field)
                 if field is None:
                     return None
                 else:
@@ -324,6 +537,13 @@ class JSONAPIAbstractFacade(object):
     def get_data_to_index_when_removed(self, propagate):
         return []
 
+    def get_parent_facades(self):
+        """
+        :return: the facades of the objects whose index documents are made from this object,
+                 they are reindexed once this object is removed
+        """
+        return []
+
     def get_relationship_data_to_index(self, rel_name):
         from app.api.facade_manager import JSONAPIFacadeManager
         to_be_reindexed = []
@@ -346,21 +566,54 @@ class JSONAPIAbstractFacade(object):
     def add_to_index(self, propagate=False):
         from app.api.search import SearchIndexManager
         for data in self.get_data_to_index_when_added(propagate):
-            SearchIndexManager.add_to_index(index=data["index"], id=data["id"], payload=data["payload"])
+            if current_app.config.get("INDEX_WRITE_BEHIND"):
+                SearchIndexManager.enqueue(index=data["index"], id=data["id"], payload=data["payload"])
+            else:
+                SearchIndexManager.add_to_index(index=data["index"], id=data["id"], payload=data["payload"])
 
     def remove_from_index(self, propagate=False):
         from app.api.search import SearchIndexManager
         for data in self.get_data_to_index_when_removed(propagate):
-            SearchIndexManager.remove_from_index(index=data["index"], id=data["id"])
+            if current_app.config.get("INDEX_WRITE_BEHIND"):
+                SearchIndexManager.enqueue(index=data["index"], id=data["id"])
+            else:
+                SearchIndexManager.remove_from_index(index=data["index"], id=data["id"])
 
-    def reindex(self, op, propagate=False):
+    def reindex(self, op, propagate=False, commit=True):
         """
-
+        With INDEX_WRITE_BEHIND, the index operations are queued in the outbox and sent by the index-worker command
         :param op:
         :param propagate:  if True then reindex related indexes too
+        :param commit: if True the pending changes of the session are committed: along with the queued operations
+        with INDEX_WRITE_BEHIND, before the index is updated otherwise. If False they are committed later by the caller
         :return:
         """
+        write_behind = current_app.config.get("INDEX_WRITE_BEHIND")
+        if commit and not write_behind:
+            db.session.commit()
         if op in ("insert", "update"):
             self.add_to_index(propagate)
         else:
             self.remove_from_index(propagate)
+        if commit and write_behind:
+            db.session.commit()
+
+
+class JSONAPIIndexedFacade(object):
+    """
+    Make the resource of a facade from the attributes stored in a search index payload
+    (see JSONAPIAbstractFacade.INDEXED_FACADES) instead of the database
+    """
+
+    def __init__(self, url_prefix, facade_class, facade_name, source):
+        self.id = source["id"]
+        self.resource = {
+            "type": facade_class.TYPE,
+            "id": self.id,
+            "attributes": source["facades"][facade_name],
+            "links": {
+                "self": "{url_prefix}/{type_plural}/{id}".format(
+                    url_prefix=url_prefix, type_plural=facade_class.TYPE_PLURAL, id=self.id
+                )
+            }
+        }
@@ -13,10 +13,10 @@ class BiblFacade(JSONAPIAbstractFacade):
         return self.obj.id
 
     @staticmethod
-    def get_resource_facade(url_prefix, id, **kwargs):
+    def get_resource_facade(url_prefix, id, options=(), **kwargs):
         from app.models import Bibl
 
-        e = Bibl.query.filter(Bibl.id == id).first()
+        e = Bibl.query.options(*options).filter(Bibl.id == id).first()
         if e is None:
             kwargs = {"status": 404}
             errors = [{"status": 404, "title": "Bibl %s does not exist" % id}]
@@ -80,6 +80,20 @@ def api_get_capabilities(api_version):
                     ]
                 }
             },
+            {
+                "type": "feature",
+                "id": "map-tiles",
+                "attributes": {
+                    "title": "Tuiles cartographiques",
+                    "content": "Les résultats localisés d'une recherche sont regroupés côté serveur par cellules dans la tuile z/x/y (nombre de documents et centroïde par cellule). Le paramètre precision fixe le niveau de zoom des cellules (entre z et z + 8, z + 3 par défaut).",
+                    "examples": [
+                        {
+                            "description": "La France entière en une seule agrégation",
+                            "content": f"{url_prefix}/map/tiles/0/0/0?query=type:place&precision=7"
+                        }
+                    ]
+                }
+            },
             {
                 "type": "feature",
                 "id": "export-linked-places",
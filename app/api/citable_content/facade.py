@@ -5,6 +5,10 @@ class CitableContentFacade(JSONAPIAbstractFacade):
     """
 
     """
+    RELATIONSHIP_LOADS = {
+        "responsibility": ("responsibility",),
+    }
+
     @property
     def id(self):
         return self.obj.id
@@ -47,4 +51,5 @@ class CitableContentFacade(JSONAPIAbstractFacade):
                 "links": self._get_links(rel_name=rel_name),
                 "resource_identifier_getter": self.get_related_resource_identifiers(rel_facade, u_rel_name, to_many),
                 "resource_getter": self.get_related_resources(rel_facade, u_rel_name, to_many),
+                "count_getter": self.get_related_count(u_rel_name, to_many),
             }
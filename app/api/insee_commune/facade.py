@@ -8,15 +8,25 @@ class CommuneFacade(JSONAPIAbstractFacade):
     TYPE = "commune"
     TYPE_PLURAL = "communes"
 
+    RESOURCE_LOADS = ("place",)
+    RELATIONSHIP_LOADS = {
+        "localized-places": ("localized_places",),
+        "place": ("place",),
+        "region": ("region",),
+        "departement": ("departement",),
+        "arrondissement": ("arrondissement",),
+        "canton": ("canton",),
+    }
+
     @property
     def id(self):
         return self.obj.id
 
     @staticmethod
-    def get_resource_facade(url_prefix, id, **kwargs):
+    def get_resource_facade(url_prefix, id, options=(), **kwargs):
         from app.models import InseeCommune
 
-        e = InseeCommune.query.filter(InseeCommune.id == id).first()
+        e = InseeCommune.query.options(*options).filter(InseeCommune.id == id).first()
         if e is None:
             kwargs = {"status": 404}
             errors = [{"status": 404, "title": "Commune %s does not exist" % id}]
@@ -80,4 +90,5 @@ class CommuneFacade(JSONAPIAbstractFacade):
                 "links": self._get_links(rel_name=rel_name),
                 "resource_identifier_getter": self.get_related_resource_identifiers(rel_facade, u_rel_name, to_many),
                 "resource_getter": self.get_related_resources(rel_facade, u_rel_name, to_many),
+                "count_getter": self.get_related_count(u_rel_name, to_many),
             }
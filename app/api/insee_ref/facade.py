@@ -8,15 +8,20 @@ class InseeRefFacade(JSONAPIAbstractFacade):
     TYPE = "insee-ref"
     TYPE_PLURAL = "insee-refs"
 
+    RELATIONSHIP_LOADS = {
+        "parent": ("parent",),
+        "children": ("children",),
+    }
+
     @property
     def id(self):
         return self.obj.id
 
     @staticmethod
-    def get_resource_facade(url_prefix, id, **kwargs):
+    def get_resource_facade(url_prefix, id, options=(), **kwargs):
         from app.models import InseeRef
 
-        e = InseeRef.query.filter(InseeRef.id == id).first()
+        e = InseeRef.query.options(*options).filter(InseeRef.id == id).first()
         if e is None:
             kwargs = {"status": 404}
             errors = [{"status": 404, "title": "InseeRef %s does not exist" % id}]
@@ -62,6 +67,7 @@ class InseeRefFacade(JSONAPIAbstractFacade):
                 "links": self._get_links(rel_name="children"),
                 "resource_identifier_getter":  self.get_related_resource_identifiers(InseeRefFacade, "children", True),
                 "resource_getter":  self.get_related_resources(InseeRefFacade, "children", True),
+                "count_getter": self.get_related_count("children", True),
             },
             #"communes": {
             #    "links": self._get_links(rel_name="communes"),
@@ -77,6 +83,7 @@ class InseeRefFacade(JSONAPIAbstractFacade):
 
 
 class InseeRefSearchFacade(InseeRefFacade):
+    RESOURCE_LOADS = ("parent.parent",)
 
     @property
     def resource(self):
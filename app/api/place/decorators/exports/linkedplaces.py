@@ -2,13 +2,20 @@ import copy
 import json
 import os
 
-from flask import url_for, current_app
+from jsonschema.validators import validator_for
 
-from app.api.abstract_facade import JSONAPIAbstractFacade
-from app.models import InseeCommune, Place
+from app import JSONAPIResponseFactory
+from app.api.insee_commune.facade import CommuneFacade
+from app.api.place.facade import PlaceFacade
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 templates = {}
+validators = {}
+
+# the JSON schema of the Linked Places features: a hand-written subset of the upstream schema (partial validation),
+# which the update-lpf-schema command replaces with the upstream one
+LPF_SCHEMA_PATH = os.path.join(dir_path, 'schemas', 'lpf-schema.json')
+LPF_SCHEMA_URL = "https://raw.githubusercontent.com/LinkedPasts/linked-places-format/{revision}/lpf-schema.json"
 
 
 def addLink(id):
@@ -29,76 +36,86 @@ def from_template(fn):
     return copy.deepcopy(templates[fn])
 
 
-def export_place_to_linkedplace(request, input_data):
+def check_lpf_schema(schema):
     """
-    Demonstration of the export feature.
-    :param data:
-    :return:
+    :return: the validator class of the schema, raise a SchemaError if the schema is not valid
     """
-    url_prefix = request.host_url[:-1] + current_app.api_url_registrar.url_prefix
+    validator_class = validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class
 
-    feature_collection = from_template('FeatureCollection.json')
 
-    # so you can work with single data the same way you would with a list
-    if not isinstance(input_data["data"], list):
-        input_data["data"] = [input_data["data"]]
+def get_lpf_validator(schema_path=LPF_SCHEMA_PATH):
+    """
+    :return: the validator of the schema, checked and made once per process
+    """
+    if schema_path not in validators:
+        with open(schema_path, 'r') as f:
+            schema = json.load(f)
+        validators[schema_path] = check_lpf_schema(schema)(schema)
+    return validators[schema_path]
 
-    # just converting the incoming jsonapi data into a simpler json format of my own
-    for place_jsonapi in input_data["data"]:
 
-        p = Place.query.filter(Place.id == place_jsonapi["id"]).first()
-        if not p:
-            print("WARNING: place %s not found in db" % place_jsonapi["id"])
-            continue
+def get_validation_error_type(error):
+    """
+    :return: the failed rule and where it is in the schema, the same for every feature failing this way
+    """
+    return "{0} {1}".format(error.validator, "/".join(str(p) for p in error.relative_schema_path))
 
-        place_f, _, _ = JSONAPIAbstractFacade.get_facade(url_prefix, p)
-        resource = place_f.resource
 
+class LinkedPlacesFeatureFacade(PlaceFacade):
+    """
+    Make the Linked Places feature of a place from the objects loaded with RESOURCE_LOADS
+    """
+    RESOURCE_LOADS = (
+        "descriptions", "old_labels", "place_feature_types",
+        "commune.region", "commune.departement", "commune.localized_places",
+        "localization_commune.region", "localization_commune.departement", "localization_commune.localized_places",
+    )
+    EXPOSES_RELATIONSHIPS = False
+
+    def make_link(self, type_plural, id):
+        return "{0}/{1}/{2}".format(self.url_prefix, type_plural, id)
+
+    @property
+    def resource(self):
         feature = from_template('Feature.json')
-        feature["@id"] = resource["links"]["self"]  # '""{0}/places/{1}".format(frontend_url, resource["id"])
-        feature["properties"]["title"] = resource["attributes"]["label"]
-        feature["properties"]["ccodes"] = [resource["attributes"]["country"]]
+        feature["@id"] = self.self_link
+        feature["properties"]["title"] = self.obj.label
+        feature["properties"]["ccodes"] = [self.obj.country]
 
-        for desc in place_f.obj.descriptions:
+        for desc in self.obj.descriptions:
             feature["descriptions"].append({
                 "@id": feature["@id"],
                 "value": desc.content,
                 "lang": "fr"
             })
 
-        insee_code = resource["attributes"]["localization-insee-code"]
-        if insee_code:
-            if place_f.obj.commune:
-                co = place_f.obj.commune
-            else:
-                co = place_f.obj.localization_commune
-        else:
-            co = None
+        co = self.obj.related_commune
+        insee_code = co.id if co else None
 
         geometry_collection = from_template('GeometryCollection.json')
         feature["geometry"] = geometry_collection
 
         # geometry
-        if insee_code:
-            commune = InseeCommune.query.filter(InseeCommune.id == insee_code).first()
-            if commune and commune.longlat:
-                point = from_template('Point.json')
-                long, lat = commune.longlat.replace("(", "").replace(")", "").split(",")
-                point["coordinates"] = [float(long), float(lat)]
-                point["geo_wkt"] = "POINT({0} {1})".format(float(long), float(lat))
-                point["src"] = "http://id.insee.fr/geo/commune/{0}".format(insee_code)
-                point["when"] = {
-                    "timespans": [
-                        {"start": {"in": "2011"}, "end": {"in": "2011"}},
-                    ]
-                }
-                geometry_collection["geometries"].append(point)
+        if co and co.coordinates:
+            point = from_template('Point.json')
+            long, lat = co.coordinates
+            point["coordinates"] = [long, lat]
+            point["geo_wkt"] = "POINT({0} {1})".format(long, lat)
+            point["src"] = "http://id.insee.fr/geo/commune/{0}".format(insee_code)
+            point["when"] = {
+                "timespans": [
+                    {"start": {"in": "2011"}, "end": {"in": "2011"}},
+                ]
+            }
+            geometry_collection["geometries"].append(point)
 
         if len(geometry_collection["geometries"]) == 0:
             feature.pop("geometry")
 
         # old labels
-        old_labels = place_f.obj.old_labels
+        old_labels = self.obj.old_labels
         if len(old_labels) > 0:
             start_in = sorted([ol.text_date for ol in old_labels if ol.text_date])
             if len(start_in) > 0:
@@ -131,7 +148,7 @@ def export_place_to_linkedplace(request, input_data):
                 feature["names"].append(name)
 
         # feature types
-        for ftype in place_f.obj.place_feature_types:
+        for ftype in self.obj.place_feature_types:
             if ftype.term:
                 feature_type = {
                     "label": ftype.term
@@ -140,7 +157,7 @@ def export_place_to_linkedplace(request, input_data):
 
         # relations
         ## administrative hierarchy
-        if insee_code:
+        if co:
             if co.region:
                 feature["relations"].append({
                     "relationType": "gvp:broaderPartitive",
@@ -168,29 +185,25 @@ def export_place_to_linkedplace(request, input_data):
             #    })
 
         # relation to commune
-        if place_f.obj.localization_commune_relation_type:
-            co_f, _, _ = JSONAPIAbstractFacade.get_facade(url_prefix, place_f.obj.localization_commune)
+        if self.obj.localization_commune_relation_type:
             feature["relations"].append({
-                "relationType": place_f.obj.localization_commune_relation_type,
-                "relationTo": co_f.self_link,
-                "label": co_f.obj.NCCENR,
+                "relationType": self.obj.localization_commune_relation_type,
+                "relationTo": self.make_link(CommuneFacade.TYPE_PLURAL, self.obj.localization_commune.id),
+                "label": self.obj.localization_commune.NCCENR,
                 # "when": {"timespans": []}
             })
 
         ## subcommunal linked places
-        if len(place_f.obj.linked_places) > 0:
-            for lp in place_f.obj.linked_places:
-                lp_f, _, _ = JSONAPIAbstractFacade.get_facade(url_prefix, lp)
-
-                feature["relations"].append({
-                    "relationType": "gvp:tgn3000_related_to",
-                    "relationTo": lp_f.self_link,
-                    "label": lp_f.resource["attributes"]["label"],
-                    # "when": {"timespans": []}
-                })
+        for lp in self.obj.linked_places:
+            feature["relations"].append({
+                "relationType": "gvp:tgn3000_related_to",
+                "relationTo": self.make_link(self.TYPE_PLURAL, lp.id),
+                "label": lp.label,
+                # "when": {"timespans": []}
+            })
 
         # links
-        if insee_code:
+        if co:
             feature["links"].append(
                 addLink("http://id.insee.fr/geo/commune/{0}".format(insee_code))
             )
@@ -234,32 +247,25 @@ def export_place_to_linkedplace(request, input_data):
                     addLink('https://thesaurus.inha.fr/thesaurus/page/ark:/54721/{0}'.format(co.inha_uuid))
                 )
 
+        return feature
 
-        feature_collection["features"].append(feature)
 
+def export_place_to_linkedplace(request, facade_objs):
+    """
+    Gather the features of the facades into a FeatureCollection
+    :param facade_objs: the LinkedPlacesFeatureFacade of the places to export
+    :return:
+    """
+    feature_collection = from_template('FeatureCollection.json')
+    feature_collection["features"] = [f.resource for f in facade_objs]
     return feature_collection, 200, {}, "application/json"
 
 
-def export_place_to_inline_linkedplace(request, input_data):
-    exp, _, _, _ = export_place_to_linkedplace(request, input_data)
-    filename = "/tmp/feat.json"
-
-    num_page = request.args.get("page[number]", 1)
-    output = "/tmp/inlined-feats.{0}.json".format(num_page)
-
-    try:
-        os.remove(output)
-    except Exception as e:
-        pass
-
-    try:
-        for i, feat in enumerate(exp["features"]):
-            with open(filename, "w", encoding='utf-8') as jsonfile:
-                json.dump(feat, jsonfile, ensure_ascii=False)
-            code = os.system('jq -c . {0} >> {1}'.format(filename, output))
-            print(code)
-
-        with open(output, "r", encoding='utf-8') as inlined:
-            return inlined.read(), 200, {}, "text/plain"
-    except:
-        return "Cannot compact data", 400, "text/plain"
+def export_place_to_inline_linkedplace(request, facade_objs):
+    """
+    Stream the features of the facades, one compact feature per line (NDJSON)
+    :param facade_objs: the LinkedPlacesFeatureFacade of the places to export
+    :return:
+    """
+    lines = JSONAPIResponseFactory.iter_encoded_lines(f.resource for f in facade_objs)
+    return lines, 200, {}, JSONAPIResponseFactory.NDJSON_CONTENT_TYPE
@@ -9,15 +9,33 @@ class PlaceFacade(JSONAPIAbstractFacade):
     TYPE = "place"
     TYPE_PLURAL = "places"
 
+    RESOURCE_LOADS = ("commune", "localization_commune")
+    RELATIONSHIP_LOADS = {
+        "linked-places": ("commune.localized_places", "localization_commune.place",
+                          "localization_commune.localized_places"),
+        "responsibility": ("responsibility",),
+        "commune": ("commune",),
+        "localization-commune": ("localization_commune",),
+        "descriptions": ("descriptions",),
+        "comments": ("comments",),
+        "old-labels": ("old_labels",),
+        "place-feature-types": ("place_feature_types",),
+    }
+    INDEX_LOADS = (
+        "commune.canton", "commune.region",
+        "localization_commune.canton", "localization_commune.region"
+    )
+    INDEXED_FACADES = ("search", "map")
+
     @property
     def id(self):
         return self.obj.id
 
     @staticmethod
-    def get_resource_facade(url_prefix, id, **kwargs):
+    def get_resource_facade(url_prefix, id, options=(), **kwargs):
         from app.models import Place
 
-        e = Place.query.filter(Place.id == id).first()
+        e = Place.query.options(*options).filter(Place.id == id).first()
         if e is None:
             kwargs = {"status": 404}
             errors = [{"status": 404, "title": "Place %s does not exist" % id}]
@@ -27,37 +45,26 @@ class PlaceFacade(JSONAPIAbstractFacade):
             errors = []
         return e, kwargs, errors
 
-    def get_linked_places_resource_identifier(self, rel_facade=None):
-        rel_facade = PlaceFacade if not rel_facade else rel_facade
-
+    def get_linked_places(self):
+        """
+        :return: the sub-communal places localized in the commune of the place, or in the same commune
+        """
         if self.obj.commune_insee_code is None:
-            return [] if self.obj.localization_commune is None or self.obj.localization_commune.place is None else [
-                rel_facade.make_resource_identifier(lp.id, rel_facade.TYPE)
-                for lp in self.obj.localization_commune.place.linked_places if
-                lp.commune_insee_code is None and lp.id != self.obj.id]
+            if self.obj.localization_commune is None or self.obj.localization_commune.place is None:
+                return []
+            linked_places = self.obj.localization_commune.place.linked_places
         else:
-            return [] if len(self.obj.linked_places) == 0 else [
-                rel_facade.make_resource_identifier(lp.id, rel_facade.TYPE)
-                for lp in self.obj.linked_places if
-                lp.commune_insee_code is None]
+            linked_places = self.obj.linked_places
+        return [lp for lp in linked_places if lp.commune_insee_code is None and lp.id != self.obj.id]
 
-    def get_linked_places_resource(self, rel_facade=None):
+    def get_linked_places_resource_identifier(self, rel_facade=None):
         rel_facade = PlaceFacade if not rel_facade else rel_facade
+        return [rel_facade.make_resource_identifier(lp.id, rel_facade.TYPE) for lp in self.get_linked_places()]
 
-        if self.obj.commune_insee_code is None:
-            return [] if self.obj.localization_commune is None or self.obj.localization_commune.place is None else [rel_facade(self.url_prefix, lp,
-                                                                                 self.with_relationships_links,
-                                                                                 self.with_relationships_data).resource
-                                                                     for lp in
-                                                                     self.obj.localization_commune.place.linked_places
-                                                                     if
-                                                                     lp.commune_insee_code is None and lp.id != self.obj.id]
-        else:
-            return [] if len(self.obj.linked_places) == 0 else [rel_facade(self.url_prefix, lp,
-                                                                            self.with_relationships_links,
-                                                                            self.with_relationships_data).resource
-                                                                for lp in self.obj.linked_places if
-                                                                lp.commune_insee_code is None]
+    def get_linked_places_resource(self, rel_facade=None):
+        rel_facade = PlaceFacade if not rel_facade else rel_facade
+        return [rel_facade(self.url_prefix, lp, self.with_relationships_links, self.with_relationships_data).resource
+                for lp in self.get_linked_places()]
 
     @property
     def resource(self):
@@ -133,6 +140,7 @@ class PlaceFacade(JSONAPIAbstractFacade):
                 "links": self._get_links(rel_name=rel_name),
                 "resource_identifier_getter": self.get_related_resource_identifiers(rel_facade, u_rel_name, to_many),
                 "resource_getter": self.get_related_resources(rel_facade, u_rel_name, to_many),
+                "count_getter": self.get_related_count(u_rel_name, to_many),
             }
 
     def get_data_to_index_when_added(self, propagate):
@@ -153,20 +161,41 @@ class PlaceFacade(JSONAPIAbstractFacade):
             "reg-id": co.region.insee_code if co and co.region else None,
 
             "ctn-label": co.canton.label if co and co.canton else None,
+
+            "location": self.make_location(co),
+
+            "facades": self.get_indexed_facades_attributes(),
         }
 
-        return [
+        data = [
             {"id": self.obj.id, "index": self.get_index_name(), "payload": payload},
         ]
+        if propagate:
+            # the old label documents carry the label of their place
+            from app.api.place_old_label.facade import PlaceOldLabelFacade
+            for old_label in self.obj.old_labels:
+                data.extend(PlaceOldLabelFacade(self.url_prefix, old_label).get_data_to_index_when_added(False))
+        return data
 
     def get_data_to_index_when_removed(self, propagate):
         print("GOING TO BE REMOVED FROM INDEX:", [{"id": self.obj.id, "index": self.get_index_name()}])
-        return [
+        data = [
             {"id": self.obj.id, "index": self.get_index_name()},
         ]
+        if propagate:
+            from app.api.place_old_label.facade import PlaceOldLabelFacade
+            for old_label in self.obj.old_labels:
+                data.extend(PlaceOldLabelFacade(self.url_prefix, old_label).get_data_to_index_when_removed(False))
+        return data
 
 
 class PlaceSearchFacade(PlaceFacade):
+    RESOURCE_LOADS = (
+        "commune.canton", "commune.region",
+        "localization_commune.canton", "localization_commune.region",
+        "old_labels", "descriptions"
+    )
+    EXPOSES_RELATIONSHIPS = False
 
     @property
     def resource(self):
@@ -196,7 +225,7 @@ class PlaceSearchFacade(PlaceFacade):
                 "region": co.region.label if co and co.region else None,
                 "longlat": co.longlat if co else None,
                 "descriptions": [d.resource["attributes"]["content"]
-                                 for d in [PlaceDescriptionFacade("", e)
+                                 for d in [PlaceDescriptionFacade("", e, False, False)
                                            for e in self.obj.descriptions]]
             },
             "links": {
@@ -207,6 +236,10 @@ class PlaceSearchFacade(PlaceFacade):
 
 
 class PlaceMapFacade(PlaceSearchFacade):
+    RESOURCE_LOADS = (
+        "commune.departement", "commune.region",
+        "localization_commune.departement", "localization_commune.region"
+    )
 
     @property
     def resource(self):
@@ -230,6 +263,7 @@ class PlaceMapFacade(PlaceSearchFacade):
 
 
 class LinkedPlaceFacade(PlaceSearchFacade):
+    RESOURCE_LOADS = ("descriptions",)
 
     @property
     def resource(self):
@@ -242,7 +276,7 @@ class LinkedPlaceFacade(PlaceSearchFacade):
                 "place-label": self.obj.label,
                 #"responsibility": self.obj.responsibility,
                 "descriptions": [d.resource["attributes"]["content"]
-                                 for d in [PlaceDescriptionFacade("", e)
+                                 for d in [PlaceDescriptionFacade("", e, False, False)
                                  for e in self.obj.descriptions]]
             },
             "links": {
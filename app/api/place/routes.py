@@ -1,23 +1,24 @@
-from app.api.decorators import export_to
 from app.api.place.facade import PlaceFacade
 from app.models import Place
 
-from app.api.place.decorators.exports.linkedplaces import export_place_to_linkedplace, \
-    export_place_to_inline_linkedplace
+from app.api.place.decorators.exports.linkedplaces import LinkedPlacesFeatureFacade, \
+    export_place_to_linkedplace, export_place_to_inline_linkedplace
 
-export_funcs = {
+exports = {
     # the export format will be available under this http parameter value.
     # ex: http://localhost:5003/dico-topo/api/1.0/places?page[size]=200&without-relationships&export=linkedplaces
     #     or
     #     http://localhost:5003/dico-topo/api/1.0/places/DT02-02878?export=linkedplaces
-    "linkedplaces": export_place_to_linkedplace,
-    "inline-linkedplaces": export_place_to_inline_linkedplace
+    # inline-linkedplaces streams one feature per line (application/x-ndjson)
+    # the export facade is made from the places loaded by the route, the export function gathers the facades
+    "linkedplaces": (LinkedPlacesFeatureFacade, export_place_to_linkedplace),
+    "inline-linkedplaces": (LinkedPlacesFeatureFacade, export_place_to_inline_linkedplace)
 }
 
 def register_place_api_urls(app):
     registrar = app.api_url_registrar
 
-    registrar.register_get_routes(Place, PlaceFacade, decorators=[export_to(export_funcs)])
+    registrar.register_get_routes(Place, PlaceFacade, exports=exports)
 
     registrar.register_relationship_get_route(PlaceFacade, 'commune')
     registrar.register_relationship_get_route(PlaceFacade, 'localization-commune')
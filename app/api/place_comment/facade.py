@@ -13,8 +13,8 @@ class PlaceCommentFacade(CitableContentFacade):
     TYPE_PLURAL = "place-comments"
 
     @staticmethod
-    def get_resource_facade(url_prefix, id, **kwargs):
-        e = PlaceComment.query.filter(PlaceComment.id == id).first()
+    def get_resource_facade(url_prefix, id, options=(), **kwargs):
+        e = PlaceComment.query.options(*options).filter(PlaceComment.id == id).first()
         if e is None:
             kwargs = {"status": 404}
             errors = [{"status": 404, "title": "PlaceComment %s does not exist" % id}]
@@ -37,6 +37,7 @@ class PlaceCommentFacade(CitableContentFacade):
 
 
 class FlatPlaceCommentFacade(PlaceCommentFacade):
+    RESOURCE_LOADS = ("responsibility.bibl", "responsibility.user")
 
     @property
     def resource(self):
@@ -41,9 +41,9 @@ class PlaceDescriptionFacade(CitableContentFacade):
     TYPE_PLURAL = "place-descriptions"
 
     @staticmethod
-    def get_resource_facade(url_prefix, id, **kwargs):
+    def get_resource_facade(url_prefix, id, options=(), **kwargs):
 
-        e = PlaceDescription.query.filter(PlaceDescription.id == id).first()
+        e = PlaceDescription.query.options(*options).filter(PlaceDescription.id == id).first()
         if e is None:
             kwargs = {"status": 404}
             errors = [{"status": 404, "title": "PlaceDescription %s does not exist" % id}]
@@ -65,7 +65,20 @@ class PlaceDescriptionFacade(CitableContentFacade):
         return res
 
 
+    def get_data_to_index_when_added(self, propagate):
+        if propagate:
+            # the place document lists the descriptions of the place, the old label documents carry them too
+            from app.api.place.facade import PlaceFacade
+            return PlaceFacade(self.url_prefix, self.obj.place).get_data_to_index_when_added(True)
+        return []
+
+    def get_parent_facades(self):
+        from app.api.place.facade import PlaceFacade
+        return [PlaceFacade(self.url_prefix, self.obj.place)]
+
+
 class FlatPlaceDescriptionFacade(PlaceDescriptionFacade):
+    RESOURCE_LOADS = ("responsibility.bibl", "responsibility.user")
 
     @property
     def resource(self):
@@ -8,15 +8,20 @@ class PlaceFeatureTypeFacade(JSONAPIAbstractFacade):
     TYPE = "place-feature-type"
     TYPE_PLURAL = "place-feature-types"
 
+    RELATIONSHIP_LOADS = {
+        "place": ("place",),
+        "responsibility": ("responsibility",),
+    }
+
     @property
     def id(self):
         return self.obj.id
 
     @staticmethod
-    def get_resource_facade(url_prefix, id, **kwargs):
+    def get_resource_facade(url_prefix, id, options=(), **kwargs):
         from app.models import PlaceFeatureType
 
-        e = PlaceFeatureType.query.filter(PlaceFeatureType.id == id).first()
+        e = PlaceFeatureType.query.options(*options).filter(PlaceFeatureType.id == id).first()
         if e is None:
             kwargs = {"status": 404}
             errors = [{"status": 404, "title": "PlaceFeatureType %s does not exist" % id}]
@@ -11,14 +11,26 @@ class PlaceOldLabelFacade(JSONAPIAbstractFacade):
     TYPE = "place-old-label"
     TYPE_PLURAL = "place-old-labels"
 
+    RELATIONSHIP_LOADS = {
+        "place": ("place",),
+        "commune": ("place.commune",),
+        "localization-commune": ("place.localization_commune",),
+        "responsibility": ("responsibility",),
+    }
+    INDEX_LOADS = (
+        "place.commune.canton", "place.commune.region",
+        "place.localization_commune.canton", "place.localization_commune.region"
+    )
+    INDEXED_FACADES = ("search", "map")
+
     @property
     def id(self):
         return self.obj.id
 
     @staticmethod
-    def get_resource_facade(url_prefix, id, **kwargs):
+    def get_resource_facade(url_prefix, id, options=(), **kwargs):
         from app.models import PlaceOldLabel
-        e = PlaceOldLabel.query.filter(PlaceOldLabel.id == id).first()
+        e = PlaceOldLabel.query.options(*options).filter(PlaceOldLabel.id == id).first()
         if e is None:
             kwargs = {"status": 404}
             errors = [{"status": 404, "title": "PlaceOldLabel %s does not exist" % id}]
@@ -153,6 +165,12 @@ class PlaceOldLabelFacade(JSONAPIAbstractFacade):
         )
 
     def get_data_to_index_when_added(self, propagate):
+        if propagate:
+            # the place document lists its old labels and every old label document carries the label of
+            # the place: reindex the place along with all its old labels (this one included)
+            from app.api.place.facade import PlaceFacade
+            return PlaceFacade(self.url_prefix, self.obj.place).get_data_to_index_when_added(True)
+
         co = self.obj.place.related_commune
 
         label = re.sub(r'<dfn>(.*?)</dfn>', r'\1', self.obj.rich_label)
@@ -176,20 +194,34 @@ class PlaceOldLabelFacade(JSONAPIAbstractFacade):
             "is-localized": co is not None,
 
             "text-date": self.parse_date(self.obj.text_date),
+
+            "location": self.make_location(co),
+
+            "facades": self.get_indexed_facades_attributes(),
         }
 
         return [{"id": self.obj.id, "index": self.get_index_name(), "payload": payload}]
 
     def get_data_to_index_when_removed(self, propagate):
         print("GOING TO BE REMOVED FROM INDEX:", [{"id": self.obj.id, "index": self.get_index_name()}])
-        from app.api.place.facade import PlaceFacade
+        # the place document is reindexed once the old label is removed (see get_parent_facades)
         return [
-            {"id": self.obj.place.id, "index": PlaceFacade.get_index_name()},
             {"id": self.obj.id, "index": self.get_index_name()}
         ]
 
+    def get_parent_facades(self):
+        from app.api.place.facade import PlaceFacade
+        return [PlaceFacade(self.url_prefix, self.obj.place)]
+
 
 class PlaceOldLabelSearchFacade(PlaceOldLabelFacade):
+    RESOURCE_LOADS = (
+        "place.commune.canton", "place.commune.region",
+        "place.localization_commune.canton", "place.localization_commune.region",
+        "place.descriptions"
+    )
+    RELATIONSHIP_LOADS = {}
+    EXPOSES_RELATIONSHIPS = False
 
     @property
     def resource(self):
@@ -203,7 +235,7 @@ class PlaceOldLabelSearchFacade(PlaceOldLabelFacade):
             "attributes": {
                 "place-id": self.obj.place.id,
                 "place-label": self.obj.place.label,
-                "place-desc": [d.resource["attributes"]["content"] for d in [PlaceDescriptionFacade("", e)
+                "place-desc": [d.resource["attributes"]["content"] for d in [PlaceDescriptionFacade("", e, False, False)
                                for e in self.obj.place.descriptions]],
                 "localization-insee-code": co.id if co else None,
                 "commune-label": co.NCCENR if co else None,
@@ -228,6 +260,10 @@ class PlaceOldLabelSearchFacade(PlaceOldLabelFacade):
 
 
 class PlaceOldLabelMapFacade(PlaceOldLabelSearchFacade):
+    RESOURCE_LOADS = (
+        "place.commune.departement", "place.commune.region",
+        "place.localization_commune.departement", "place.localization_commune.region"
+    )
 
     @property
     def resource(self):
@@ -252,6 +288,7 @@ class PlaceOldLabelMapFacade(PlaceOldLabelSearchFacade):
 
 
 class FlatPlaceOldLabelFacade(PlaceOldLabelFacade):
+    RESOURCE_LOADS = ("responsibility.bibl", "responsibility.user")
 
     @property
     def resource(self):
@@ -1,9 +1,39 @@
 import json
-from flask import Response
+from collections import OrderedDict
+from flask import Response, stream_with_context
+
+
+class JSONAPIIncludedResources(object):
+    """
+    Ordered collection of the resources to be included in a document.
+    Resources are unique by (type, id): adding an already included resource does nothing.
+    """
+
+    def __init__(self, resources=()):
+        self._resources = OrderedDict()
+        self.extend(resources)
+
+    def add(self, resource):
+        if resource is not None:
+            self._resources.setdefault((resource["type"], resource["id"]), resource)
+
+    def extend(self, resources):
+        for resource in resources:
+            self.add(resource)
+
+    def __contains__(self, resource):
+        return (resource["type"], resource["id"]) in self._resources
+
+    def __iter__(self):
+        return iter(self._resources.values())
+
+    def __len__(self):
+        return len(self._resources)
 
 
 class JSONAPIResponseFactory:
     CONTENT_TYPE = "application/vnd.api+json; charset=utf-8"
+    NDJSON_CONTENT_TYPE = "application/x-ndjson; charset=utf-8"
     HEADERS = {"Access-Control-Allow-Origin": "*",
                "Access-Control-Allow-Methods": ["GET", "POST", "DELETE", "PATCH"]}
 
@@ -20,7 +50,7 @@ class JSONAPIResponseFactory:
         if links is not None:
             document["links"] = links
         if included_resources is not None:
-            document["included"] = included_resources
+            document["included"] = list(included_resources)
         return document
 
     @classmethod
@@ -36,7 +66,7 @@ class JSONAPIResponseFactory:
         headers = kwargs.get("headers", {})
         headers.update(JSONAPIResponseFactory.HEADERS)
         content_type = kwargs.get("content_type", JSONAPIResponseFactory.CONTENT_TYPE)
-        raw = kwargs.get("raw")
+        raw = kwargs.pop("raw", False)
 
         if "headers" in kwargs:
             kwargs.pop("headers")
@@ -54,6 +84,56 @@ class JSONAPIResponseFactory:
         resource = JSONAPIResponseFactory.encapsulate_data(data_resource, links, included_resources, meta)
         return JSONAPIResponseFactory.make_response(resource, **kwargs)
 
+    @classmethod
+    def iter_encoded_document(cls, data_resources, links=None, included_resources=None, meta=None, indent=None):
+        """
+        Encode a data document piece by piece.
+        The data items are encoded as soon as the 'data_resources' iterable produces them. 'links', 'meta' and
+        'included_resources' may be callables: they are called once the data has been encoded so they can
+        depend on it (eg. the resources included by the data items).
+        :param indent: None for a compact output
+        """
+        separators = (',', ':') if indent is None else (',', ': ')
+        encoder = json.JSONEncoder(ensure_ascii=False, indent=indent, separators=separators)
+
+        def encode_list(key, items):
+            yield '"%s":[' % key
+            for i, item in enumerate(items):
+                yield ',' + encoder.encode(item) if i > 0 else encoder.encode(item)
+            yield ']'
+
+        yield '{'
+        yield from encode_list("data", data_resources)
+        yield ',"jsonapi":{"version":"1.0"}'
+        for key, value in (("meta", meta), ("links", links)):
+            value = value() if callable(value) else value
+            if value is not None:
+                yield ',"%s":%s' % (key, encoder.encode(value))
+        included_resources = included_resources() if callable(included_resources) else included_resources
+        if included_resources is not None:
+            yield ','
+            yield from encode_list("included", included_resources)
+        yield '}'
+
+    @classmethod
+    def iter_encoded_lines(cls, resources):
+        """
+        Encode each resource on its own line, with a compact encoding (NDJSON, aka JSON Lines).
+        The resources are encoded as soon as the 'resources' iterable produces them.
+        """
+        encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+        for resource in resources:
+            yield encoder.encode(resource) + '\n'
+
+    @classmethod
+    def make_streamed_data_response(cls, data_resources, links=None, included_resources=None, meta=None,
+                                    indent=None, **kwargs):
+        """
+        Make a response whose body is encoded while it is sent to the client (see iter_encoded_document)
+        """
+        body = JSONAPIResponseFactory.iter_encoded_document(data_resources, links, included_resources, meta, indent)
+        return JSONAPIResponseFactory.make_response(stream_with_context(body), raw=True, **kwargs)
+
     @classmethod
     def make_errors_response(cls, errors_resource, **kwargs):
         resource = JSONAPIResponseFactory.encapsulate_errors(errors_resource, kwargs.get("links", None))
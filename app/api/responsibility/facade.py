@@ -8,15 +8,20 @@ class ResponsibilityFacade(JSONAPIAbstractFacade):
     TYPE = "responsibility"
     TYPE_PLURAL = "responsibilities"
 
+    RELATIONSHIP_LOADS = {
+        "bibl": ("bibl",),
+        "user": ("user",),
+    }
+
     @property
     def id(self):
         return self.obj.id
 
     @staticmethod
-    def get_resource_facade(url_prefix, id, **kwargs):
+    def get_resource_facade(url_prefix, id, options=(), **kwargs):
         from app.models import Responsibility
 
-        e = Responsibility.query.filter(Responsibility.id == id).first()
+        e = Responsibility.query.options(*options).filter(Responsibility.id == id).first()
         if e is None:
             kwargs = {"status": 404}
             errors = [{"status": 404, "title": "Responsibility %s does not exist" % id}]
@@ -67,10 +72,13 @@ class ResponsibilityFacade(JSONAPIAbstractFacade):
                 "links": self._get_links(rel_name=rel_name),
                 "resource_identifier_getter": self.get_related_resource_identifiers(rel_facade, u_rel_name, to_many),
                 "resource_getter": self.get_related_resources(rel_facade, u_rel_name, to_many),
+                "count_getter": self.get_related_count(u_rel_name, to_many),
             }
 
 
 class FlatResponsibilityFacade(ResponsibilityFacade):
+    RESOURCE_LOADS = ("bibl", "user")
+    EXPOSES_RELATIONSHIPS = False
 
     @property
     def resource(self):
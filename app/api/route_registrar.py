@@ -1,5 +1,6 @@
 import pprint
 import time
+import datetime
 
 import json
 import urllib
@@ -8,14 +9,18 @@ import sys
 from math import ceil
 from collections import OrderedDict
 
-from flask import request, current_app
+from flask import request, current_app, stream_with_context
 
-from sqlalchemy import func, desc, asc, column, text
+from sqlalchemy import func, desc, asc, and_, or_, false, inspect
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import ColumnProperty
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.sql.operators import ColumnOperators
 
 from app import JSONAPIResponseFactory, api_bp, db
+from app.api.abstract_facade import JSONAPIIndexedFacade
 from app.api.facade_manager import JSONAPIFacadeManager
+from app.api.response_factory import JSONAPIIncludedResources
 from app.api.search import SearchIndexManager
 
 if sys.version_info < (3, 6):
@@ -42,6 +47,9 @@ class JSONAPIRouteRegistrar(object):
         self.models = dict([(cls.__tablename__, cls) for cls in db.Model._decl_class_registry.values()
                             if isinstance(cls, type) and issubclass(cls, db.Model)])
 
+        # (tablename, filters) -> (timestamp, total count) of the collections, in the order they were counted
+        self.count_cache = OrderedDict()
+
     @staticmethod
     def get_relationships_mode(args):
         if "without-relationships" in args:
@@ -59,9 +67,86 @@ class JSONAPIRouteRegistrar(object):
         return w_rel_links, w_rel_data
 
     @staticmethod
-    def get_included_resources(asked_relationships, facade_obj):
+    def get_streaming_mode(args):
+        """
+        ?stream streams a compact response, ?stream=pretty streams an indented one
+        :return: (streamed, indent)
+        """
+        if "stream" not in args:
+            return False, None
+        return True, 2 if args["stream"] == "pretty" else None
+
+    @staticmethod
+    def make_streamed_facades_response(facade_objs, links, meta, indent=None):
+        """
+        Stream the resources of the facades as soon as they are made.
+        The resources to be included are gathered along the way and sent after the data.
+        :param facade_objs: an iterable of facades
+        :param meta: the meta dict or a callable evaluated after the data has been sent
+        """
+        include = JSONAPIRouteRegistrar.get_include_parameter()
+        included_resources = JSONAPIIncludedResources()
+
+        def resources():
+            for facade_obj in facade_objs:
+                yield facade_obj.resource
+                if include:
+                    JSONAPIRouteRegistrar.get_included_resources(include, facade_obj, included_resources)
+
+        return JSONAPIResponseFactory.make_streamed_data_response(
+            resources(),
+            links=links,
+            included_resources=(lambda: included_resources) if include else None,
+            meta=meta,
+            indent=indent
+        )
+
+    @staticmethod
+    def get_export(exports):
+        """
+        ?export=format_name exports the resources in another format than JSON:API
+        :param exports: the export formats of the route: format name -> (facade class, export function)
+        :return: the (facade class, export function) of the asked format, None if no export is asked
+        """
+        if "export" not in request.args:
+            return None
+        if request.args["export"] not in exports:
+            raise ValueError("Export format unknown or unavailable. Available values are : %s" %
+                             ", ".join(exports.keys()))
+        return exports[request.args["export"]]
+
+    @staticmethod
+    def make_export_response(export_func, facade_objs):
+        """
+        Export the resources of the facades made from the objects already loaded by the route
+        :param export_func: a function (request, facade_objs) -> (output, status, headers, content type).
+                            The output is a JSON document, or an iterable of encoded chunks to be streamed
+        """
+        try:
+            output_data, status, headers, content_type = export_func(request, facade_objs)
+        except Exception as e:
+            return JSONAPIResponseFactory.make_errors_response(
+                {"status": 403, "title": "Forbidden", "detail": str(e)}, status=403
+            )
+        streamed = not isinstance(output_data, (dict, list))
+        return JSONAPIResponseFactory.make_response(
+            stream_with_context(output_data) if streamed else output_data,
+            raw=streamed,
+            status=status,
+            headers=headers,
+            content_type=content_type
+        )
+
+    @staticmethod
+    def get_included_resources(asked_relationships, facade_obj, included_resources=None):
+        """
+        Add the resources related to facade_obj through the asked relationships to included_resources
+        :param included_resources: the JSONAPIIncludedResources to fill, a new one if None
+        :return: (included_resources, errors)
+        """
         errors = []
-        included_resources = OrderedDict({})
+        if included_resources is None:
+            included_resources = JSONAPIIncludedResources()
 
         w_data, w_links = facade_obj.with_relationships_data, facade_obj.with_relationships_links
         facade_obj.with_relationships_data = False
@@ -83,28 +168,76 @@ class JSONAPIRouteRegistrar(object):
             try:
                 # try bring the related resources and add them to the list
                 related_resources = relationships[rel_name]["resource_getter"](asked_facade)
-                # make unique keys to avoid duplicates
+                # the accumulator avoids duplicates
                 if isinstance(related_resources, list):
-                    for related_resource in related_resources:
-                        unique_key = (related_resource["type"], related_resource["id"])
-                        included_resources[unique_key] = related_resource
+                    included_resources.extend(related_resources)
                 else:
                     # the resource is a single object
-                    if related_resources is not None:
-                        unique_key = (related_resources["type"], related_resources["id"])
-                        included_resources[unique_key] = related_resources
+                    included_resources.add(related_resources)
             except KeyError as e:
                 errors.append({"status": 403, "title": "Cannot include the relationship %s" % str(e)})
 
         facade_obj.with_relationships_data = w_data
         facade_obj.with_relationships_links = w_links
 
-        return list(included_resources.values()), None
+        return included_resources, None
+
+    def get_related_facades(self, facade_obj, rel_name, related_resources, include):
+        """
+        Make the facades of the related resources, to include their relationships.
+        The related objects loaded with facade_obj are used, the others are loaded with a query by facade class
+        :param related_resources: the resources of the relationship rel_name of facade_obj
+        :param include: the relationships to be included from the related resources
+        :return: (list of facades, errors)
+        """
+        loaded = {}
+        for path in facade_obj.RELATIONSHIP_LOADS.get(rel_name, ()):
+            for rel_obj in facade_obj.iter_loaded_objects(facade_obj.obj, path):
+                loaded[(type(rel_obj), str(rel_obj.id))] = rel_obj
+
+        f_classes = [JSONAPIFacadeManager.get_facade_class_from_facade_type(res["type"]) for res in related_resources]
+        f_models = [self.get_model_from_facade_class(f_class) for f_class in f_classes]
+        missing = OrderedDict()
+        for res, f_class, f_model in zip(related_resources, f_classes, f_models):
+            if f_model is not None and (f_model, str(res["id"])) not in loaded:
+                missing.setdefault((f_class, f_model), []).append(res["id"])
+        for (f_class, f_model), ids in missing.items():
+            options = f_class.get_loader_options(f_model, False, include)
+            for i in range(0, len(ids), 500):
+                for rel_obj in f_model.query.options(*options).filter(f_model.id.in_(ids[i:i + 500])).all():
+                    loaded[(f_model, str(rel_obj.id))] = rel_obj
+
+        facades = []
+        for res, f_class, f_model in zip(related_resources, f_classes, f_models):
+            rel_obj = loaded.get((f_model, str(res["id"])))
+            if rel_obj is not None:
+                facades.append(f_class(facade_obj.url_prefix, rel_obj, facade_obj.with_relationships_links,
+                                       facade_obj.with_relationships_data))
+                continue
+            f_obj, kwargs, errors = f_class.get_resource_facade(
+                facade_obj.url_prefix, res["id"],
+                with_relationships_links=facade_obj.with_relationships_links,
+                with_relationships_data=facade_obj.with_relationships_data
+            )
+            if f_obj is None:
+                return None, errors
+            facades.append(f_obj)
+        return facades, None
 
     @staticmethod
     def count(model):
         return db.session.query(func.count('*')).select_from(model).scalar()
 
+    def get_model_from_facade_class(self, facade_class):
+        for tablename, facades in JSONAPIFacadeManager.FACADES.items():
+            if tablename in self.models and facade_class in facades.values():
+                return self.models[tablename]
+        return None
+
+    @staticmethod
+    def get_include_parameter():
+        return request.args["include"].split(",") if "include" in request.args else []
+
     @staticmethod
     def make_url(url, args):
         url = url.replace("[", "%5B").replace("]", "%5D")
@@ -133,48 +266,62 @@ class JSONAPIRouteRegistrar(object):
                    for f in request.args.keys() if f.startswith('filter[') and f.endswith(']')]
         if len(filters) > 0:
             for filter_param, filter_fieldname in filters:
+                # filter[field][operator]
+                filter_fieldname, _, operator = filter_fieldname.partition('][')
                 filter_fieldname = filter_fieldname.replace("-", "_").replace('#', '')
 
                 not_null_operator = filter_fieldname.startswith("!")
                 if not_null_operator:
                     filter_fieldname = filter_fieldname[1:]
 
+                if filter_fieldname in ("bbox", "near"):
+                    filter_criteriae.append(JSONAPIRouteRegistrar.parse_location_filter(
+                        model, filter_fieldname, request.args[filter_param]
+                    ))
+                    continue
+
                 if not hasattr(model, filter_fieldname):
                     raise ValueError("cannot parse filter parameter '%s.%s'" % (model, filter_fieldname))
 
+                is_hybrid = isinstance(inspect(model).all_orm_descriptors.get(filter_fieldname), hybrid_property)
+                if is_hybrid and not operator:
+                    filter_criteriae.append(JSONAPIRouteRegistrar.make_property_criterion(
+                        getattr(model, filter_fieldname), request.args[filter_param], not_null_operator
+                    ))
+                    continue
+
+                # the other properties are evaluated on each object
                 if isinstance(getattr(model, filter_fieldname), property):
                     properties_fieldnames.append((filter_param, filter_fieldname, not_null_operator))
                     continue
 
+                field = getattr(model, filter_fieldname)
+                if not is_hybrid and not isinstance(getattr(field, "property", None), ColumnProperty):
+                    raise ValueError("cannot filter on the relationship '%s.%s'" % (model.__tablename__,
+                                                                                    filter_fieldname))
+
+                if operator:
+                    filter_criteriae.append(JSONAPIRouteRegistrar.make_operator_criterion(
+                        field, operator, request.args[filter_param]
+                    ))
+                    continue
+
                 for criteria in request.args[filter_param].split(','):
                     criteria_upper = criteria.upper()
                     if criteria_upper == 'TRUE' or criteria_upper == 'FALSE':
-                        new_criteria = "{table}.{field} is {criteria}".format(
-                            table=model.__tablename__,
-                            field=filter_fieldname,
-                            criteria=True if criteria_upper == 'TRUE' else False
-                        )
-                        #print(str(new_criteria))
+                        new_criteria = field.is_(criteria_upper == 'TRUE')
                     elif not not_null_operator:
                         if criteria:
                             # filter[field]=value
-                            new_criteria = "{table}.{field}{operator}'{criteria}'".format(
-                                table=model.__tablename__,
-                                field=filter_fieldname,
-                                operator="==",
-                                criteria=criteria
-                            )
+                            new_criteria = field == JSONAPIRouteRegistrar.coerce_filter_value(field, criteria)
                         else:
                             # filter[field] means IS NULL
-                            col = "{table}.{field}".format(table=model.__tablename__, field=filter_fieldname)
-                            new_criteria = column(col, is_literal=True).is_(None)
+                            new_criteria = field.is_(None)
                     else:
                         # filter[!field]  means IS NOT NULL
-                        col = "{table}.{field}".format(table=model.__tablename__, field=filter_fieldname)
-                        new_criteria = column(col, is_literal=True).isnot(None)
+                        new_criteria = field.isnot(None)
 
-                    print(str(new_criteria))
-                    filter_criteriae.append(text(str(new_criteria)))
+                    filter_criteriae.append(new_criteria)
 
             objs_query = objs_query.filter(*filter_criteriae)
 
@@ -206,24 +353,210 @@ class JSONAPIRouteRegistrar(object):
 
         return objs_query
 
+    # filter[field][operator]=value
+    FILTER_OPERATORS = {
+        # filter[field][in]=value1,value2
+        "in": lambda field, values: field.in_(values),
+        # filter[field][prefix]=value, a range of the values rather than a LIKE so that an index can answer it
+        "prefix": lambda field, values: and_(field >= values[0], field < values[0] + chr(0x10FFFF)),
+        "gt": lambda field, values: field > values[0],
+        "gte": lambda field, values: field >= values[0],
+        "lt": lambda field, values: field < values[0],
+        "lte": lambda field, values: field <= values[0],
+        # filter[field][between]=lower,upper (bounds included)
+        "between": lambda field, values: field.between(*values),
+    }
+
     @staticmethod
-    def parse_sort_parameter(objs_query, model):
-        # if request has sorting parameter
+    def coerce_filter_value(field, value):
+        """
+        :return: the value converted to the python type of the numeric fields
+        """
+        try:
+            python_type = field.type.python_type
+        except (AttributeError, NotImplementedError):
+            return value
+        if python_type in (int, float):
+            return python_type(value)
+        return value
+
+    @staticmethod
+    def make_operator_criterion(field, operator, value):
+        """
+        Make the criterion of filter[field][operator]=value, with bound parameters
+        """
+        if operator not in JSONAPIRouteRegistrar.FILTER_OPERATORS:
+            raise ValueError("unknown filter operator '%s', the operators are: %s" % (
+                operator, ", ".join(JSONAPIRouteRegistrar.FILTER_OPERATORS.keys())))
+        values = [JSONAPIRouteRegistrar.coerce_filter_value(field, v) for v in value.split(',')]
+        if operator == "between" and len(values) != 2:
+            raise ValueError("filter[...][between] expects two values: lower,upper")
+        if operator not in ("in", "between") and len(values) != 1:
+            raise ValueError("filter[...][%s] expects a single value" % operator)
+        if operator == "prefix" and not isinstance(values[0], str):
+            raise ValueError("filter[...][prefix] only applies to text fields")
+        return JSONAPIRouteRegistrar.FILTER_OPERATORS[operator](field, values)
+
+    @staticmethod
+    def make_property_criterion(expression, value, not_operator):
+        """
+        Make the SQL criterion of a filter on the expression of a hybrid property,
+        with the meaning of the filters on properties:
+        filter[prop] keeps the objects whose prop is truthy, filter[!prop] those whose prop is falsy,
+        and filter[prop]=value1,value2 those whose prop is one of the values
+        """
+        if not_operator:
+            return or_(expression.is_(None), expression == '')
+        elif value == '':
+            return and_(expression.isnot(None), expression != '')
+        else:
+            return expression.in_(value.split(','))
+
+    @staticmethod
+    def parse_location_filter(model, filter_name, value):
+        """
+        filter[bbox]=minlon,minlat,maxlon,maxlat keeps the resources located in the box
+        filter[near]=lon,lat,km keeps the resources located less than km kilometers away from (lon, lat)
+        Both are answered by the spatial index of the communes
+        """
+        from app.models import InseeCommune
+        if not hasattr(model, "located_in"):
+            raise ValueError("cannot filter '%s' by location" % model.__tablename__)
+
+        try:
+            numbers = [float(v) for v in value.split(',')]
+        except ValueError:
+            numbers = []
+
+        if filter_name == "bbox" and len(numbers) == 4:
+            insee_codes = InseeCommune.select_insee_codes_in_bbox(*numbers)
+        elif filter_name == "near" and len(numbers) == 3:
+            insee_codes = InseeCommune.select_insee_codes_near(*numbers)
+        else:
+            raise ValueError("cannot parse filter parameter 'filter[%s]=%s'" % (filter_name, value))
+
+        return model.located_in(insee_codes)
+
+    @staticmethod
+    def get_sort_criteriae(model):
+        """
+        :return: (the columns to sort by, asc or desc)
+        """
+        sort_criteriae = []
+        sort_order = asc
         if "sort" in request.args:
-            sort_criteriae = []
-            sort_order = asc
             for criteria in request.args["sort"].split(','):
                 if criteria.startswith('-'):
                     sort_order = desc
                     criteria = criteria[1:]
                 sort_criteriae.append(getattr(model, criteria.replace("-", "_")))
+        return sort_criteriae, sort_order
+
+    @staticmethod
+    def get_query_plan_headers(objs_query, duration):
+        """
+        :param duration: the seconds taken to filter and load the objects
+        :return: the X-Query-Plan header with the EXPLAIN QUERY PLAN of the query, if it was slow or asked
+        """
+        slow_query_time = current_app.config.get("SLOW_QUERY_TIME")
+        if not (slow_query_time and duration > float(slow_query_time)) and \
+                not ("explain" in request.args and current_app.debug):
+            return {}
+        compiled = objs_query.statement.compile(dialect=db.engine.dialect)
+        params = [compiled.params[name] for name in compiled.positiontup] if compiled.positional else compiled.params
+        plan = db.session.connection().execute("EXPLAIN QUERY PLAN %s" % compiled, params)
+        return {"X-Query-Plan": " | ".join(row[-1] for row in plan)}
+
+    @staticmethod
+    def parse_sort_parameter(objs_query, model):
+        # if request has sorting parameter
+        if "sort" in request.args:
+            sort_criteriae, sort_order = JSONAPIRouteRegistrar.get_sort_criteriae(model)
             print("sort criteriae: ", request.args["sort"], sort_criteriae)
             # reset the order clause
             objs_query = objs_query.order_by(False)
             # then apply the user order criteriae
-            objs_query = objs_query.order_by(sort_order(*sort_criteriae))
+            objs_query = objs_query.order_by(*[sort_order(c) for c in sort_criteriae])
         return objs_query
 
+    @staticmethod
+    def parse_after_parameter(objs_query, model):
+        """
+        Keyset pagination: page[after]=<id> starts the page right after the resource <id>
+        in the (sort criteriae, id) order. An empty page[after] starts from the beginning.
+        Unlike page[number], the cost of a page does not grow with its position.
+        """
+        sort_criteriae, sort_order = JSONAPIRouteRegistrar.get_sort_criteriae(model)
+        keys = sort_criteriae + [model.id]
+        objs_query = objs_query.order_by(False).order_by(*[sort_order(k) for k in keys])
+
+        after = request.args["page[after]"]
+        if not after:
+            return objs_query
+
+        if sort_criteriae:
+            last_obj = db.session.query(*sort_criteriae).filter(model.id == after).first()
+            if last_obj is None:
+                raise ValueError("cannot parse page[after] parameter: '%s' does not exist" % after)
+            values = list(last_obj) + [after]
+        else:
+            values = [after]
+
+        # (k1, k2, ...) > (v1, v2, ...) spelled out so that NULLs sort the way SQLite sorts them
+        # (first in ascending order, last in descending order)
+        conditions = []
+        for i, (key, value) in enumerate(zip(keys, values)):
+            previous_keys_equal = [k.is_(None) if v is None else k == v for k, v in zip(keys[:i], values[:i])]
+            if sort_order is asc:
+                after_value = key.isnot(None) if value is None else key > value
+            else:
+                after_value = false() if value is None else or_(key < value, key.is_(None))
+            conditions.append(and_(*previous_keys_equal, after_value))
+
+        return objs_query.filter(or_(*conditions))
+
+    # maximum number of counts kept in the cache
+    COUNT_CACHE_SIZE = 1000
+
+    def get_count(self, model, objs_query):
+        """
+        Count the filtered collection. The counts are kept COUNT_CACHE_TIMEOUT seconds if configured,
+        the oldest ones are dropped beyond COUNT_CACHE_SIZE
+        """
+        timeout = int(current_app.config.get("COUNT_CACHE_TIMEOUT") or 0)
+        if not timeout:
+            return objs_query.count()
+
+        # the counts are in the order they were made: the expired ones come first
+        now = time.time()
+        while self.count_cache and now - next(iter(self.count_cache.values()))[0] >= timeout:
+            self.count_cache.popitem(last=False)
+
+        key = (model.__tablename__,
+               tuple(sorted((k, v) for k, v in request.args.items(multi=True) if k.startswith('filter['))))
+        cached = self.count_cache.get(key)
+        if cached is not None:
+            return cached[1]
+
+        count = objs_query.count()
+        self.count_cache[key] = (now, count)
+        while len(self.count_cache) > self.COUNT_CACHE_SIZE:
+            self.count_cache.popitem(last=False)
+        return count
+
+    def clear_count_cache(self, *models):
+        tablenames = set(model.__tablename__ for model in models)
+        for key in [k for k in self.count_cache if k[0] in tablenames]:
+            del self.count_cache[key]
+
+    def clear_relationship_count_cache(self, model, rel_name):
+        """
+        Clear the counts of the resources on both sides of the relationship
+        """
+        relationship = getattr(model, rel_name.replace("-", "_"), None)
+        mapper = getattr(getattr(relationship, "property", None), "mapper", None)
+        self.clear_count_cache(model, *([mapper.class_] if mapper is not None else []))
+
     @staticmethod
     def parse_range_parameter():
         ranges = []
@@ -238,8 +571,17 @@ class JSONAPIRouteRegistrar(object):
         print("ranges params:", ranges)
         return ranges
 
-    def search(self, index, query, ranges, groupby, sort_criteriae, page_id, page_size, page_after):
+    def search(self, index, query, ranges, groupby, sort_criteriae, page_id, page_size, page_after,
+               index_only_facade=None):
+        """
+        :param index_only_facade: if set, return the indexed documents carrying the attributes
+                                  of this facade instead of the queries fetching the objects
+        """
         # query the search engine
+        if index_only_facade is None:
+            source = ("type",)
+        else:
+            source = ("type", "id", "facades.%s" % index_only_facade)
         results, buckets, after_key, total = SearchIndexManager.query_index(
             index=index,
             query=query,
@@ -248,19 +590,23 @@ class JSONAPIRouteRegistrar(object):
             sort_criteriae=sort_criteriae,
             page=page_id,
             after=page_after,
-            per_page=page_size
+            per_page=page_size,
+            source=source
         )
 
         if total == 0:
             return [], {}, {"total": 0}
 
         res_dict = {}
+        # (res_type, id) -> position in the search engine results
+        ranks = {}
         if groupby is None:
-            for res in results:
+            for rank, res in enumerate(results):
                 res_type = res.type.replace("-", "_")
                 if res_type not in res_dict:
                     res_dict[res_type] = []
-                res_dict[res_type].append(res.id)
+                res_dict[res_type].append(res.id if index_only_facade is None else res.source)
+                ranks[(res_type, str(res.id))] = rank
         else:
             # groupby mode
             print("[aggregation mode] fetching obj from ids")
@@ -271,7 +617,7 @@ class JSONAPIRouteRegistrar(object):
                 mapper_name = "default"
 
             res_dict[res_type] = []
-            for bucket in buckets:
+            for rank, bucket in enumerate(buckets):
                 # transform the id if needed
                 if res_type in JSONAPIFacadeManager.IDMapper:
                     mapper = JSONAPIFacadeManager.IDMapper[res_type]
@@ -280,24 +626,41 @@ class JSONAPIRouteRegistrar(object):
                 else:
                     mapper = lambda s: s
 
-                res_dict[res_type].append(mapper(bucket["key"]["item"]))
+                id = mapper(bucket["key"]["item"])
+                res_dict[res_type].append(id)
+                ranks[(res_type, str(id))] = rank
             print("ids fetched !")
 
+        if index_only_facade is not None:
+            return ranks, res_dict, {"total": total, "after": after_key}
+
         # build the query to get objects from their ids
+        # (they are put back in the search engine order afterwards, see sort_by_rank)
         for res_type, res_ids in res_dict.items():
-            when = []
-            for i, id in enumerate(res_ids):
-                when.append((id, i))
-
             m = self.models[res_type]
             res_dict[res_type] = db.session.query(m).filter(m.id.in_(res_ids))
-            if len(when) > 0:
-                res_dict[res_type] = res_dict[res_type].order_by(db.case(when, value=m.id))
 
         print({"total": total, "after": after_key})
-        return [r.id for r in results], res_dict, {"total": total, "after": after_key}
+        return ranks, res_dict, {"total": total, "after": after_key}
+
+    @staticmethod
+    def sort_by_rank(facade_objs, ranks):
+        """
+        Put the facades back in the search engine order
+        :param facade_objs: a list of (res_type, facade)
+        :param ranks: the (res_type, id) -> rank dict made by search()
+        :return: the sorted list of facades
+        """
+        sorted_facade_objs = [None] * len(ranks)
+        for res_type, f_obj in facade_objs:
+            sorted_facade_objs[ranks[(res_type, str(f_obj.id))]] = f_obj
+        return [f for f in sorted_facade_objs if f is not None]
 
-    def register_search_route(self, decorators=()):
+    def register_search_route(self, decorators=(), exports=None):
+        """
+        :param exports: the export formats of the searched resources: format name -> (facade class, export function)
+        """
+        exports = exports or {}
 
         search_rule = '/api/{api_version}/search'.format(api_version=self.api_version)
 
@@ -316,6 +679,23 @@ class JSONAPIRouteRegistrar(object):
             query = request.args["query"]
             ranges = JSONAPIRouteRegistrar.parse_range_parameter()
             groupby = request.args["groupby[field]"] if "groupby[field]" in request.args else None
+            facade_class_type = request.args["facade"] if "facade" in request.args else "search"
+
+            try:
+                export = JSONAPIRouteRegistrar.get_export(exports)
+            except ValueError as e:
+                return JSONAPIResponseFactory.make_errors_response(
+                    {"status": 400, "title": "Bad request", "detail": str(e)}, status=400
+                )
+
+            # make the resources from the indexed documents only
+            index_only = "index-only" in request.args
+            if index_only and (groupby is not None or "include" in request.args or "export" in request.args or
+                               any(f.startswith("filter[") for f in request.args.keys())):
+                return JSONAPIResponseFactory.make_errors_response({
+                    "status": 400,
+                    "title": "index-only searches cannot be grouped, filtered, exported nor include related resources"
+                }, status=400)
 
             # if request has pagination parameters
             # add links to the top-level object
@@ -343,7 +723,7 @@ class JSONAPIRouteRegistrar(object):
                     sort_criteriae.append({criteria: {"order": sort_order}})
 
             try:
-                sorted_ids_list, res, meta = self.search(
+                ranks, res, meta = self.search(
                     index=index,
                     query=query,
                     ranges=ranges,
@@ -351,7 +731,8 @@ class JSONAPIRouteRegistrar(object):
                     sort_criteriae=sort_criteriae,
                     page_id=num_page,
                     page_after=request.args["page[after]"] if "page[after]" in request.args else None,
-                    page_size=page_size
+                    page_size=page_size,
+                    index_only_facade=facade_class_type if index_only else None
                 )
             except Exception as e:
                 # raise e
@@ -406,8 +787,15 @@ class JSONAPIRouteRegistrar(object):
                 #            for c in sort_criteriae[criteria_table_name]:
                 #                res[criteria_table_name] = res[criteria_table_name].order_by(sort_order(c))
 
+                if export is not None:
+                    # only the resources of the exported type are exported, loaded with what the export reads
+                    export_type = export[0].TYPE.replace("-", "_")
+                    res = {idx: r.options(*export[0].get_loader_options(self.models[idx], False))
+                           for idx, r in res.items() if idx == export_type}
+
                 try:
-                    for idx in res.keys():
+                    # the index-only results are already there
+                    for idx in ([] if index_only else res.keys()):
                         res[idx] = res[idx].all()
                 except Exception as e:
                     print(e)
@@ -448,53 +836,76 @@ class JSONAPIRouteRegistrar(object):
 
                 # finally make the facades
                 facade_objs = []
-                sorted_facade_objs = [None] * len(sorted_ids_list)
-
                 for idx, r in res.items():
+                    if index_only:
+                        facade_class = JSONAPIFacadeManager.FACADES.get(idx, {}).get(facade_class_type)
+                        if facade_class is None or facade_class_type not in facade_class.INDEXED_FACADES:
+                            return JSONAPIResponseFactory.make_errors_response({
+                                "status": 400,
+                                "title": "The '%s' facade of %s cannot be made from the index" % (
+                                    facade_class_type, idx)
+                            }, status=400)
+                        try:
+                            indexed_facade_objs = [JSONAPIIndexedFacade(url_prefix, facade_class, facade_class_type,
+                                                                         source) for source in r]
+                        except KeyError as e:
+                            return JSONAPIResponseFactory.make_errors_response({
+                                "status": 400,
+                                "title": "The indexed documents lack the '%s' facade attributes, "
+                                         "the index must be rebuilt" % facade_class_type,
+                                "detail": str(e)
+                            }, status=400)
+                        facade_objs.extend((idx, f) for f in indexed_facade_objs)
+                        continue
+
                     for obj in r:
-                        facade_class_type = request.args["facade"] if "facade" in request.args else "search"
-                        facade_class = JSONAPIFacadeManager.get_facade_class(obj, facade_class_type)
+                        if export is not None:
+                            facade_class = export[0]
+                        else:
+                            facade_class = JSONAPIFacadeManager.get_facade_class(obj, facade_class_type)
                         f_obj = facade_class(url_prefix, obj, with_relationships_links=w_rel_links,
                                              with_relationships_data=w_rel_data)
-                        facade_objs.append(f_obj)
+                        facade_objs.append((idx, f_obj))
 
                 # reapply the initial sorts to the spread resources (because the order may have been split
                 # across different facades)
-                if groupby is None:
-                    #print([(i, o)for i, o in enumerate(sorted_ids_list)])
-                    #print([(i, o.id) for i, o in enumerate(facade_objs)])
-                    for f_obj in facade_objs:
-                        try:
-                            index = sorted_ids_list.index(str(f_obj.id))
-                            sorted_facade_objs[index] = f_obj
-                        except (ValueError, IndexError) as e:
-                            #print([o.id if o else None for o in sorted_facade_objs])
-                            #print("Not in list", index, f_obj.id, f_obj.obj.label)
-                            raise e
-
-                    sorted_facade_objs = [f for f in sorted_facade_objs if f is not None]
-                else:
-                    # TODO gerer le groupby quand pas sur le doctype ? à revérifier
-                    # l'agg côté ES gère déjà le tri multicritères
-                    sorted_facade_objs = facade_objs
+                sorted_facade_objs = JSONAPIRouteRegistrar.sort_by_rank(facade_objs, ranks)
+
+                if export is not None:
+                    return JSONAPIRouteRegistrar.make_export_response(export[1], sorted_facade_objs)
+
+                # stream the resources while the facades make them
+                streamed, indent = JSONAPIRouteRegistrar.get_streaming_mode(request.args)
+                if streamed:
+                    def get_meta():
+                        res_meta = {
+                            "total-count": meta["total"],
+                            "duration": float('%.4f' % (time.time() - start_time))
+                        }
+                        if "after" in meta:
+                            res_meta["after"] = meta["after"]
+                        return res_meta
+
+                    return JSONAPIRouteRegistrar.make_streamed_facades_response(
+                        sorted_facade_objs, links=links, meta=get_meta, indent=indent
+                    )
 
                 # find out if related resources must be included too
                 included_resources = None
                 if "include" in request.args:
-                    included_resources = []
+                    included_resources = JSONAPIIncludedResources()
                     for facade_obj in sorted_facade_objs:
-                        included_res, errors = JSONAPIRouteRegistrar.get_included_resources(
+                        included_resources, errors = JSONAPIRouteRegistrar.get_included_resources(
                             request.args["include"].split(','),
-                            facade_obj
+                            facade_obj,
+                            included_resources
                         )
                         if errors:
                             pass
                             # return errors
-                        # extend the included_res but avoid duplicates
-                        for _res in included_res:
-                            if (_res["type"], _res["id"]) not in [(r["type"], r["id"]) for r in included_resources]:
-                                included_resources.append(_res)
-                        # included_resources.extend(included_res)
+
+            if export is not None:
+                return JSONAPIRouteRegistrar.make_export_response(export[1], sorted_facade_objs)
 
             resources = [f.resource for f in sorted_facade_objs]
             res_meta = {
@@ -519,15 +930,126 @@ class JSONAPIRouteRegistrar(object):
         # register the rule
         api_bp.add_url_rule(search_rule, endpoint=search_endpoint.__name__, view_func=search_endpoint)
 
-    def register_get_routes(self, model, f_class, decorators=()):
+    def register_map_tiles_route(self, decorators=()):
+
+        tiles_rule = '/api/{api_version}/map/tiles/<int:z>/<int:x>/<int:y>'.format(api_version=self.api_version)
+
+        def map_tiles_endpoint(z, x, y):
+            """
+            Cluster the located search results in the web mercator tile z/x/y
+            Support the following parameters:
+            - query, index and range[...] as in the search endpoint (default query: *)
+            - precision: the zoom level of the cells, between z and z + 8 (default: z + 3)
+            Each non empty cell is a map-cell resource giving its document count and centroid
+            """
+            start_time = time.time()
+
+            index = request.args.get("index", None)
+            query = request.args.get("query", "*")
+            ranges = JSONAPIRouteRegistrar.parse_range_parameter()
+            try:
+                precision = int(request.args.get("precision", min(z + 3, 29)))
+            except ValueError as e:
+                return JSONAPIResponseFactory.make_errors_response(
+                    {"status": 400, "title": "Cannot parse the precision parameter", "detail": str(e)}, status=400
+                )
+
+            if not (0 <= z <= 29 and x < 2 ** z and y < 2 ** z):
+                return JSONAPIResponseFactory.make_errors_response(
+                    {"status": 400, "title": "Tile %s/%s/%s does not exist" % (z, x, y)}, status=400
+                )
+            if not (z <= precision <= min(z + SearchIndexManager.MAX_TILE_PRECISION_OFFSET, 29)):
+                return JSONAPIResponseFactory.make_errors_response({
+                    "status": 400,
+                    "title": "The precision must be between %s and %s" % (
+                        z, min(z + SearchIndexManager.MAX_TILE_PRECISION_OFFSET, 29))
+                }, status=400)
+
+            try:
+                cells, total = SearchIndexManager.aggregate_tile(index, query, z, x, y, precision, ranges)
+            except Exception as e:
+                return JSONAPIResponseFactory.make_errors_response({
+                    "status": 400,
+                    "title": "Cannot perform search operations",
+                    "details": str(e)
+                }, status=400)
+
+            resources = [{
+                "type": "map-cell",
+                "id": cell["key"],
+                "attributes": {
+                    "count": cell["count"],
+                    "centroid": cell["centroid"]
+                }
+            } for cell in cells]
+
+            return JSONAPIResponseFactory.make_data_response(
+                resources,
+                links={"self": JSONAPIRouteRegistrar.make_url(request.base_url, OrderedDict(request.args))},
+                included_resources=None,
+                meta={
+                    "total-count": total,
+                    "precision": precision,
+                    "bounds": SearchIndexManager.get_tile_bounds(z, x, y),
+                    "duration": float('%.4f' % (time.time() - start_time))
+                }
+            )
+
+        # APPLY decorators if any
+        for dec in decorators:
+            map_tiles_endpoint = dec(map_tiles_endpoint)
+
+        # register the rule
+        api_bp.add_url_rule(tiles_rule, endpoint=map_tiles_endpoint.__name__, view_func=map_tiles_endpoint)
+
+    def register_index_queue_route(self, decorators=()):
+
+        index_queue_rule = '/api/{api_version}/admin/index-queue'.format(api_version=self.api_version)
+
+        def index_queue_endpoint():
+            """
+            Report the index operations waiting in the outbox: an index-queue resource for each index,
+            with the number of operations, and the lag (seconds since the oldest operation) in the meta
+            """
+            depths, oldest = SearchIndexManager.get_outbox_status()
+            resources = [{
+                "type": "index-queue",
+                "id": index,
+                "attributes": {
+                    "depth": depth
+                }
+            } for index, depth in sorted(depths.items())]
+
+            return JSONAPIResponseFactory.make_data_response(
+                resources,
+                links={"self": request.base_url},
+                included_resources=None,
+                meta={
+                    "total-count": sum(depths.values()),
+                    "write-behind": bool(current_app.config.get("INDEX_WRITE_BEHIND")),
+                    "oldest": oldest.strftime("%Y-%m-%d %H:%M:%S") if oldest else None,
+                    "lag": (datetime.datetime.utcnow() - oldest).total_seconds() if oldest else 0
+                }
+            )
+
+        # APPLY decorators if any
+        for dec in decorators:
+            index_queue_endpoint = dec(index_queue_endpoint)
+
+        # register the rule
+        api_bp.add_url_rule(index_queue_rule, endpoint=index_queue_endpoint.__name__, view_func=index_queue_endpoint)
+
+    def register_get_routes(self, model, f_class, decorators=(), exports=None):
         """
 
         :param model:
         :param facade_class:
         :param obj_getter:
         :param facade_class:
+        :param exports: the export formats of the resources: format name -> (facade class, export function)
         :return:
         """
+        exports = exports or {}
 
         # ================================
         # Collection resource GET route
@@ -544,7 +1066,11 @@ class JSONAPIRouteRegistrar(object):
               filter[field_name]=searched_value
               filter[!field_name] means IS NOT NULL
               filter[field_name] means IS NULL
+              filter[field_name][operator]=value with the operators in, prefix, gt, gte, lt, lte and between
+              (eg. filter[dpt][in]=01,02 or filter[level][between]=2,3)
               field_name MUST be a mapped field of the underlying queried model
+              filter[bbox]=minlon,minlat,maxlon,maxlat and filter[near]=lon,lat,km filter places and communes
+              by location
             - Sorting syntax :
               The sort respects the fields order :
               model.field,model.field2,model.field3...
@@ -556,6 +1082,15 @@ class JSONAPIRouteRegistrar(object):
               If the page number is omitted, it is set to 1
               Provide self,first,last,prev,next links for the collection (top-level)
               Omit the prev link if the current page is the first one, omit the next link if it is the last one
+            - Keyset pagination syntax :
+              page[after]=resource_id&page[size]=100
+              Start the page right after the given resource, in the sort order (then the id order).
+              An empty page[after] starts from the first resource.
+              Provide self,first,next links: follow the next links to walk through a large collection
+              at a constant cost per page
+            - Total count :
+              ?without-count does not count the collection: the total-count meta and the last link are omitted
+              The counts are cached COUNT_CACHE_TIMEOUT seconds when this setting is defined
             - Related resource inclusion :
               ?include=relationname1,relationname2
             - Relationships inclusion
@@ -567,6 +1102,16 @@ class JSONAPIRouteRegistrar(object):
                 with-relationships=data retrieve both links and data
                 with-relationships=link only retrieve links
               By default, if without-relationships or with-relationships are not specified, you retrieve everything from the relationships
+            - Streaming
+              ?stream sends each resource as soon as it is made, with a compact encoding.
+              The links, meta and included sections are sent after the data.
+              ?stream=pretty indents the streamed document
+            - Query plan
+              The X-Query-Plan header gives the SQLite plan of the query when it takes more than
+              SLOW_QUERY_TIME seconds, or when ?explain is given in debug mode
+            - Export
+              ?export=format_name exports the page in one of the export formats of the route (eg. linkedplaces).
+              The export facade is made from the objects of the page, loaded with what the export reads
             Return a 400 Bad Request if something goes wrong with the syntax or
              if the sort/filter criteriae are incorrect
             """
@@ -580,7 +1125,17 @@ class JSONAPIRouteRegistrar(object):
             if "facade" in request.args:
                 facade_class = JSONAPIFacadeManager.get_facade_class(model, request.args["facade"])
 
+            try:
+                export = JSONAPIRouteRegistrar.get_export(exports)
+            except ValueError as e:
+                return JSONAPIResponseFactory.make_errors_response(
+                    {"status": 400, "title": "Bad request", "detail": str(e)}, status=400
+                )
+            if export is not None:
+                facade_class = export[0]
+
             objs_query = model.query
+            start_time = time.time()
             try:
 
                 # if request has pagination parameters
@@ -600,34 +1155,83 @@ class JSONAPIRouteRegistrar(object):
                 # SORT
                 objs_query = JSONAPIRouteRegistrar.parse_sort_parameter(objs_query, model)
 
-                pagination_obj = objs_query.paginate(num_page, page_size, False)
-                all_objs = pagination_obj.items
-                args = OrderedDict(request.args)
+                if "without-count" in request.args:
+                    count = None
+                else:
+                    count = self.get_count(model, objs_query)
 
-                count = objs_query.count()
-                nb_pages = max(1, ceil(count / page_size))
+                # should we retrieve relationships too ?
+                w_rel_links, w_rel_data = JSONAPIRouteRegistrar.get_relationships_mode(request.args)
+                if export is not None:
+                    w_rel_links, w_rel_data = False, False
+
+                # eager load what the facades are going to read
+                objs_query = objs_query.options(*facade_class.get_loader_options(
+                    model, w_rel_data, JSONAPIRouteRegistrar.get_include_parameter() if export is None else ()
+                ))
+
+                keyset = "page[after]" in request.args
+                if keyset:
+                    objs_query = JSONAPIRouteRegistrar.parse_after_parameter(objs_query, model)
+                    page_query = objs_query.limit(page_size)
+                else:
+                    # the total count is already known, do not let paginate() count again
+                    page_query = objs_query.limit(page_size).offset((num_page - 1) * page_size)
+                all_objs = page_query.all()
+                headers = JSONAPIRouteRegistrar.get_query_plan_headers(page_query, time.time() - start_time)
+                args = OrderedDict(request.args)
 
-                keep_pagination = "page[size]" in args or "page[number]" in args or count > page_size
-                if keep_pagination:
+                if keyset:
+                    args.pop("page[number]", None)
                     args["page[size]"] = page_size
-                links["self"] = JSONAPIRouteRegistrar.make_url(request.base_url, args)
-
-                if keep_pagination:
-                    args["page[number]"] = 1
+                    links["self"] = JSONAPIRouteRegistrar.make_url(request.base_url, args)
+                    args["page[after]"] = ""
                     links["first"] = JSONAPIRouteRegistrar.make_url(request.base_url, args)
-                    args["page[number]"] = nb_pages
-                    links["last"] = JSONAPIRouteRegistrar.make_url(request.base_url, args)
-                    if num_page > 1:
-                        n = max(1, num_page - 1)
-                        if n * page_size <= count:
-                            args["page[number]"] = max(1, num_page - 1)
-                            links["prev"] = JSONAPIRouteRegistrar.make_url(request.base_url, args)
-                    if num_page < nb_pages:
-                        args["page[number]"] = min(nb_pages, num_page + 1)
+                    if len(all_objs) == page_size:
+                        args["page[after]"] = all_objs[-1].id
                         links["next"] = JSONAPIRouteRegistrar.make_url(request.base_url, args)
+                else:
+                    has_next_page = len(all_objs) == page_size
+                    if count is not None:
+                        nb_pages = max(1, ceil(count / page_size))
+                        has_next_page = num_page < nb_pages
 
-                # should we retrieve relationships too ?
-                w_rel_links, w_rel_data = JSONAPIRouteRegistrar.get_relationships_mode(request.args)
+                    keep_pagination = "page[size]" in args or "page[number]" in args or has_next_page
+                    if keep_pagination:
+                        args["page[size]"] = page_size
+                    links["self"] = JSONAPIRouteRegistrar.make_url(request.base_url, args)
+
+                    if keep_pagination:
+                        args["page[number]"] = 1
+                        links["first"] = JSONAPIRouteRegistrar.make_url(request.base_url, args)
+                        if count is not None:
+                            args["page[number]"] = nb_pages
+                            links["last"] = JSONAPIRouteRegistrar.make_url(request.base_url, args)
+                        if num_page > 1:
+                            n = max(1, num_page - 1)
+                            if count is None or n * page_size <= count:
+                                args["page[number]"] = max(1, num_page - 1)
+                                links["prev"] = JSONAPIRouteRegistrar.make_url(request.base_url, args)
+                        if has_next_page:
+                            args["page[number]"] = num_page + 1
+                            links["next"] = JSONAPIRouteRegistrar.make_url(request.base_url, args)
+
+                meta = {"total-count": count} if count is not None else {}
+
+                if export is not None:
+                    return JSONAPIRouteRegistrar.make_export_response(
+                        export[1], [facade_class(url_prefix, obj, False, False) for obj in all_objs]
+                    )
+
+                # stream the resources while the facades make them
+                streamed, indent = JSONAPIRouteRegistrar.get_streaming_mode(request.args)
+                if streamed:
+                    return JSONAPIRouteRegistrar.make_streamed_facades_response(
+                        (facade_class(url_prefix, obj, w_rel_links, w_rel_data) for obj in all_objs),
+                        links=links,
+                        meta=meta,
+                        indent=indent
+                    )
 
                 # finally retrieve the (eventually filtered, sorted, paginated) resources
                 facade_objs = [facade_class(url_prefix, obj, w_rel_links, w_rel_data)
@@ -636,24 +1240,22 @@ class JSONAPIRouteRegistrar(object):
                 # find out if related resources must be included too
                 included_resources = None
                 if "include" in request.args:
-                    included_resources = []
+                    included_resources = JSONAPIIncludedResources()
                     for facade_obj in facade_objs:
-                        included_res, errors = JSONAPIRouteRegistrar.get_included_resources(
+                        included_resources, errors = JSONAPIRouteRegistrar.get_included_resources(
                             request.args["include"].split(','),
-                            facade_obj
+                            facade_obj,
+                            included_resources
                         )
                         if errors:
                             return errors
-                        # extend the included_res but avoid duplicates
-                        for _res in included_res:
-                            if (_res["type"], _res["id"]) not in [(r["type"], r["id"]) for r in included_resources]:
-                                included_resources.append(_res)
 
                 return JSONAPIResponseFactory.make_data_response(
                     [obj.resource for obj in facade_objs],
                     links=links,
                     included_resources=included_resources,
-                    meta={"total-count": count}
+                    meta=meta,
+                    headers=headers
                 )
 
             except (AttributeError, ValueError, OperationalError) as e:
@@ -703,14 +1305,31 @@ class JSONAPIRouteRegistrar(object):
 
             url_prefix = request.host_url[:-1] + self.url_prefix
 
+            try:
+                export = JSONAPIRouteRegistrar.get_export(exports)
+            except ValueError as e:
+                return JSONAPIResponseFactory.make_errors_response(
+                    {"status": 400, "title": "Bad request", "detail": str(e)}, status=400
+                )
+
             w_rel_links, w_rel_data = JSONAPIRouteRegistrar.get_relationships_mode(request.args)
-            f_obj, kwargs, errors = facade_class.get_resource_facade(url_prefix, id,
+            if export is not None:
+                w_rel_links, w_rel_data = False, False
+                options = export[0].get_loader_options(model, False)
+            else:
+                options = facade_class.get_loader_options(model, w_rel_data,
+                                                          JSONAPIRouteRegistrar.get_include_parameter())
+            f_obj, kwargs, errors = facade_class.get_resource_facade(url_prefix, id, options=options,
                                                                      with_relationships_links=w_rel_links,
                                                                      with_relationships_data=w_rel_data)
 
             print(facade_class, f_obj)
             if f_obj is None:
                 return JSONAPIResponseFactory.make_errors_response(errors, **kwargs)
+            elif export is not None:
+                return JSONAPIRouteRegistrar.make_export_response(
+                    export[1], [export[0](url_prefix, f_obj.obj, False, False)]
+                )
             else:
                 links = {
                     "self": request.url
@@ -739,6 +1358,37 @@ class JSONAPIRouteRegistrar(object):
         # register the rule
         api_bp.add_url_rule(single_obj_rule, endpoint=single_obj_endpoint.__name__, view_func=single_obj_endpoint)
 
+    @staticmethod
+    def get_relationship_page(facade_class):
+        """
+        :return: the (page number, page size) of the relationship pagination parameters
+        """
+        num_page = int(request.args.get('page[number]', 1))
+        page_size = min(
+            facade_class.ITEMS_PER_PAGE,
+            int(request.args.get('page[size]', facade_class.ITEMS_PER_PAGE))
+        )
+        return num_page, page_size
+
+    @staticmethod
+    def get_relationship_data(relationship, getter_name, facade_class):
+        """
+        Get the data of a relationship with one of its getters. If the request is paginated and the relationship
+        can be counted, only the requested page of the related objects is loaded
+        :return: (data, total count, True if data is only the requested page)
+        """
+        if ('page[number]' in request.args or 'page[size]' in request.args) and "count_getter" in relationship:
+            num_page, page_size = JSONAPIRouteRegistrar.get_relationship_page(facade_class)
+            data = relationship[getter_name](limit=page_size, offset=(num_page - 1) * page_size)
+            return data, relationship["count_getter"](), True
+
+        data = relationship[getter_name]()
+        if isinstance(data, list):
+            count = len(data)
+        else:
+            count = 1 if isinstance(data, dict) else 0
+        return data, count, False
+
     def register_relationship_get_route(self, facade_class, rel_name, decorators=()):
         """
         Supported request parameters :
@@ -761,31 +1411,35 @@ class JSONAPIRouteRegistrar(object):
             type_plural=facade_class.TYPE_PLURAL, rel_name=rel_name
         )
 
+        model = self.get_model_from_facade_class(facade_class)
+
         def resource_relationship_endpoint(id):
             url_prefix = request.host_url[:-1] + self.url_prefix
-            f_obj, kwargs, errors = facade_class.get_resource_facade(url_prefix, id)
+            paginated = 'page[number]' in request.args or 'page[size]' in request.args
+            # the identifiers only need the related objects, plus what the inclusions read.
+            # A page of the related objects is queried by the relationship getter
+            paths = [] if paginated else list(facade_class.RELATIONSHIP_LOADS.get(rel_name, ()))
+            paths.extend(facade_class.get_eager_loading_paths(model, False,
+                                                              JSONAPIRouteRegistrar.get_include_parameter()))
+            options = facade_class.make_loader_options(model, paths) if model else ()
+            f_obj, kwargs, errors = facade_class.get_resource_facade(url_prefix, id, options=options)
 
             if f_obj is None:
                 return JSONAPIResponseFactory.make_errors_response(errors, **kwargs)
             else:
                 relationship = f_obj.relationships[rel_name]
-                data = relationship["resource_identifier_getter"]()
-                if isinstance(data, list):
-                    count = len(data)
-                else:
-                    count = 1 if isinstance(data, dict) else 0
                 links = relationship["links"]
                 paginated_links = {}
 
                 try:
+                    data, count, paged = JSONAPIRouteRegistrar.get_relationship_data(
+                        relationship, "resource_identifier_getter", facade_class
+                    )
+
                     # if request has pagination parameters
                     # add links to the top-level object
-                    if 'page[number]' in request.args or 'page[size]' in request.args:
-                        num_page = int(request.args.get('page[number]', 1))
-                        page_size = min(
-                            facade_class.ITEMS_PER_PAGE,
-                            int(request.args.get('page[size]', facade_class.ITEMS_PER_PAGE))
-                        )
+                    if paginated:
+                        num_page, page_size = JSONAPIRouteRegistrar.get_relationship_page(facade_class)
 
                         args = OrderedDict(request.args)
                         nb_pages = max(1, ceil(count / page_size))
@@ -807,7 +1461,8 @@ class JSONAPIRouteRegistrar(object):
                             paginated_links["next"] = JSONAPIRouteRegistrar.make_url(request.base_url, args)
 
                         # perform the pagination
-                        data = data[(num_page - 1) * page_size:min(num_page * page_size, count)]
+                        if not paged:
+                            data = data[(num_page - 1) * page_size:min(num_page * page_size, count)]
                         links.update(paginated_links)
 
                     # try to include related resources if requested
@@ -864,35 +1519,34 @@ class JSONAPIRouteRegistrar(object):
             """
             url_prefix = request.host_url[:-1] + self.url_prefix
             w_rel_links, w_rel_data = JSONAPIRouteRegistrar.get_relationships_mode(request.args)
-            f_obj, kwargs, errors = facade_class.get_resource_facade(url_prefix, id,
+            paginated = 'page[number]' in request.args or 'page[size]' in request.args
+            # the related resources are made with the same relationships mode as the requested one.
+            # A page of the related objects is queried, with what they read, by the relationship getter
+            options = facade_class.make_loader_options(
+                model, facade_class.get_related_eager_loading_paths(
+                    model, rel_name, None, w_rel_data, JSONAPIRouteRegistrar.get_include_parameter()
+                )
+            ) if model and not paginated else ()
+            f_obj, kwargs, errors = facade_class.get_resource_facade(url_prefix, id, options=options,
                                                                      with_relationships_links=w_rel_links,
                                                                      with_relationships_data=w_rel_data)
             if f_obj is None:
                 return JSONAPIResponseFactory.make_errors_response(errors, **kwargs)
             else:
                 relationship = f_obj.relationships[rel_name]
-                resource_data = relationship["resource_getter"]()
-                if resource_data is None:
-                    count = 0
-                else:
-                    if isinstance(resource_data, dict):
-                        count = 1
-                    else:
-                        count = len(resource_data)
                 paginated_links = {}
                 links = {
                     "self": request.url
                 }
                 try:
+                    resource_data, count, paged = JSONAPIRouteRegistrar.get_relationship_data(
+                        relationship, "resource_getter", facade_class
+                    )
 
                     # if request has pagination parameters
                     # add links to the top-level object
-                    if 'page[number]' in request.args or 'page[size]' in request.args:
-                        num_page = int(request.args.get('page[number]', 1))
-                        page_size = min(
-                            facade_class.ITEMS_PER_PAGE,
-                            int(request.args.get('page[size]', facade_class.ITEMS_PER_PAGE))
-                        )
+                    if paginated:
+                        num_page, page_size = JSONAPIRouteRegistrar.get_relationship_page(facade_class)
 
                         args = OrderedDict(request.args)
                         nb_pages = max(1, ceil(count / page_size))
@@ -913,7 +1567,8 @@ class JSONAPIRouteRegistrar(object):
                             paginated_links["next"] = JSONAPIRouteRegistrar.make_url(request.base_url, args)
 
                         # perform the pagination
-                        resource_data = resource_data[(num_page - 1) * page_size:min(num_page * page_size, count)]
+                        if not paged:
+                            resource_data = resource_data[(num_page - 1) * page_size:min(num_page * page_size, count)]
                         links.update(paginated_links)
 
                     # try to include related resources if requested
@@ -921,22 +1576,22 @@ class JSONAPIRouteRegistrar(object):
 
                     # get the related resources to include
                     if "include" in request.args:
-                        included_resources = []
-                        for res in resource_data:
-                            f_class = JSONAPIFacadeManager.get_facade_class_from_facade_type(res["type"])
-                            f_obj, kwargs, errors = f_class.get_resource_facade(
-                                url_prefix, res["id"],
-                                with_relationships_links=w_rel_links,
-                                with_relationships_data=w_rel_data
-                            )
-                            i_resources, errors = JSONAPIRouteRegistrar.get_included_resources(
-                                request.args["include"].split(","),
-                                f_obj
+                        included_resources = JSONAPIIncludedResources()
+                        include = JSONAPIRouteRegistrar.get_include_parameter()
+                        if isinstance(resource_data, list):
+                            related_resources = resource_data
+                        else:
+                            related_resources = [resource_data] if resource_data else []
+                        related_facades, errors = self.get_related_facades(f_obj, rel_name, related_resources,
+                                                                           include)
+                        if errors:
+                            return JSONAPIResponseFactory.make_errors_response(errors, status=404)
+                        for related_facade in related_facades:
+                            included_resources, errors = JSONAPIRouteRegistrar.get_included_resources(
+                                include,
+                                related_facade,
+                                included_resources
                             )
-                            # extend the included_res but avoid duplicates
-                            for _res in i_resources:
-                                if (_res["type"], _res["id"]) not in [(r["type"], r["id"]) for r in included_resources]:
-                                    included_resources.append(_res)
                             if errors:
                                 return errors
                     # respond
@@ -1066,14 +1721,16 @@ class JSONAPIRouteRegistrar(object):
                 # =====================================
                 #  Create the resource from its facade
                 # =====================================
-                resource, e = facade_class.create_resource(model, obj_id, attributes, related_resources)
+                resource, e = facade_class.create_resource(model, obj_id, attributes, related_resources,
+                                                           commit=False)
                 if e is None:
                     url_prefix = request.host_url[:-1] + self.url_prefix
                     w_rel_links, w_rel_data = JSONAPIRouteRegistrar.get_relationships_mode(request.args)
                     f_obj = facade_class(url_prefix, resource, with_relationships_links=w_rel_links,
                                          with_relationships_data=w_rel_data)
 
-                    # reindex
+                    self.clear_count_cache(model)
+                    # reindex, the changes are committed along with the queued operations
                     f_obj.reindex("insert", propagate=True)
 
                     # RESPOND 201 CREATED
@@ -1145,14 +1802,16 @@ class JSONAPIRouteRegistrar(object):
                 # ==============================
                 model = self.models[facade_class.TYPE]
                 obj = model.query.filter(model.id == id).first()
-                resource, e = facade_class.update_resource(obj, facade_class.TYPE, {}, related_resources, append=True)
+                resource, e = facade_class.update_resource(obj, facade_class.TYPE, {}, related_resources, append=True,
+                                                           commit=False)
                 if e is None:
+                    self.clear_relationship_count_cache(model, rel_name)
                     url_prefix = request.host_url[:-1] + self.url_prefix
                     w_rel_links, w_rel_data = JSONAPIRouteRegistrar.get_relationships_mode(request.args)
                     f_obj = facade_class(url_prefix, resource, with_relationships_links=w_rel_links,
                                          with_relationships_data=w_rel_data)
 
-                    # reindex
+                    # reindex, the changes are committed along with the queued operations
                     f_obj.reindex("insert", propagate=True)
 
                     # RESPOND 200
@@ -1292,7 +1951,8 @@ class JSONAPIRouteRegistrar(object):
                 # =====================================
                 #  Update the resource from its facade
                 # =====================================
-                resource, e = facade_class.update_resource(obj, facade_class.TYPE, attributes, related_resources)
+                resource, e = facade_class.update_resource(obj, facade_class.TYPE, attributes, related_resources,
+                                                           commit=False)
 
                 if e is None:
                     url_prefix = request.host_url[:-1] + self.url_prefix
@@ -1300,7 +1960,8 @@ class JSONAPIRouteRegistrar(object):
                     f_obj = facade_class(url_prefix, resource, with_relationships_links=True,
                                          with_relationships_data=True)
 
-                    # reindex
+                    self.clear_count_cache(model)
+                    # reindex, the changes are committed along with the queued operations
                     f_obj.reindex("update", propagate=True)
 
                     # RESPOND 200
@@ -1379,14 +2040,16 @@ class JSONAPIRouteRegistrar(object):
                     return JSONAPIResponseFactory.make_errors_response(
                         {"status": 404, "title": "Resource %s does not exist" % id}, status=404
                     )
-                resource, e = facade_class.update_resource(obj, facade_class.TYPE, {}, related_resources, append=False)
+                resource, e = facade_class.update_resource(obj, facade_class.TYPE, {}, related_resources, append=False,
+                                                           commit=False)
                 if e is None:
+                    self.clear_relationship_count_cache(model, rel_name)
                     url_prefix = request.host_url[:-1] + self.url_prefix
 
                     f_obj = facade_class(url_prefix, resource, with_relationships_links=True,
                                          with_relationships_data=True)
 
-                    # reindex
+                    # reindex, the changes are committed along with the queued operations
                     f_obj.reindex("update", propagate=True)
 
                     # RESPOND 200
@@ -1445,13 +2108,21 @@ class JSONAPIRouteRegistrar(object):
             # Delete the resource
             # =====================
             f_obj = facade_class("", obj)
-            # reindex
-            f_obj.reindex("delete", propagate=True)
+            parent_facades = f_obj.get_parent_facades()
+            self.clear_count_cache(model)
+            # reindex, the queued operations are committed with the deletion
+            f_obj.reindex("delete", propagate=True, commit=False)
 
-            errors = facade_class.delete_resource(obj)
+            errors = facade_class.delete_resource(obj, commit=False)
             if errors is not None:
                 return JSONAPIResponseFactory.make_errors_response(errors, status=404)
 
+            # the documents made from the deleted object are rebuilt without it
+            for parent_facade in parent_facades:
+                db.session.expire(parent_facade.obj)
+                parent_facade.reindex("update", propagate=True, commit=False)
+            db.session.commit()
+
             return JSONAPIResponseFactory.make_data_response(None, None, None, None, status=204)
 
         # APPLY decorators if any
@@ -1523,10 +2194,12 @@ class JSONAPIRouteRegistrar(object):
             # ===============================
             # Delete the related resources
             # ===============================
-            errors = facade_class.delete_related_resources(f_obj.obj, related_resources)
+            errors = facade_class.delete_related_resources(f_obj.obj, related_resources, commit=False)
             if errors is not None:
                 return JSONAPIResponseFactory.make_errors_response(errors, status=404)
+            self.clear_relationship_count_cache(f_obj.obj.__class__, rel_name)
 
+            # the changes are committed along with the queued operations
             f_obj.reindex("update", propagate=True)
 
             return JSONAPIResponseFactory.make_data_response(None, None, None, None, status=204)
@@ -1,41 +1,68 @@
+import copy
 import elasticsearch
+import itertools
+import json
+import math
 import pprint
+import time
+from datetime import datetime
 from flask import current_app
 
+from app import db
+
 
 class SearchIndexManager(object):
 
+    # how long the deletes are remembered by a version being built
+    BUILDING_GC_DELETES = "7d"
+
+    # the geotile precision can be at most this much larger than the tile zoom level
+    MAX_TILE_PRECISION_OFFSET = 8
+    # the default search.max_buckets of elasticsearch
+    MAX_TILE_BUCKETS = 65535
+
     @staticmethod
-    def query_index(index, query, ranges=(), groupby=None, sort_criteriae=None, page=None, per_page=None, after=None):
+    def make_query(query, ranges=()):
+        """
+        Make the query of the search body from a query string and range criteriae
+        """
+        body_query = {
+            "bool": {
+                "must": [
+                    {
+                        "query_string": {
+                            "query": query,
+                            "default_operator": "AND"
+                        }
+                    }
+                ]
+            },
+        }
+        for range in ranges:
+            body_query["bool"]["must"].append({"range": range})
+        return body_query
+
+    @staticmethod
+    def query_index(index, query, ranges=(), groupby=None, sort_criteriae=None, page=None, per_page=None, after=None,
+                    source=("type",)):
+        """
+        :param source: the fields of the indexed documents to be returned along the hits
+        """
         if sort_criteriae is None:
             sort_criteriae = []
         if hasattr(current_app, 'elasticsearch'):
             body = {
-                "query": {
-                    "bool": {
-                        "must": [
-                            {
-                                "query_string": {
-                                    "query": query,
-                                    "default_operator": "AND"
-                                }
-                            }
-                        ]
-                    },
-                },
+                "query": SearchIndexManager.make_query(query, ranges),
                 "aggregations": {
 
                 },
                 "sort": [
                     #  {"creation": {"order": "desc"}}
                     *sort_criteriae
-                ]
+                ],
+                "_source": list(source)
             }
 
-            if len(ranges) > 0:
-                for range in ranges:
-                    body["query"]["bool"]["must"].append({"range": range})
-
             if groupby is not None:
                 body["aggregations"] = {
                     "items": {
@@ -97,10 +124,10 @@ class SearchIndexManager(object):
                 # scan = Elasticsearch.helpers.scan(client=current_app.elasticsearch, index=index, body=body)
 
                 from collections import namedtuple
-                Result = namedtuple("Result", "index id type score")
+                Result = namedtuple("Result", "index id type score source")
 
                 results = [Result(str(hit['_index']), str(hit['_id']), str(hit['_source']["type"]),
-                                  str(hit['_score']))
+                                  str(hit['_score']), hit['_source'])
                            for hit in search['hits']['hits']]
 
                 buckets = []
@@ -124,10 +151,320 @@ class SearchIndexManager(object):
             except Exception as e:
                 raise e
 
+    @staticmethod
+    def get_tile_bounds(z, x, y):
+        """
+        :return: the (west, south, east, north) coordinates of the web mercator tile z/x/y
+        """
+        n = 2 ** z
+
+        def lat(tile_y):
+            return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+        return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+    @staticmethod
+    def aggregate_tile(index, query, z, x, y, precision, ranges=()):
+        """
+        Cluster the located documents matching the query in the tile z/x/y
+        :param precision: the zoom level of the cells, from z to z + MAX_TILE_PRECISION_OFFSET
+        :return: (cells, total) where cells are dicts with the key, count and centroid of the non empty cells
+        """
+        west, south, east, north = SearchIndexManager.get_tile_bounds(z, x, y)
+        body_query = SearchIndexManager.make_query(query, ranges)
+        body_query["bool"]["filter"] = [{
+            "geo_bounding_box": {
+                "location": {
+                    "top_left": {"lat": north, "lon": west},
+                    "bottom_right": {"lat": south, "lon": east}
+                }
+            }
+        }]
+        body = {
+            "query": body_query,
+            "size": 0,
+            "track_total_hits": True,
+            "aggregations": {
+                "cells": {
+                    "geotile_grid": {
+                        "field": "location",
+                        "precision": precision,
+                        "size": min(4 ** (precision - z), SearchIndexManager.MAX_TILE_BUCKETS)
+                    },
+                    "aggregations": {
+                        "centroid": {
+                            "geo_centroid": {"field": "location"}
+                        }
+                    }
+                }
+            }
+        }
+
+        if index is None or len(index) == 0:
+            index = current_app.config["DEFAULT_INDEX_NAME"]
+
+        search = current_app.elasticsearch.search(index=index, body=body)
+
+        cells = [{"key": bucket["key"],
+                  "count": bucket["doc_count"],
+                  "centroid": bucket["centroid"]["location"]}
+                 for bucket in search["aggregations"]["cells"]["buckets"]]
+        return cells, search["hits"]["total"]["value"]
+
+    @staticmethod
+    def make_version():
+        """
+        The external version of the documents written while a version of an index is being built: the time
+        of the write in milliseconds, so that the rebuild, which reads the rows earlier, cannot overwrite
+        a newer document (the builder and the API must share the same clock)
+        """
+        return int(time.time() * 1000)
+
+    @staticmethod
+    def make_action(op, index, id, version=None):
+        action = {"_index": index, "_id": id}
+        if version is not None:
+            action.update({"version": version, "version_type": "external"})
+        return json.dumps({op: action})
+
+    @staticmethod
+    def make_bulk_lines(index, id, payload, version=None):
+        """
+        :param version: the external version of the document, if any
+        :return: the encoded bulk API lines indexing the payload
+        """
+        return "{0}\n{1}\n".format(
+            SearchIndexManager.make_action("index", index, id, version),
+            json.dumps(payload)
+        ).encode("utf-8")
+
+    @staticmethod
+    def iter_bulk_chunks(actions, max_chunk_bytes):
+        """
+        Group the bulk actions into request bodies of at most max_chunk_bytes
+        (unless a single action is larger)
+        :param actions: an iterable of (id, encoded bulk lines)
+        :return: a generator of (id of the last action, number of actions, body)
+        """
+        chunk, size, last_id = [], 0, None
+        for id, lines in actions:
+            if chunk and size + len(lines) > max_chunk_bytes:
+                yield last_id, len(chunk), b"".join(chunk)
+                chunk, size = [], 0
+            chunk.append(lines)
+            size += len(lines)
+            last_id = id
+        if chunk:
+            yield last_id, len(chunk), b"".join(chunk)
+
+    @staticmethod
+    def send_bulk(body, request_timeout=60 * 10):
+        """
+        Send a bulk API request body
+        :return: the list of (id, error) of the failed actions
+        """
+        return [(id, error) for id, error in SearchIndexManager.send_bulk_items(body, request_timeout)
+                if error is not None]
+
+    @staticmethod
+    def send_bulk_items(body, request_timeout=60 * 10):
+        """
+        Send a bulk API request body
+        The version conflicts are not errors: a newer version of the document is already indexed.
+        :return: the (id, error or None) of every action, in the order of the body
+        """
+        res = current_app.elasticsearch.bulk(body=body, request_timeout=request_timeout)
+        items = []
+        for item in res["items"]:
+            for op, result in item.items():
+                error = result.get("error")
+                if error is not None and error.get("type") == "version_conflict_engine_exception":
+                    error = None
+                items.append((result.get("_id"), error))
+        return items
+
+    @staticmethod
+    def get_building_alias(alias):
+        return "{0}__building".format(alias)
+
+    @staticmethod
+    def get_building_versions(alias):
+        """
+        :return: the versions of the index being built behind the alias, which the writes must also go to
+        """
+        try:
+            return sorted(current_app.elasticsearch.indices.get_alias(
+                name=SearchIndexManager.get_building_alias(alias)).keys())
+        except elasticsearch.exceptions.NotFoundError:
+            return []
+
+    @staticmethod
+    def create_index_version(alias, conf):
+        """
+        Create a new version of the index behind the alias, without replicas nor refreshes while it is filled.
+        Until it is published, the new version is also behind the building alias: the writes made through
+        the alias go to both versions, with external versions (see make_version). The deletes are remembered
+        for BUILDING_GC_DELETES, so that the rebuild cannot bring back a document removed after its row was read.
+        :param conf: the settings and mappings of the index
+        :return: the name of the new index
+        """
+        es = current_app.elasticsearch
+        index = "{0}__{1}".format(alias, datetime.utcnow().strftime("%Y%m%d%H%M%S"))
+        settings = copy.deepcopy(conf.get("settings", {}))
+        settings.setdefault("index", {}).update({"number_of_replicas": 0, "refresh_interval": "-1",
+                                                 "gc_deletes": SearchIndexManager.BUILDING_GC_DELETES})
+        es.indices.create(index=index, settings=settings, mappings=conf.get("mappings"))
+
+        # an abandoned rebuild does not receive the writes anymore
+        building_alias = SearchIndexManager.get_building_alias(alias)
+        actions = [{"add": {"index": index, "alias": building_alias}}]
+        actions.extend({"remove": {"index": abandoned, "alias": building_alias}}
+                       for abandoned in SearchIndexManager.get_building_versions(alias))
+        es.indices.update_aliases(actions=actions)
+        return index
+
+    @staticmethod
+    def publish_index_version(alias, index, conf, keep=1):
+        """
+        Restore the replicas and refreshes of the conf, then point the alias to the index in a single
+        atomic update. The versions older than the index are deleted, except the last keep ones.
+        """
+        es = current_app.elasticsearch
+        index_settings = conf.get("settings", {}).get("index", {})
+        replicas = index_settings.get("number_of_replicas", 1)
+        es.indices.put_settings(index=index, settings={"index": {
+            "number_of_replicas": replicas,
+            "refresh_interval": index_settings.get("refresh_interval", "1s"),
+            "gc_deletes": index_settings.get("gc_deletes", "60s")
+        }})
+        es.indices.refresh(index=index)
+        if replicas > 0:
+            es.cluster.health(index=index, wait_for_status="green", timeout="30m")
+
+        # the writes stop going to both versions when the alias is swapped
+        actions = [{"add": {"index": index, "alias": alias}},
+                   {"remove": {"index": index, "alias": SearchIndexManager.get_building_alias(alias),
+                               "must_exist": False}}]
+        if es.indices.exists_alias(name=alias):
+            actions.extend({"remove": {"index": current, "alias": alias}}
+                           for current in es.indices.get_alias(name=alias).keys() if current != index)
+        elif es.indices.exists(index=alias):
+            # an index made before the versions, the alias takes its name
+            actions.append({"remove_index": {"index": alias}})
+        es.indices.update_aliases(actions=actions)
+
+        older_versions = sorted(v for v in es.indices.get(index="{0}__*".format(alias)).keys() if v < index)
+        for version in older_versions[:max(0, len(older_versions) - keep)]:
+            es.indices.delete(index=version)
+
+    @staticmethod
+    def make_bulk_delete_lines(index, id, version=None):
+        """
+        :param version: the external version of the delete, if any
+        :return: the encoded bulk API line removing the document
+        """
+        return "{0}\n".format(SearchIndexManager.make_action("delete", index, id, version)).encode("utf-8")
+
+    @staticmethod
+    def enqueue(index, id, payload=None):
+        """
+        Add an index operation to the outbox, in the current transaction of the session
+        :param payload: the document to index, None to remove the document
+        """
+        from app.models import IndexOutbox
+        db.session.add(IndexOutbox(index_name=index, doc_id=str(id),
+                                   op="delete" if payload is None else "index",
+                                   payload=None if payload is None else json.dumps(payload)))
+
+    @staticmethod
+    def flush_outbox(batch_size=1000, max_chunk_bytes=10 * 1024 * 1024, max_attempts=5):
+        """
+        Send the oldest operations of the outbox with bulk requests, then remove them from the outbox.
+        Only the last operation of each document is sent, to the index and to its versions being built.
+        The operations are kept in the outbox if a request fails. The actions rejected by elasticsearch are kept
+        too, and dropped after max_attempts.
+        :return: (number of operations read, number of documents sent, list of (id, error) of the failed actions)
+        """
+        from app.models import IndexOutbox
+        rows = IndexOutbox.query.order_by(IndexOutbox.id).limit(batch_size).all()
+        if len(rows) == 0:
+            return 0, 0, []
+
+        last_ops = {}
+        for row in rows:
+            last_ops.pop((row.index_name, row.doc_id), None)
+            last_ops[(row.index_name, row.doc_id)] = row
+
+        building_versions = {index_name: SearchIndexManager.get_building_versions(index_name)
+                             for index_name in set(row.index_name for row in rows)}
+        version = SearchIndexManager.make_version()
+
+        def make_lines(row):
+            targets = [(row.index_name, None)] + [(v, version) for v in building_versions[row.index_name]]
+            if row.op == "delete":
+                return b"".join(SearchIndexManager.make_bulk_delete_lines(index, row.doc_id, v)
+                                for index, v in targets)
+            payload = json.loads(row.payload)
+            return b"".join(SearchIndexManager.make_bulk_lines(index, row.doc_id, payload, v)
+                            for index, v in targets)
+
+        sent_rows = list(last_ops.values())
+        actions = ((row.id, make_lines(row)) for row in sent_rows)
+        errors = []
+        # the errors give the concrete index of the documents, which may be a version behind an alias:
+        # the bulk items are matched with the rows by their position
+        failed = set()
+        position = 0
+        for last_id, count, body in SearchIndexManager.iter_bulk_chunks(actions, max_chunk_bytes):
+            items = iter(SearchIndexManager.send_bulk_items(body))
+            for row in sent_rows[position:position + count]:
+                # one item for the index, one for each of its versions being built
+                row_items = itertools.islice(items, 1 + len(building_versions[row.index_name]))
+                row_errors = [error for id, error in row_items if error is not None]
+                if row_errors:
+                    failed.add((row.index_name, row.doc_id))
+                    errors.append((row.doc_id, row_errors[0]))
+            position += count
+
+        kept_ids = set()
+        for row in sent_rows:
+            if (row.index_name, row.doc_id) in failed:
+                row.attempts += 1
+                if row.attempts < max_attempts:
+                    kept_ids.add(row.id)
+                else:
+                    print("WARNING: {0} {1} dropped from the outbox after {2} attempts".format(
+                        row.op, row.doc_id, row.attempts))
+
+        # the sent and superseded operations
+        done_ids = [row.id for row in rows if row.id not in kept_ids]
+        for i in range(0, len(done_ids), 500):
+            IndexOutbox.query.filter(IndexOutbox.id.in_(done_ids[i:i + 500])).delete(synchronize_session=False)
+        db.session.commit()
+        return len(rows), len(last_ops), errors
+
+    @staticmethod
+    def get_outbox_status():
+        """
+        :return: the number of operations waiting in the outbox, by index, and the date of the oldest one
+        """
+        from app.models import IndexOutbox
+        depths = dict(db.session.query(IndexOutbox.index_name, db.func.count(IndexOutbox.id))
+                      .group_by(IndexOutbox.index_name).all())
+        oldest = db.session.query(db.func.min(IndexOutbox.creation_date)).scalar()
+        return depths, oldest
+
     @staticmethod
     def add_to_index(index, id, payload):
         # print("ADD_TO_INDEX", index, id)
         current_app.elasticsearch.index(index=index, id=id, body=payload)
+        for building_version in SearchIndexManager.get_building_versions(index):
+            try:
+                current_app.elasticsearch.index(index=building_version, id=id, body=payload,
+                                                version=SearchIndexManager.make_version(), version_type="external")
+            except elasticsearch.exceptions.ConflictError:
+                # the rebuild has read a newer row
+                pass
 
     @staticmethod
     def remove_from_index(index, id):
@@ -136,6 +473,13 @@ class SearchIndexManager(object):
             current_app.elasticsearch.delete(index=index, id=id)
         except elasticsearch.exceptions.NotFoundError as e:
             print("WARNING: resource already removed from index:", str(e))
+        for building_version in SearchIndexManager.get_building_versions(index):
+            # the delete is remembered even if the rebuild has not indexed the document yet
+            try:
+                current_app.elasticsearch.delete(index=building_version, id=id,
+                                                 version=SearchIndexManager.make_version(), version_type="external")
+            except (elasticsearch.exceptions.NotFoundError, elasticsearch.exceptions.ConflictError):
+                pass
 
     # @staticmethod
     # def reindex_resources(changes):
@@ -8,15 +8,19 @@ class UserFacade(JSONAPIAbstractFacade):
     TYPE = "user"
     TYPE_PLURAL = "users"
 
+    RELATIONSHIP_LOADS = {
+        "responsibilities": ("responsibilities",),
+    }
+
     @property
     def id(self):
         return self.obj.id
 
     @staticmethod
-    def get_resource_facade(url_prefix, id, **kwargs):
+    def get_resource_facade(url_prefix, id, options=(), **kwargs):
         from app.models import User
 
-        e = User.query.filter(User.id == id).first()
+        e = User.query.options(*options).filter(User.id == id).first()
         if e is None:
             kwargs = {"status": 404}
             errors = [{"status": 404, "title": "User %s does not exist" % id}]
@@ -64,4 +68,5 @@ class UserFacade(JSONAPIAbstractFacade):
                 "links": self._get_links(rel_name=rel_name),
                 "resource_identifier_getter": self.get_related_resource_identifiers(rel_facade, u_rel_name, to_many),
                 "resource_getter": self.get_related_resources(rel_facade, u_rel_name, to_many),
+                "count_getter": self.get_related_count(u_rel_name, to_many),
             }
@@ -1,53 +1,594 @@
-from math import floor
+from math import floor, ceil
 from pprint import pprint
 from elasticsearch import Elasticsearch
-from elasticsearch.helpers import parallel_bulk
 
+import functools
+import gzip
+import multiprocessing
+import os
+import queue
+import sys
 import time
+import urllib.request
 import click
 import json
-import requests
-import sqlalchemy
 from elasticsearch import AuthorizationException
+from flask import current_app
 
-from jsonschema import validate
-from sqlalchemy import event, or_, not_
+from sqlalchemy import event, not_
 from sqlalchemy.engine import Engine
 
 from app import create_app
 
+from app.api.place.decorators.exports.linkedplaces import LinkedPlacesFeatureFacade, LPF_SCHEMA_PATH, \
+    LPF_SCHEMA_URL, check_lpf_schema, from_template, get_lpf_validator, get_validation_error_type
 from app.api.place.facade import PlaceFacade
 from app.api.place_old_label.facade import PlaceOldLabelFacade
-from app.models import Place, PlaceOldLabel, IdRegister,  PlaceComment, PlaceDescription, PlaceFeatureType
+from app.api.response_factory import JSONAPIResponseFactory
+from app.api.search import SearchIndexManager
+from app.models import Place, PlaceOldLabel, IdRegister,  PlaceComment, PlaceDescription, PlaceFeatureType, User
 
 app = None
 
 
-def load_elastic_conf(conf_name, index_name, delete=False):
-    url = '/'.join([app.config['ELASTICSEARCH_URL'], index_name])
-    res = None
+def read_elastic_conf(conf_name):
+    """
+    :return: the settings and mappings of the index, None if the index has no conf
+    """
+    try:
+        with open('elasticsearch/_settings.conf.json', 'r') as _settings:
+            settings = json.load(_settings)
+        with open('elasticsearch/%s.conf.json' % conf_name, 'r') as f:
+            conf = json.load(f)
+    except FileNotFoundError:
+        return None
+    conf["settings"] = settings
+    return conf
+
+
+def parse_between(between):
+    """
+    :param between: 'lower_bound' or 'lower_bound,upper_bound'
+    :return: (lower_bound, upper_bound), None for the missing bounds
+    """
+    if not between:
+        return None, None
+    boundaries = between.split(",")
+    if len(boundaries) == 1:
+        return boundaries[0], None
+    return boundaries[0], boundaries[1]
+
+
+def split_id_space(model, between, nb_slices, filters=()):
+    """
+    Split the ids of the objects between the bounds into nb_slices slices of the same size
+    :param filters: criteria on the objects, the slices only count the ids of the matching ones
+    :return: the 'first_id,last_id' bounds of the slices, in the --between format
+    """
+    from app import db
+    lower_bound, upper_bound = parse_between(between)
+    stmt = db.session.query(model.id).filter(*filters).order_by(model.id)
+    if lower_bound is not None:
+        stmt = stmt.filter(model.id >= lower_bound)
+    if upper_bound is not None:
+        stmt = stmt.filter(model.id <= upper_bound)
+
+    total = stmt.count()
+    slice_size = max(1, ceil(total / nb_slices))
+    slices = []
+    for offset in range(0, total, slice_size):
+        first_id = stmt.offset(offset).limit(1).scalar()
+        last_id = stmt.offset(min(offset + slice_size, total) - 1).limit(1).scalar()
+        slices.append("{0},{1}".format(first_id, last_id))
+    return slices
+
+
+def iter_index_actions(model, facade_class, prefix, index_name, lower_bound=None, upper_bound=None, after=None,
+                       batch_size=1000):
+    """
+    Make the bulk actions indexing the objects in the id order.
+    The objects are loaded batch_size rows at a time, with what their payloads read, then forgotten.
+    The documents are versioned with the time their batch is read, so that they do not overwrite the newer
+    documents written by the API in a version being built.
+    :param after: start after this id
+    :return: a generator of (id, encoded bulk lines)
+    """
+    from app import db
+    options = facade_class.get_index_loader_options(model)
+    while True:
+        version = SearchIndexManager.make_version()
+        stmt = model.query.options(*options).order_by(model.id)
+        if lower_bound is not None:
+            stmt = stmt.filter(model.id >= lower_bound)
+        if upper_bound is not None:
+            stmt = stmt.filter(model.id <= upper_bound)
+        if after is not None:
+            stmt = stmt.filter(model.id > after)
+
+        objs = stmt.limit(batch_size).all()
+        if len(objs) == 0:
+            return
+
+        for obj in objs:
+            yield obj.id, b"".join(
+                SearchIndexManager.make_bulk_lines(index_name, data["id"], data["payload"], version)
+                for data in facade_class(prefix, obj).get_data_to_index_when_added(False)
+            )
+
+        after = objs[-1].id
+        db.session.expunge_all()
+
+
+def read_checkpoint(path):
     try:
-        if delete:
-            res = requests.delete(url)
-            with open('elasticsearch/_settings.conf.json', 'r') as _settings:
-                settings = json.load(_settings)
-
-                with open('elasticsearch/%s.conf.json' % conf_name, 'r') as f:
-                    payload = json.load(f)
-                    payload["settings"] = settings
-                    print("PUT", url, payload)
-                    res = requests.put(url, json=payload)
-                    assert str(res.status_code).startswith("20")
-
-    except FileNotFoundError as e:
-        print("no conf...", flush=True, end=" ")
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_checkpoint(path, checkpoint):
+    # write then rename so that a crash never leaves a truncated checkpoint
+    with open(path + ".tmp", 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+
+def new_checkpoint(index_name, between):
+    return {"index": index_name, "between": between, "last-id": None, "count": 0, "errors": 0}
+
+
+def get_slice_checkpoint_path(checkpoint_path, num):
+    return checkpoint_path.replace(".checkpoint.json", ".{0}.checkpoint.json".format(num))
+
+
+def reindex_model(model, facade_class, prefix, index_name, checkpoint_path, checkpoint=None, between=None,
+                  batch_size=1000, max_chunk_bytes=10 * 1024 * 1024):
+    """
+    Stream the payloads of the objects to the index with bulk requests of at most max_chunk_bytes.
+    The id of the last object sent is saved in the checkpoint file after each request.
+    :param checkpoint: a checkpoint to continue from
+    :return: the stats of the reindex
+    """
+    lower_bound, upper_bound = parse_between(between)
+    if checkpoint is None:
+        checkpoint = new_checkpoint(index_name, between)
+    elif checkpoint["between"] != between:
+        raise ValueError("the checkpoint was made for --between {0}".format(checkpoint["between"]))
+
+    actions = iter_index_actions(model, facade_class, prefix, index_name, lower_bound, upper_bound,
+                                 after=checkpoint["last-id"], batch_size=batch_size)
+
+    for num, (last_id, count, body) in enumerate(SearchIndexManager.iter_bulk_chunks(actions, max_chunk_bytes)):
+        errors = SearchIndexManager.send_bulk(body)
+
+        checkpoint["last-id"] = last_id
+        checkpoint["count"] += count
+        checkpoint["errors"] += len(errors)
+        write_checkpoint(checkpoint_path, checkpoint)
+
+        print("chunk {0}: {1} documents ({2:.1f} MB) up to {3}, {4} errors".format(
+            num + 1, count, len(body) / (1024 * 1024), last_id, len(errors)), flush=True)
+        for id, error in errors[:5]:
+            print("  {0}: {1}".format(id, error))
+
+    checkpoint["done"] = True
+    write_checkpoint(checkpoint_path, checkpoint)
+    return checkpoint
+
+
+def build_slice_chunks(flask_app, chunks, num, make_chunks, slice_args):
+    """
+    Make the chunks of a slice in a worker process.
+    Put ('chunk', num, last_id, count, body) messages in the chunks queue, then ('done', num, ...)
+    or ('error', num, ..., message) at the end of the slice.
+    """
+    try:
+        with flask_app.app_context():
+            for last_id, count, body in make_chunks(slice_args):
+                chunks.put(("chunk", num, last_id, count, body))
+        chunks.put(("done", num, None, 0, None))
     except Exception as e:
-        print(res.text, str(e), flush=True, end=" ")
-        raise e
+        chunks.put(("error", num, None, 0, str(e)))
 
 
-def validateJSONSchema(schema, data):
-    validate(instance=data, schema=schema)
+def iter_chunks_in_parallel(make_chunks, slices):
+    """
+    Make the chunks of each slice in a worker process with its own database connection.
+    The chunks are given back to the current process as soon as they are made, so the slices are interleaved.
+    An exception is raised once all the workers are done if a slice failed.
+    :param make_chunks: a function (slice args) -> iterable of (last id, count, body), called in the workers
+    :param slices: the args of the slices by slice number
+    :return: a generator of (slice number, last id, count, body), with a body of None at the end of a slice
+    """
+    from app import db
+    # the forked workers must not share the connections of this process
+    db.session.remove()
+    db.engine.dispose()
+
+    context = multiprocessing.get_context("fork")
+    chunks = context.Queue(maxsize=2 * max(1, len(slices)))
+    processes = {
+        num: context.Process(target=build_slice_chunks,
+                             args=(current_app._get_current_object(), chunks, num, make_chunks, slice_args))
+        for num, slice_args in slices.items()
+    }
+    for process in processes.values():
+        process.start()
+
+    running = set(processes.keys())
+    failures = []
+    try:
+        while running:
+            try:
+                kind, num, last_id, count, body = chunks.get(timeout=1)
+            except queue.Empty:
+                # a worker exiting normally always sends its last message
+                for num in [num for num in running if processes[num].exitcode not in (None, 0)]:
+                    running.remove(num)
+                    failures.append("slice {0}: the worker exited with code {1}".format(
+                        num, processes[num].exitcode))
+                continue
+
+            if kind == "chunk":
+                yield num, last_id, count, body
+            else:
+                running.remove(num)
+                if kind == "error":
+                    failures.append("slice {0}: {1}".format(num, body))
+                else:
+                    yield num, None, 0, None
+    except BaseException:
+        for process in processes.values():
+            process.terminate()
+        raise
+    finally:
+        for process in processes.values():
+            process.join()
+
+    if failures:
+        raise Exception(", ".join(failures))
+
+
+def reindex_model_in_parallel(model, facade_class, prefix, index_name, checkpoint_path, workers, checkpoint=None,
+                              between=None, batch_size=1000, max_chunk_bytes=10 * 1024 * 1024):
+    """
+    Split the ids into as many slices as workers. Each slice is built by a worker process with its own
+    database connection and the bulk requests are all sent from the current process.
+    Each slice has its own checkpoint file, the checkpoint_path file keeps the slices.
+    :param checkpoint: a checkpoint to continue from, its slices are kept
+    :return: the stats of the reindex
+    """
+    if checkpoint is None:
+        checkpoint = {"index": index_name, "between": between, "slices": split_id_space(model, between, workers)}
+        write_checkpoint(checkpoint_path, checkpoint)
+    elif checkpoint["between"] != between:
+        raise ValueError("the checkpoint was made for --between {0}".format(checkpoint["between"]))
+
+    slice_checkpoints = []
+    for num, slice_between in enumerate(checkpoint["slices"]):
+        path = get_slice_checkpoint_path(checkpoint_path, num)
+        slice_checkpoints.append((path, read_checkpoint(path) or new_checkpoint(index_name, slice_between)))
+
+    def make_chunks(slice_checkpoint):
+        lower_bound, upper_bound = parse_between(slice_checkpoint["between"])
+        actions = iter_index_actions(model, facade_class, prefix, index_name, lower_bound, upper_bound,
+                                     after=slice_checkpoint["last-id"], batch_size=batch_size)
+        return SearchIndexManager.iter_bulk_chunks(actions, max_chunk_bytes)
+
+    slices = {num: slice_checkpoint for num, (path, slice_checkpoint) in enumerate(slice_checkpoints)
+              if not slice_checkpoint.get("done")}
+    for num, last_id, count, body in iter_chunks_in_parallel(make_chunks, slices):
+        path, slice_checkpoint = slice_checkpoints[num]
+        if body is None:
+            slice_checkpoint["done"] = True
+            write_checkpoint(path, slice_checkpoint)
+            continue
+
+        errors = SearchIndexManager.send_bulk(body)
+        slice_checkpoint["last-id"] = last_id
+        slice_checkpoint["count"] += count
+        slice_checkpoint["errors"] += len(errors)
+        write_checkpoint(path, slice_checkpoint)
+
+        print("slice {0}: {1} documents ({2:.1f} MB) up to {3}, {4} errors".format(
+            num, count, len(body) / (1024 * 1024), last_id, len(errors)), flush=True)
+        for id, error in errors[:5]:
+            print("  {0}: {1}".format(id, error))
+
+    checkpoint["count"] = sum(slice_checkpoint["count"] for path, slice_checkpoint in slice_checkpoints)
+    checkpoint["errors"] = sum(slice_checkpoint["errors"] for path, slice_checkpoint in slice_checkpoints)
+    checkpoint["done"] = True
+    write_checkpoint(checkpoint_path, checkpoint)
+    return checkpoint
+
+
+def iter_dump_chunks(prefix, lower_bound=None, upper_bound=None, dpts=None, batch_size=1000):
+    """
+    Encode the Linked Places features of the places in the id order, one compact feature per line.
+    The places are loaded batch_size rows at a time, with what their features read, then forgotten.
+    :param dpts: only dump the places of these departments
+    :return: a generator of (last id, count, encoded lines)
+    """
+    from app import db
+    options = LinkedPlacesFeatureFacade.get_loader_options(Place, False)
+    after = None
+    while True:
+        stmt = Place.query.options(*options).order_by(Place.id)
+        if lower_bound is not None:
+            stmt = stmt.filter(Place.id >= lower_bound)
+        if upper_bound is not None:
+            stmt = stmt.filter(Place.id <= upper_bound)
+        if dpts:
+            stmt = stmt.filter(Place.dpt.in_(dpts))
+        if after is not None:
+            stmt = stmt.filter(Place.id > after)
+
+        places = stmt.limit(batch_size).all()
+        if len(places) == 0:
+            return
+
+        lines = JSONAPIResponseFactory.iter_encoded_lines(
+            LinkedPlacesFeatureFacade(prefix, place).resource for place in places
+        )
+        yield places[-1].id, len(places), "".join(lines).encode("utf-8")
+
+        after = places[-1].id
+        db.session.expunge_all()
+
+
+def iter_dump_chunks_in_parallel(prefix, workers, between=None, dpts=None, batch_size=1000):
+    """
+    Split the ids of the dumped places into as many slices as workers. Each slice is loaded and encoded by
+    a worker process (see iter_chunks_in_parallel), so the slices are interleaved in the dump.
+    :return: a generator of (last id, count, encoded lines)
+    """
+    slices = split_id_space(Place, between, workers, filters=[Place.dpt.in_(dpts)] if dpts else ())
+
+    def make_chunks(slice_between):
+        lower_bound, upper_bound = parse_between(slice_between)
+        return iter_dump_chunks(prefix, lower_bound, upper_bound, dpts, batch_size)
+
+    for num, last_id, count, body in iter_chunks_in_parallel(make_chunks, dict(enumerate(slices))):
+        if body is not None:
+            yield last_id, count, body
+
+
+def get_dump_compression(path):
+    """
+    :return: the compression ('gz' or 'zst') given by the extension of the path, None if not compressed
+    """
+    extension = os.path.splitext(path)[1]
+    return extension[1:] if extension in (".gz", ".zst") else None
+
+
+def open_dump_file(path, compression=None):
+    """
+    :return: a binary file object compressing what is written
+    """
+    if compression == "gz":
+        return gzip.open(path, "wb")
+    if compression == "zst":
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("the zstandard package is required to write .zst files")
+        return zstandard.open(path, "wb")
+    return open(path, "wb")
+
+
+def write_dump(path, chunks, dump_format="ndjson"):
+    """
+    Write the chunks of encoded features as they come, with a constant memory use.
+    The dump is written to a temporary file, so that a failed dump never replaces the previous one.
+    :param dump_format: 'ndjson' for one feature per line, 'linkedplaces' for a FeatureCollection
+    :return: the number of features written
+    """
+    tmp_path = path + ".tmp"
+    head, tail = None, None
+    if dump_format == "linkedplaces":
+        collection = json.dumps(from_template('FeatureCollection.json'), ensure_ascii=False)
+        head, tail = collection.split('"features": []')
+
+    count = 0
+    try:
+        with open_dump_file(tmp_path, get_dump_compression(path)) as f:
+            if head is not None:
+                f.write((head + '"features": [\n').encode("utf-8"))
+            for last_id, chunk_count, body in chunks:
+                if head is not None:
+                    # the encoded features hold no newline, they are separated with commas instead
+                    body = (b",\n" if count else b"") + body.rstrip(b"\n").replace(b"\n", b",\n")
+                f.write(body)
+                count += chunk_count
+            if tail is not None:
+                f.write(("\n]" + tail + "\n").encode("utf-8"))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return count
+
+
+def get_id_batches(model, between, batch_size):
+    """
+    :return: the (first id, last id, count) of the batches of batch_size objects between the bounds
+    """
+    from app import db
+    lower_bound, upper_bound = parse_between(between)
+    stmt = db.session.query(model.id).order_by(model.id)
+    if lower_bound is not None:
+        stmt = stmt.filter(model.id >= lower_bound)
+    if upper_bound is not None:
+        stmt = stmt.filter(model.id <= upper_bound)
+    ids = [id for id, in stmt]
+    return [(ids[i], ids[min(i + batch_size, len(ids)) - 1], min(batch_size, len(ids) - i))
+            for i in range(0, len(ids), batch_size)]
+
+
+def validate_place_batch(batch, schema_path=LPF_SCHEMA_PATH):
+    """
+    Validate the Linked Places features of a batch of places (in the current process or in a worker of the pool,
+    which uses the app of the command line interface)
+    :param batch: the (first id, last id, count) of the batch
+    :return: (the number of places, a list of (place id, error type, message))
+    """
+    from app import db
+    validator = get_lpf_validator(schema_path)
+    first_id, last_id, _ = batch
+    with app.app_context():
+        places = Place.query.options(*LinkedPlacesFeatureFacade.get_loader_options(Place, False)) \
+            .filter(Place.id >= first_id, Place.id <= last_id).all()
+        failures = []
+        for place in places:
+            for error in validator.iter_errors(LinkedPlacesFeatureFacade("", place).resource):
+                failures.append((place.id, get_validation_error_type(error), error.message))
+        db.session.expunge_all()
+    return len(places), failures
+
+
+def register_place_ids(force=False):
+    """
+    Register the place ids as they are (primary value = secondary value = place id), in set-based statements.
+    The places already registered with their id as primary value are skipped (anti-join on the register).
+    With 'force', the entries whose primary or secondary value matches a place id are first reset to this id.
+    Nothing is committed.
+    :return: the number of (reset, inserted) entries
+    """
+    from app import db
+    matching_place_id = "COALESCE(" \
+                        "(SELECT p.place_id FROM place p WHERE p.place_id = id_register.secondary_value), " \
+                        "(SELECT p.place_id FROM place p WHERE p.place_id = id_register.primary_value))"
+    nb_reset = 0
+    if force:
+        nb_reset = db.session.execute(
+            "UPDATE id_register SET primary_value = {0}, secondary_value = {0} "
+            "WHERE {0} IS NOT NULL AND (secondary_value IS NULL OR primary_value != {0} "
+            "OR secondary_value != {0})".format(matching_place_id)
+        ).rowcount
+    nb_insert = db.session.execute(
+        "INSERT INTO id_register (primary_value, secondary_value) "
+        "SELECT p.place_id, p.place_id FROM place p "
+        "LEFT JOIN id_register r ON r.primary_value = p.place_id "
+        "WHERE r.primary_value IS NULL ORDER BY p.place_id"
+    ).rowcount
+    return nb_reset, nb_insert
+
+
+def select_unregistered_place_ids(force=False):
+    """
+    Select the ids of the places that are neither a primary nor a secondary value of the register (anti-joins on
+    the register). Unless 'force', the ids already in the new format are left apart.
+    :return: the unregistered ids and the number of ids left apart because they are in the new format
+    """
+    from app import db
+    unregistered = "FROM place p " \
+                   "LEFT JOIN id_register r ON r.primary_value = p.place_id " \
+                   "LEFT JOIN id_register s ON s.secondary_value = p.place_id " \
+                   "WHERE r.primary_value IS NULL AND s.primary_value IS NULL"
+    new_format = "substr(p.place_id, 1, length(:prefix)) = :prefix"
+    params = {"prefix": IdRegister.PREFIX}
+    if force:
+        nb_new_format = 0
+    else:
+        unregistered += " AND NOT " + new_format
+        nb_new_format = db.session.execute(
+            "SELECT COUNT(*) FROM place p WHERE {0} "
+            "AND NOT EXISTS (SELECT 1 FROM id_register r WHERE r.primary_value = p.place_id)".format(new_format),
+            params
+        ).scalar()
+    place_ids = [place_id for place_id, in db.session.execute(
+        "SELECT p.place_id {0} ORDER BY p.place_id".format(unregistered), params
+    )]
+    return place_ids, nb_new_format
+
+
+def update_app_ids():
+    """
+    Renumber the places with the ids of the register, in a few set-based statements per table.
+    The new ids are mapped to the place ids (the secondary values) in a temporary table, then each table
+    is updated with correlated subqueries on the mapping. When a place id was registered several times,
+    the first registered id is used, as the place is renumbered by the first entry. Nothing is committed.
+    :return: the number of updated rows, by table
+    """
+    from app import db
+    mapped = "SELECT old_id FROM id_mapping"
+    new_id = "(SELECT new_id FROM id_mapping WHERE old_id = {0}.place_id)"
+
+    db.session.execute("DROP TABLE IF EXISTS temp.id_mapping")
+    db.session.execute("CREATE TEMP TABLE id_mapping (old_id VARCHAR PRIMARY KEY, new_id VARCHAR NOT NULL)")
+    db.session.execute(
+        "INSERT INTO id_mapping (old_id, new_id) "
+        "SELECT r.secondary_value, r.primary_value FROM id_register r "
+        "JOIN place p ON p.place_id = r.secondary_value "
+        "WHERE r.primary_value != r.secondary_value AND r.rowid = ("
+        "  SELECT MIN(r2.rowid) FROM id_register r2 "
+        "  WHERE r2.secondary_value = r.secondary_value AND r2.primary_value != r2.secondary_value)"
+    )
+    counts = {"id_mapping": db.session.execute("SELECT COUNT(*) FROM id_mapping").scalar()}
+    print(f' --> app.update: {counts["id_mapping"]} ids from the register have a secondary value matching '
+          f'a place id', flush=True)
+
+    # the old labels are numbered in their id order, before their place id changes
+    counts[PlaceOldLabel.__tablename__] = db.session.execute(
+        "UPDATE place_old_label SET old_label_id = {0} || '-' || ("
+        "  SELECT COUNT(*) FROM place_old_label o "
+        "  WHERE o.place_id = place_old_label.place_id AND o.id <= place_old_label.id) "
+        "WHERE place_id IN ({1})".format(new_id.format("place_old_label"), mapped)
+    ).rowcount
+    print(f' --> app.update: {counts[PlaceOldLabel.__tablename__]} old label ids', flush=True)
+
+    for model in (PlaceOldLabel, PlaceFeatureType, PlaceComment, PlaceDescription, Place):
+        table = model.__tablename__
+        counts[table] = db.session.execute(
+            "UPDATE {0} SET place_id = {1} WHERE place_id IN ({2})".format(table, new_id.format(table), mapped)
+        ).rowcount
+        print(f' --> app.update: {table}: {counts[table]} rows', flush=True)
+
+    db.session.execute("DROP TABLE temp.id_mapping")
+    return counts
+
+
+def parse_dt(dt_id, data_dir):
+    """
+    Parse and normalize the articles of a DT, without any database access (so it can run in a worker process)
+    :return: (dt_id, places ready to be written, parse duration, error message or None)
+    """
+    # lxml is only needed to import the DTs
+    from db.utils import dt2db
+    start = time.time()
+    try:
+        places = [dt2db.parse_article(entry, dt_id, dpt)
+                  for dpt, entry in dt2db.iter_articles(dt2db.get_dt_path(dt_id, data_dir))]
+    except Exception as e:
+        return dt_id, None, time.time() - start, str(e)
+    return dt_id, places, time.time() - start, None
+
+
+def imap_unordered_bounded(pool, func, items, window):
+    """
+    Like pool.imap_unordered, but the next item is only submitted when a result is consumed:
+    at most window results wait in this process while the previous ones are handled
+    """
+    results = queue.Queue()
+    items = iter(items)
+    pending = 0
+    for item in items:
+        pool.apply_async(func, (item,), callback=results.put, error_callback=results.put)
+        pending += 1
+        if pending == window:
+            break
+    while pending:
+        result = results.get()
+        pending -= 1
+        for item in items:
+            pool.apply_async(func, (item,), callback=results.put, error_callback=results.put)
+            pending += 1
+            break
+        if isinstance(result, BaseException):
+            raise result
+        yield result
 
 
 def make_cli(given_app=None):
@@ -109,194 +650,325 @@ def make_cli(given_app=None):
 
     @click.command("db-validate")
     @click.option('--between', required=False)
-    def db_validate(between):
-        SCHEMA_URL = "https://raw.githubusercontent.com/kgeographer/whgazetteer/master/datasets/static/validate/lpf-schema.json"
-        getAPIUrl = lambda \
-                id: "http://localhost:5003/api/1.0/places/{0}?export=linkedplaces&without-relationships".format(id)
-        print("Fetching schema from {0}... ".format(SCHEMA_URL), end='', flush=False)
-        r = requests.get(SCHEMA_URL)
-        print(r.status_code)
-        schema = r.json()
-
+    @click.option('--schema', default=LPF_SCHEMA_PATH, help="JSON schema of the Linked Places features")
+    @click.option('--batch-size', default=1000, help="number of places validated at once")
+    @click.option('--workers', default=1, help="number of processes validating the places")
+    def db_validate(between, schema, batch_size, workers):
+        """
+        Validate the Linked Places features of the places against the LPF schema, without a running server.
+        The bundled schema is a hand-written subset of the upstream one: the validation is partial.
+        The failures are reported by error type.
+        """
+        from app import db
         with app.app_context():
+            start = time.time()
+            batches = get_id_batches(Place, between, batch_size)
+            validate_batch = functools.partial(validate_place_batch, schema_path=schema)
+
+            pool = None
+            if workers > 1:
+                # the forked workers must not share the connections of this process
+                db.session.remove()
+                db.engine.dispose()
+                pool = multiprocessing.get_context("fork").Pool(workers)
+                results = pool.imap_unordered(validate_batch, batches)
+            else:
+                results = map(validate_batch, batches)
 
-            stmt = Place.query
-            if between:
-                boundaries = between.split(",")
-                if len(boundaries) == 1:
-                    lower_bound = boundaries[0]
-                    stmt = stmt.filter(Place.id >= lower_bound)
-                else:
-                    lower_bound, upper_bound = boundaries
-                    bt_op = sqlalchemy.sql.expression.between
-                    stmt = stmt.filter(bt_op(Place.id, lower_bound, upper_bound))
-
-            for place in stmt.all():
-                print("validating '{0}'... ".format(place.id), end='', flush=False)
-                res_url = getAPIUrl(place.id)
-                r = requests.get(res_url)
-                data = r.json()
-                features = data.get('features', [])
-                print("{0} feature(s) detected... ".format(len(features)), end='', flush=False)
-
-                for feature in features:
-                    try:
-                        validateJSONSchema(schema, feature)
-                        print('OK', flush=True)
-                    except Exception as e:
-                        print(str(e))
-                        print(' .... NOT OK', flush=True)
-
-                        exit(1)
+            nb_places = 0
+            nb_total = sum(b[2] for b in batches)
+            # error type -> (count, first failure)
+            error_types = {}
+            invalid_ids = set()
+            try:
+                for count, failures in results:
+                    nb_places += count
+                    for id, error_type, message in failures:
+                        nb, example = error_types.get(error_type, (0, (id, message)))
+                        error_types[error_type] = (nb + 1, example)
+                        invalid_ids.add(id)
+                    print("{0}/{1} places validated, {2} not valid".format(
+                        nb_places, nb_total, len(invalid_ids)), flush=True)
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+
+        print("timer full ({0} workers): ".format(workers),
+              time.strftime("%H:%M:%S", time.gmtime((time.time() - start))))
+        print("{0} places validated, {1} not valid".format(nb_places, len(invalid_ids)))
+        for error_type, (nb, (id, message)) in sorted(error_types.items(), key=lambda e: -e[1][0]):
+            print("  {0} x {1} (eg. {2}: {3})".format(nb, error_type, id, message))
+        if invalid_ids:
+            print("NOT OK")
+            sys.exit(1)
+        print("OK")
+
+    @click.command("update-lpf-schema")
+    @click.option('--revision', required=True, help="commit of the linked-places-format repository to vendor")
+    @click.option('--schema', default=LPF_SCHEMA_PATH, help="where to write the schema")
+    def update_lpf_schema(revision, schema):
+        """
+        Vendor the Linked Places Format schema published upstream, unchanged, at the given revision.
+        Its source URL and revision are written next to it ({schema}.source).
+        """
+        url = LPF_SCHEMA_URL.format(revision=revision)
+        with urllib.request.urlopen(url, timeout=60) as response:
+            content = response.read()
+        check_lpf_schema(json.loads(content.decode("utf-8")))
+        with open(schema, 'wb') as f:
+            f.write(content)
+        with open(schema + ".source", 'w') as f:
+            f.write("{0}\nrevision: {1}\n".format(url, revision))
+        print("{0} written from {1}".format(schema, url))
+
+    @click.command("import-dt")
+    @click.option('--data-dir', required=True, help="directory of the DT sources ({data-dir}/DT01/output7.xml...)")
+    @click.option('--dt', required=False, help="comma separated ids of the DTs to import (default: the DTs with "
+                                               "INSEE codes)")
+    @click.option('--username', default="delisle", help="user responsible for the imported places (created if needed)")
+    @click.option('--batch-size', default=1000, help="number of articles inserted at once")
+    @click.option('--workers', default=1, help="number of processes parsing the DTs")
+    def import_dt(data_dir, dt, username, batch_size, workers):
+        """
+        Import DTs: the worker processes parse and normalize the DTs, a single writer inserts each DT
+        in its own transaction as soon as it is ready.
+        """
+        from app import db
+        from db.utils import dt2db
+        with app.app_context():
+            start = time.time()
+            dt_ids = dt.split(",") if dt else dt2db.DT_WITH_INSEE
+            user = User.query.filter(User.username == username).first()
+            if user is None:
+                user = User(username=username)
+                db.session.add(user)
+                db.session.commit()
+            user_id = user.id
+            parse = functools.partial(parse_dt, data_dir=data_dir)
+
+            pool = None
+            if workers > 1:
+                # the forked workers must not share the connections of this process
+                db.session.remove()
+                db.engine.dispose()
+                pool = multiprocessing.get_context("fork").Pool(workers)
+                # the parsed DTs wait for the writer: one per worker at most
+                results = imap_unordered_bounded(pool, parse, dt_ids, workers)
+            else:
+                results = map(parse, dt_ids)
+
+            connection = db.engine.raw_connection()
+            cursor = connection.cursor()
+            # the connection goes back to the pool with its previous setting
+            foreign_keys = cursor.execute("PRAGMA foreign_keys").fetchone()[0]
+            cursor.execute("PRAGMA foreign_keys=ON")
+            nb_places, nb_old_labels = 0, 0
+            failures = []
+            try:
+                for num, (dt_id, places, parse_duration, error) in enumerate(results):
+                    if error is None:
+                        write_start = time.time()
+                        try:
+                            counts = dt2db.write_dt(connection.connection, cursor, dt_id, user_id, places,
+                                                    batch_size)
+                        except Exception as e:
+                            error = str(e)
+                    if error is not None:
+                        failures.append(dt_id)
+                        print("[{0}/{1}] {2}: NOT OK {3}".format(num + 1, len(dt_ids), dt_id, error), flush=True)
+                        continue
+                    nb_places += counts[0]
+                    nb_old_labels += counts[1]
+                    print("[{0}/{1}] {2}: {3} places, {4} old labels | parsed in {5:.1f}s, written in {6:.1f}s".format(
+                        num + 1, len(dt_ids), dt_id, counts[0], counts[1], parse_duration, time.time() - write_start),
+                        flush=True)
+            finally:
+                cursor.execute("PRAGMA foreign_keys={0}".format("ON" if foreign_keys else "OFF"))
+                cursor.close()
+                connection.close()
+                if pool is not None:
+                    pool.close()
+                    pool.join()
+
+        print("timer full ({0} workers): ".format(workers),
+              time.strftime("%H:%M:%S", time.gmtime((time.time() - start))))
+        print("{0} DTs imported: {1} places, {2} old labels".format(len(dt_ids) - len(failures), nb_places,
+                                                                   nb_old_labels))
+        if failures:
+            print("NOT OK: {0}".format(",".join(failures)))
+            sys.exit(1)
+        print("OK")
 
     @click.command("db-reindex")
     @click.option('--indexes', default="all")
     @click.option('--host', required=True)
     @click.option('--between', required=False)
-    @click.option('--delete', required=False, default=None)
-    def db_reindex(indexes, host, between, delete):
+    @click.option('--resume', is_flag=True, default=False,
+                  help="continue the interrupted reindexes from their last checkpoint")
+    @click.option('--batch-size', default=1000, help="number of rows loaded from the database at once")
+    @click.option('--chunk-size', default=10.0, help="maximum size of the bulk requests (MB)")
+    @click.option('--checkpoint-dir', default=".", help="directory of the checkpoint files")
+    @click.option('--workers', default=1, help="number of processes building the documents")
+    @click.option('--keep-versions', default=1, help="number of previous index versions kept after a rebuild")
+    def db_reindex(indexes, host, between, resume, batch_size, chunk_size, checkpoint_dir, workers, keep_versions):
         """
-        Rebuild the elasticsearch indexes from the current database
+        Rebuild the elasticsearch indexes from the current database.
+        The indexes are aliases: a complete rebuild fills a new version of the index while the current one
+        is still searched, then the alias is moved to it. Partial reindexes (--between, or some of the
+        indexes sharing an alias) write in the current version.
         """
-        print(indexes, host, between, delete)
+        print(indexes, host, between)
         indexes_info = {
-            "places": {"facade": PlaceFacade, "model": Place, "reload-conf": True},
-            "old-labels": {"facade": PlaceOldLabelFacade, "model": PlaceOldLabel, "reload-conf": False},
+            "places": {"facade": PlaceFacade, "model": Place, "conf": "places"},
+            "old-labels": {"facade": PlaceOldLabelFacade, "model": PlaceOldLabel, "conf": None},
         }
 
-        def reindex_from_info(name, info):
-
-            with app.app_context():
-
-                prefix = "{host}{api_prefix}".format(host=host, api_prefix=app.config.get("API_URL_PREFIX", ""))
-                print("Reindexing %s" % name, end=" ", flush=True)
-
-                index_name = info["facade"].get_index_name()
-
-                url = "/".join([app.config['ELASTICSEARCH_URL'], index_name, '_settings'])
-
-                def reset_readonly():
-                    r = requests.put(url, json={"index.blocks.read_only_allow_delete": None})
-                    assert (r.status_code == 200)
-
-                try:
-                    if info["reload-conf"]:
-                        load_elastic_conf(name, index_name, delete=delete is not None)
-
-                    stmt = info["model"].query
+        def reindex_from_info(name, info, alias, index_name):
+            """
+            :return: True if every object has been sent
+            """
+            prefix = "{host}{api_prefix}".format(host=host, api_prefix=app.config.get("API_URL_PREFIX", ""))
+            print("Reindexing %s into %s" % (name, index_name), flush=True)
+            checkpoint_path = os.path.join(checkpoint_dir, "{0}.{1}.checkpoint.json".format(alias, name))
 
-                    if between:
-                        print("with between")
-                        boundaries = between.split(",")
-                        if len(boundaries) == 1:
-                            lower_bound = boundaries[0]
-                            stmt = stmt.filter(info["model"].id >= lower_bound)
-                        else:
-                            lower_bound, upper_bound = boundaries
-                            bt_op = sqlalchemy.sql.expression.between
-                            stmt = stmt.filter(bt_op(info["model"].id, lower_bound, upper_bound))
-
-                    all_objs = stmt.all()
-                    count = len(all_objs)
-                    print("(%s items)" % count, end=" ", flush=True)
-
-                    bulk_body = []
-                    start_facade = time.time()
-
-                    is_creation = 'index'
-
-                    if is_creation == 'index':
-                        for obj in all_objs:
-                            # REINDEX
-                            f_obj = info["facade"](prefix, obj)
-                            #bulk create mode
-                            bulk_body.append("\n".join(
-                                [json.dumps({"index": {"_index": index_name, "_id": obj.id}}),
-                                 json.dumps(f_obj.get_data_to_index_when_added(False)[0]["payload"])]))
-                    elif is_creation == 'update':
-                        for obj in all_objs:
-                            # REINDEX
-                            f_obj = info["facade"](prefix, obj)
-                            # bulk update mode (to be used in test mode only as reindex is meant to create, not update)
-                            bulk_body.append("\n".join([json.dumps({"update": {"_index": index_name, "_id": obj.id}}), json.dumps({"doc": f_obj.get_data_to_index_when_added(False)[0]["payload"]})]))
-
-                    elif is_creation == 'delete':
-                        for obj in all_objs:
-                            #bulk delete mode (to be used in test mode only as reindex is meant to create, not delete)
-                            bulk_body.append(json.dumps({"delete": {"_index": index_name, "_id": obj.id}}))
-
-
-                    #print("bulk_body", bulk_body)
-                    print("\ntimer build facade objects : ", time.strftime("%H:%M:%S", time.gmtime((time.time() - start_facade))))
-
-                    #Split the index data in chunks
-                    def split_list(lst, chunk_size):
-                        return [lst[i:i + chunk_size] for i in range(0, len(lst), chunk_size)]
-
-                    actions_chunks = split_list(bulk_body, 50000)
-
-                    es = app.elasticsearch
-                    start_es = time.time()
-
-                    for chunk in actions_chunks:
-                        res = es.bulk(body=chunk, request_timeout=60*10)
-                        #print(res)
-
-                    """
-                    #Test with parallel_bulk : SLOWER !!!
-                    def generate_actions(data):
-                        actions = []
-                        if is_creation == 'index':
-                            for obj in data:
-                                action = {
-                                    '_op_type': 'index',
-                                    '_index': index_name,
-                                    "_id": obj.id,
-                                    '_source': json.dumps(info["facade"](prefix, obj).get_data_to_index_when_added(False)[0]["payload"])
-                                }
-                                actions.append(action)
-                            return actions
-                        else:
-                            for obj in data:
-                                action = {
-                                    '_op_type': 'delete',
-                                    '_index': index_name,
-                                    "_id": obj.id,
-                                }
-                                actions.append(action)
-                            return actions
-                    
-                    # no security enabled (dev):
-                    es = Elasticsearch("http://localhost:9200")
-                    # security enabled (prod):
-                    # es = Elasticsearch("http://localhost:9200", basic_auth=("elastic","ES8KEY"))
-                    start_es = time.time()
-                    
-                    for success, info in parallel_bulk(client=es, chunk_size=1000, actions=generate_actions(all_objs)):
-                        if not success:
-                            print("Insert failed: ", info)
-                    """
-
-                    print("\ntimer ES : ", time.strftime("%H:%M:%S", time.gmtime((time.time() - start_es))))
-                    print("\ntimer full : ", time.strftime("%H:%M:%S", time.gmtime((time.time() - start_facade))))
-
-                    print("OK")
-                except Exception as e:
-                    print("NOT OK!  ", str(e))
+            try:
+                checkpoint = read_checkpoint(checkpoint_path) if resume else None
+                if checkpoint is not None and checkpoint.get("done"):
+                    print("already done")
+                    return True
+
+                start = time.time()
+                # a resumed reindex keeps the slices it started with
+                if (checkpoint is None and workers > 1) or (checkpoint is not None and "slices" in checkpoint):
+                    stats = reindex_model_in_parallel(info["model"], info["facade"], prefix, index_name,
+                                                      checkpoint_path, workers, checkpoint=checkpoint,
+                                                      between=between, batch_size=batch_size,
+                                                      max_chunk_bytes=chunk_size * 1024 * 1024)
+                else:
+                    stats = reindex_model(info["model"], info["facade"], prefix, index_name, checkpoint_path,
+                                          checkpoint=checkpoint, between=between, batch_size=batch_size,
+                                          max_chunk_bytes=chunk_size * 1024 * 1024)
+
+                print("timer full ({0} workers): ".format(workers),
+                      time.strftime("%H:%M:%S", time.gmtime((time.time() - start))))
+                print("{0} documents indexed, {1} errors".format(stats["count"], stats["errors"]))
+                print("OK" if stats["errors"] == 0 else "NOT OK!")
+                return True
+            except Exception as e:
+                print("NOT OK!  ", str(e))
+                print("run the command again with --resume to continue from the last checkpoint")
+                return False
 
         if indexes == "all":  # reindex every index configured above
             indexes = ",".join(indexes_info.keys())
 
+        names = []
         for name in indexes.split(","):
             if name in indexes_info:
-                reindex_from_info(name, indexes_info[name])
+                names.append(name)
             else:
                 print("Warning: index %s does not exist or is not declared in the cli" % name)
 
+        with app.app_context():
+            aliases = {name: info["facade"].get_index_name() for name, info in indexes_info.items()}
+
+            for alias in sorted(set(aliases[name] for name in names)):
+                sharing_names = [name for name in indexes_info if aliases[name] == alias]
+                confs = [indexes_info[name]["conf"] for name in sharing_names if indexes_info[name]["conf"]]
+                conf = read_elastic_conf(confs[0]) if confs else None
+                rebuild = between is None and conf is not None and all(name in names for name in sharing_names)
+
+                index_name = alias
+                if rebuild:
+                    # a resumed rebuild continues to fill the version it started
+                    checkpoints = [read_checkpoint(os.path.join(checkpoint_dir, "{0}.{1}.checkpoint.json".format(
+                        alias, name))) if resume else None for name in sharing_names]
+                    versions = [checkpoint["index"] for checkpoint in checkpoints
+                                if checkpoint is not None and checkpoint["index"] != alias]
+                    if versions:
+                        index_name = versions[0]
+                    else:
+                        index_name = SearchIndexManager.create_index_version(alias, conf)
+                        print("Building %s" % index_name, flush=True)
+
+                sent = [reindex_from_info(name, indexes_info[name], alias, index_name)
+                        for name in sharing_names if name in names]
+
+                if rebuild and all(sent):
+                    SearchIndexManager.publish_index_version(alias, index_name, conf, keep=keep_versions)
+                    print("%s now points to %s" % (alias, index_name), flush=True)
+
+    @click.command("export-dump")
+    @click.option('--output', required=True, help="path of the dump file, compressed if it ends with .gz or .zst")
+    @click.option('--format', 'dump_format', default="ndjson", type=click.Choice(["ndjson", "linkedplaces"]),
+                  help="ndjson writes one feature per line, linkedplaces a FeatureCollection")
+    @click.option('--host', default="", help="host of the links of the features")
+    @click.option('--dpt', required=False, help="only dump the places of these departments: --dpt 01,02")
+    @click.option('--between', required=False)
+    @click.option('--batch-size', default=1000, help="number of places loaded from the database at once")
+    @click.option('--workers', default=1, help="number of processes making the features")
+    def export_dump(output, dump_format, host, dpt, between, batch_size, workers):
+        """
+        Dump the Linked Places features of the places into a file.
+        With several workers the places are dumped in the order the workers make them, not in the id order.
+        """
+        prefix = "{host}{api_prefix}".format(host=host, api_prefix=app.config.get("API_URL_PREFIX", ""))
+        dpts = dpt.split(",") if dpt else None
+
+        with app.app_context():
+            start = time.time()
+            try:
+                if workers > 1:
+                    chunks = iter_dump_chunks_in_parallel(prefix, workers, between=between, dpts=dpts,
+                                                          batch_size=batch_size)
+                else:
+                    lower_bound, upper_bound = parse_between(between)
+                    chunks = iter_dump_chunks(prefix, lower_bound, upper_bound, dpts=dpts, batch_size=batch_size)
+                count = write_dump(output, chunks, dump_format)
+            except Exception as e:
+                print("NOT OK!  ", str(e))
+                sys.exit(1)
+
+            print("timer full ({0} workers): ".format(workers),
+                  time.strftime("%H:%M:%S", time.gmtime((time.time() - start))))
+            print("{0} places dumped into {1}".format(count, output))
+
+    @click.command("index-worker")
+    @click.option('--once', is_flag=True, default=False, help="empty the outbox then stop")
+    @click.option('--interval', default=2.0, help="seconds to wait when the outbox is empty")
+    @click.option('--batch-size', default=1000, help="number of queued operations sent at once")
+    @click.option('--chunk-size', default=10.0, help="maximum size of the bulk requests (MB)")
+    def index_worker(once, interval, batch_size, chunk_size):
+        """
+        Send the index operations queued by the API (INDEX_WRITE_BEHIND) to elasticsearch.
+        The repeated operations on a document are sent once, with bulk requests.
+        """
+        from app import db
+        with app.app_context():
+            while True:
+                try:
+                    nb_ops, nb_docs, errors = SearchIndexManager.flush_outbox(
+                        batch_size=batch_size, max_chunk_bytes=chunk_size * 1024 * 1024)
+                except Exception as e:
+                    db.session.rollback()
+                    print("NOT OK!  ", str(e), flush=True)
+                    nb_ops, nb_docs, errors = 0, 0, []
+                if nb_ops:
+                    print("{0} queued operations, {1} documents sent, {2} errors".format(
+                        nb_ops, nb_docs, len(errors)), flush=True)
+                    for id, error in errors[:5]:
+                        print("  {0}: {1}".format(id, error))
+                # the rejected operations are retried after a pause
+                if not nb_ops or errors:
+                    if once:
+                        return
+                    time.sleep(interval)
+
     @click.command("id-register")
     @click.option('--clear', required=False, default=False, is_flag=True, help="empty the id register")
     @click.option('--register', required=False, default=False, is_flag=True,
-                  help="register all Place ids without generating new ids. Replace old mapping if any.")
+                  help="register all Place ids without generating new ids. Reset the old mappings with --force.")
     @click.option('--replace', required=False, default=False, is_flag=True, help="replace all Place ids that exist in "
                                                                                  "the register but only if they don't"
                                                                                  " match the new id format (see "
@@ -315,7 +987,10 @@ def make_cli(given_app=None):
                                                                                     "Place, PlaceComment, "
                                                                                     "PlaceDescription, "
                                                                                     "PlaceFeatureType, PlaceOldLabel)")
-    def id_register(clear, register, replace, append, force, auto_commit, update_app):
+    @click.option('--dry-run', required=False, default=False, is_flag=True, help="report the number of rows the "
+                                                                                 "operations would touch, then "
+                                                                                 "rollback everything")
+    def id_register(clear, register, replace, append, force, auto_commit, update_app, dry_run):
         with app.app_context():
 
             @event.listens_for(Engine, "connect")
@@ -343,35 +1018,19 @@ def make_cli(given_app=None):
                 print(f' --> register: {IdRegister.query.count()} ids | place: {Place.query.count()} ids')
 
                 if register:
-                    nb_register = 0
-                    elts_to_save = []
-                    for place in Place.query.all():
-                        elts = IdRegister.query.filter(or_(IdRegister.primary_value == place.id,
-                                                           IdRegister.secondary_value == place.id)).all()
-
-                        if len(elts) > 0 and force:
-                            for elt in elts:
-                                elt.primary_value = place.id
-                                elt.secondary_value = place.id
-                        else:
-                            elt = IdRegister(place.id, place.id)
-                            elts_to_save.append(elt)
-
-                        nb_register += 1
-                        print(f' --> register.replace: {nb_register} registrations', end='\r')
-                    db.session.bulk_save_objects(elts_to_save)
-                    db.session.flush()
-                    print('')
+                    nb_reset, nb_register = register_place_ids(force)
+                    if force:
+                        print(f' --> register.register: {nb_reset} entries reset to their place id')
+                    print(f' --> register.register: {nb_register} registrations')
                 else:
                     if replace:
-                        nb_replace = 0
+                        # the new ids are allocated all at once, after the replaced entries are known
+                        replaced_ids = []
                         for place in Place.query.all():
                             # update entries with a secondary value matching the place id
                             elt = IdRegister.query.filter(IdRegister.secondary_value == place.id).first()
                             if elt:
-                                elt = IdRegister(place.id)
-                                nb_replace += 1
-                                db.session.add(elt)
+                                replaced_ids.append(place.id)
                             else:
                                 # update entries if the primary value matches the place id AND if the place id is
                                 # already in the new format
@@ -379,44 +1038,36 @@ def make_cli(given_app=None):
                                     elt = IdRegister.query.filter(IdRegister.primary_value == place.id).first()
                                     if elt:
                                         db.session.delete(elt)
-                                        db.session.flush()
-                                        elt = IdRegister(place.id)
-                                        nb_replace += 1
-                                        db.session.add(elt)
+                                        replaced_ids.append(place.id)
 
-                            print(f' --> register.replace: {nb_replace} replacements', end='\r')
-                            db.session.flush()
+                            print(f' --> register.replace: {len(replaced_ids)} replacements', end='\r')
+                        db.session.flush()
+                        IdRegister.bulk_register(replaced_ids)
+                        nb_replace = len(replaced_ids)
                         if nb_replace != Place.query.count():
                             print(f'\n --> register.replace: you may have some Place ids that are not registered. '
                                   f'Consider using --append to add them to the register', end='\r')
                         print('')
                     if append:
-                        nb_add = 0
-                        new_ids = []
-                        places = Place.query.with_entities(Place.id).filter(
-                            Place.id.notin_([r.primary_value for r in
-                                             IdRegister.query.with_entities(IdRegister.primary_value).all()])
-                        ).all()
-                        for i, place in enumerate(places):
-                            # append only new ids to the register
-                            if (not is_new_format(place.id) or force) and place.id not in new_ids:
-                                nb_add += 1
-                                print(f' --> register.append: {nb_add} new ids', end='\r')
-                                elt = IdRegister(place.id)
-                                new_ids.append(elt.primary_value)
-                                db.session.add(elt)
-                            else:
-                                print(place.id, place.id in new_ids, is_new_format(place.id))
-
+                        appended_ids, nb_new_format = select_unregistered_place_ids(force)
+                        if nb_new_format:
+                            print(f' --> register.append: {nb_new_format} unregistered ids already in the new format '
+                                  f'(see --force)')
+
+                        # the new ids are allocated all at once and inserted with a single statement
+                        IdRegister.bulk_register(appended_ids)
+                        nb_add = len(appended_ids)
                         if nb_add == 0:
                             print(
                                 f' --> register.append: no ids from Place to append (maybe they are already in the new format ?)')
                         else:
-                            print('')
+                            print(f' --> register.append: {nb_add} new ids')
 
                 print('[register.end]')
 
-                if clear or register or append or replace:
+                if dry_run:
+                    print('[register.dry-run] nothing is committed')
+                elif clear or register or append or replace:
                     if auto_commit:
                         db.session.commit()
                         print('[register.commit]')
@@ -434,41 +1085,18 @@ def make_cli(given_app=None):
                     print('[app.start]')
 
                     # update the whole application using the ids stored in the register
-                    q = IdRegister.query.with_entities(IdRegister.primary_value).filter(IdRegister.secondary_value is not None)
-                    print(
-                        f' --> app.update: {q.count()} ids from the register have a secondary value matching a place id')
-
-                    for j, elt in enumerate(IdRegister.query.filter(IdRegister.secondary_value is not None).all()):
-                        new_id, old_id = elt.primary_value, elt.secondary_value
-                        print(f' --> app.update: {j + 1} ids updated', end='\r')
+                    update_app_ids()
 
-                        with db.session.no_autoflush:
-
-                            p = Place.query.filter(Place.id == old_id).first()
-                            if p:
-                                p.id = new_id
-
-                                for i, p_old in enumerate(
-                                        PlaceOldLabel.query.filter(PlaceOldLabel.place_id == old_id).order_by(
-                                                PlaceOldLabel.id).all()):
-                                    p_old.old_label_id = f'{new_id}-{i + 1}'
-                                    p_old.place_id = new_id
-
-                                for p_feat in PlaceFeatureType.query.filter(PlaceFeatureType.place_id == old_id).all():
-                                    p_feat.place_id = new_id
-
-                                for p_co in PlaceComment.query.filter(PlaceComment.place_id == old_id).all():
-                                    p_co.place_id = new_id
-
-                                for p_desc in PlaceDescription.query.filter(PlaceDescription.place_id == old_id).all():
-                                    p_desc.place_id = new_id
-
-                    print(f'\n[app.end]')
+                    print(f'[app.end]')
 
                 else:
                     print('[app] no application update')
 
-                db.session.commit()
+                if dry_run:
+                    db.session.rollback()
+                    print('[register.rollback]')
+                else:
+                    db.session.commit()
             except Exception as e:
                 print(str(e))
                 db.session.rollback()
@@ -487,7 +1115,11 @@ def make_cli(given_app=None):
     cli.add_command(db_recreate)
     cli.add_command(db_reindex)
     cli.add_command(db_validate)
+    cli.add_command(export_dump)
+    cli.add_command(import_dt)
+    cli.add_command(index_worker)
     cli.add_command(run)
+    cli.add_command(update_lpf_schema)
     cli.add_command(id_register)
 
     return cli
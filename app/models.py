@@ -1,11 +1,37 @@
 import datetime
-from sqlalchemy import CheckConstraint
+import math
+from sqlalchemy import CheckConstraint, DDL, MetaData, Table, Column, Integer, Float, String, event, and_, or_, func
 from sqlalchemy.dialects.sqlite import DATETIME
 from sqlalchemy.ext.declarative import declared_attr
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import validates
 import random
 
 from app import db
 
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_OF_LATITUDE = 111.32
+
+
+def parse_longlat(longlat):
+    """
+    :param longlat: a '(longitude, latitude)' string
+    :return: the (longitude, latitude) floats, None if longlat is empty
+    """
+    if not longlat:
+        return None
+    long, lat = longlat.replace("(", "").replace(")", "").split(",")
+    return float(long), float(lat)
+
+
+def distance_km(long1, lat1, long2, lat2):
+    """
+    Haversine distance between two points
+    """
+    long1, lat1, long2, lat2 = map(math.radians, (long1, lat1, long2, lat2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((long2 - long1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
 
 class CitableElementMixin(object):
 
@@ -57,7 +83,7 @@ class Place(CitableElementMixin, db.Model):
     id = db.Column("place_id", db.String(10), primary_key=True)
     label = db.Column(db.String(200), nullable=False)
     country = db.Column(db.String(2), nullable=False)
-    dpt = db.Column(db.String(2), nullable=False)
+    dpt = db.Column(db.String(2), nullable=False, index=True)
     # not null if the place is known as being a commune
     commune_insee_code = db.Column(db.String(5), db.ForeignKey('insee_commune.insee_code'), index=True)
     # not null if the place is localized somewhere
@@ -80,17 +106,20 @@ class Place(CitableElementMixin, db.Model):
         uselist=False
     )
 
-    #linked_places = db.relationship('Place')
-
     @property
     def linked_places(self):
+        """
+        The places localized in the related commune. They are read from the localized_places relationship
+        of the commune, so they are loaded once per commune and can be eager loaded for a whole page of places
+        (eg. selectinload(Place.commune).selectinload(InseeCommune.localized_places))
+        """
         co = self.related_commune
         if co:
-            return Place.query.filter(Place.localization_commune_insee_code == co.id, Place.id != self.id).all()
+            return [lp for lp in co.localized_places if lp.id != self.id]
         else:
             return []
 
-    @property
+    @hybrid_property
     def related_commune(self):
         if self.commune:
             return self.commune
@@ -99,11 +128,29 @@ class Place(CitableElementMixin, db.Model):
         else:
             return None
 
-    @property
+    @related_commune.expression
+    def related_commune(cls):
+        # in SQL, the insee code of the related commune
+        return func.coalesce(cls.commune_insee_code, cls.localization_commune_insee_code)
+
+    @hybrid_property
     def longlat(self):
         co = self.related_commune
         return co.longlat if co else None
 
+    @longlat.expression
+    def longlat(cls):
+        return db.select([InseeCommune.longlat]).where(InseeCommune.id == cls.related_commune).as_scalar()
+
+    @classmethod
+    def located_in(cls, insee_codes):
+        """
+        :param insee_codes: a list or a SELECT of insee codes
+        :return: the criterion of the places whose related commune is one of insee_codes
+        """
+        return or_(cls.commune_insee_code.in_(insee_codes),
+                   and_(cls.commune_insee_code.is_(None), cls.localization_commune_insee_code.in_(insee_codes)))
+
 
 class PlaceDescription(CitableElementMixin, related_to_place_mixin("descriptions"), db.Model):
     __tablename__ = "place_description"
@@ -140,11 +187,15 @@ class PlaceOldLabel(CitableElementMixin, related_to_place_mixin("old_labels"), d
     # primary source reference with tags
     rich_reference = db.Column(db.Text)
 
-    @property
+    @hybrid_property
     def longlat(self):
         return self.place.longlat
 
-    @property
+    @longlat.expression
+    def longlat(cls):
+        return db.select([Place.longlat]).where(Place.id == cls.place_id).as_scalar()
+
+    @hybrid_property
     def label(self):
         return self.rich_label
 
@@ -161,6 +212,9 @@ class InseeCommune(db.Model):
     NCCENR = db.Column(db.String(70), nullable=False)
     ARTMIN = db.Column(db.String(10))
     longlat = db.Column(db.String(100))
+    # the coordinates of longlat, indexed by the insee_commune_rtree R*Tree
+    longitude = db.Column(db.Float)
+    latitude = db.Column(db.Float)
 
     geoname_id = db.Column(db.String(32))
     wikidata_item_id = db.Column(db.String(32))
@@ -177,6 +231,55 @@ class InseeCommune(db.Model):
     """
     inha_uuid = db.Column(db.String(64))
 
+    @validates('longlat')
+    def validate_longlat(self, key, longlat):
+        self.longitude, self.latitude = parse_longlat(longlat) or (None, None)
+        return longlat
+
+    @property
+    def coordinates(self):
+        """
+        :return: the (longitude, latitude) floats, None if unknown
+        """
+        if self.longitude is None or self.latitude is None:
+            return None
+        return self.longitude, self.latitude
+
+    @classmethod
+    def located_in(cls, insee_codes):
+        return cls.id.in_(insee_codes)
+
+    @staticmethod
+    def select_insee_codes_in_bbox(min_lon, min_lat, max_lon, max_lat):
+        """
+        :return: the SELECT of the insee codes of the communes located in the box, answered by the R*Tree index
+        """
+        rtree = insee_commune_rtree
+        # the R*Tree stores rounded coordinates: it gives the candidates, the columns give the exact answer
+        candidates = db.select([rtree.c.insee_code]).where(and_(
+            rtree.c.max_lon >= min_lon, rtree.c.min_lon <= max_lon,
+            rtree.c.max_lat >= min_lat, rtree.c.min_lat <= max_lat
+        ))
+        return db.select([InseeCommune.id]).where(and_(
+            InseeCommune.id.in_(candidates),
+            InseeCommune.longitude.between(min_lon, max_lon),
+            InseeCommune.latitude.between(min_lat, max_lat)
+        ))
+
+    @staticmethod
+    def select_insee_codes_near(long, lat, km):
+        """
+        :return: the SELECT of the insee codes of the communes located less than km kilometers away from (long, lat):
+        the candidates of the box around the circle, filtered by the distance_km SQL function
+        """
+        d_lat = km / KM_PER_DEGREE_OF_LATITUDE
+        d_long = km / (KM_PER_DEGREE_OF_LATITUDE * max(math.cos(math.radians(lat)), 1e-6))
+        in_bbox = InseeCommune.select_insee_codes_in_bbox(long - d_long, lat - d_lat, long + d_long, lat + d_lat)
+        return db.select([InseeCommune.id]).where(and_(
+            InseeCommune.id.in_(in_bbox),
+            func.distance_km(long, lat, InseeCommune.longitude, InseeCommune.latitude) <= km
+        ))
+
     # relationships
     region = db.relationship('InseeRef', primaryjoin="InseeCommune.REG_id==InseeRef.id",
                              backref=db.backref('communes_region'))
@@ -188,6 +291,48 @@ class InseeCommune(db.Model):
                              backref=db.backref('communes_canton'))
 
 
+# R*Tree spatial index of the communes coordinates (SQLite only).
+# It is kept up to date by triggers and is not part of the models metadata (create_all cannot create virtual tables)
+insee_commune_rtree = Table(
+    "insee_commune_rtree", MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("min_lon", Float), Column("max_lon", Float),
+    Column("min_lat", Float), Column("max_lat", Float),
+    Column("insee_code", String(5))
+)
+
+INSEE_COMMUNE_RTREE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS insee_commune_rtree "
+    "USING rtree(id, min_lon, max_lon, min_lat, max_lat, +insee_code)",
+
+    "CREATE TRIGGER IF NOT EXISTS insee_commune_rtree_insert AFTER INSERT ON insee_commune "
+    "WHEN new.longitude IS NOT NULL AND new.latitude IS NOT NULL "
+    "BEGIN "
+    "INSERT INTO insee_commune_rtree (min_lon, max_lon, min_lat, max_lat, insee_code) "
+    "VALUES (new.longitude, new.longitude, new.latitude, new.latitude, new.insee_code); "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS insee_commune_rtree_update "
+    "AFTER UPDATE OF insee_code, longitude, latitude ON insee_commune "
+    "BEGIN "
+    "DELETE FROM insee_commune_rtree WHERE insee_code = old.insee_code; "
+    "INSERT INTO insee_commune_rtree (min_lon, max_lon, min_lat, max_lat, insee_code) "
+    "SELECT new.longitude, new.longitude, new.latitude, new.latitude, new.insee_code "
+    "WHERE new.longitude IS NOT NULL AND new.latitude IS NOT NULL; "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS insee_commune_rtree_delete AFTER DELETE ON insee_commune "
+    "BEGIN "
+    "DELETE FROM insee_commune_rtree WHERE insee_code = old.insee_code; "
+    "END",
+)
+
+for statement in INSEE_COMMUNE_RTREE_DDL:
+    event.listen(InseeCommune.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(InseeCommune.__table__, "before_drop",
+             DDL("DROP TABLE IF EXISTS insee_commune_rtree").execute_if(dialect="sqlite"))
+
+
 class InseeRef(db.Model):
     """ """
     __tablename__ = 'insee_ref'
@@ -293,8 +438,8 @@ class IdRegister(db.Model):
 
         super(IdRegister, self).__init__(primary_value=primary_value, secondary_value=secondary_value)
 
-
-    def make_primary_value(self, new_id):
+    @classmethod
+    def make_primary_value(cls, new_id):
         # check digit ; https://en.wikisource.org/wiki/User:Inductiveload/BnF_ARK_format
         xdigits = "0123456789"
         index_sum = 0
@@ -303,4 +448,88 @@ class IdRegister(db.Model):
             index_sum += xdigits.index(digit) * i
             i += 1
         check_digit = xdigits[index_sum % 10]
-        return f"{self.PREFIX}{str(new_id).zfill(self._PADDING)}{str(check_digit)}"
+        return f"{cls.PREFIX}{str(new_id).zfill(cls._PADDING)}{str(check_digit)}"
+
+    @classmethod
+    def parse_primary_value(cls, primary_value):
+        """
+        :return: the number of a primary value made by make_primary_value, None for the other values
+        """
+        number = primary_value[len(cls.PREFIX):-1]
+        if not primary_value.startswith(cls.PREFIX) or len(number) != cls._PADDING or not number.isdigit():
+            return None
+        return int(number)
+
+    @classmethod
+    def load_used_numbers(cls):
+        """
+        :return: a bitmap of the numbers used by the registered primary values, and how many they are
+        """
+        used = bytearray(cls._ID_MAX // 8 + 1)
+        nb_used = 0
+        for primary_value, in db.session.query(cls.primary_value).filter(cls.primary_value.like(cls.PREFIX + '%')):
+            number = cls.parse_primary_value(primary_value)
+            if number is not None and not used[number >> 3] & (1 << (number & 7)):
+                used[number >> 3] |= 1 << (number & 7)
+                nb_used += 1
+        return used, nb_used
+
+    @classmethod
+    def allocate_primary_values(cls, nb):
+        """
+        Draw nb unused primary values at random. The used numbers are loaded once, then the new numbers
+        are drawn in memory.
+        :return: a list of nb primary values
+        """
+        used, nb_used = cls.load_used_numbers()
+        nb_free = cls._ID_MAX + 1 - nb_used
+        if nb > nb_free:
+            raise Exception("There is (probably) no room anymore!")
+
+        if nb_free < 2 * nb:
+            # drawing at random would hit the used numbers most of the time: draw among the free ones
+            free = [n for n in range(cls._ID_MAX + 1) if not used[n >> 3] & (1 << (n & 7))]
+            return [cls.make_primary_value(n) for n in random.sample(free, nb)]
+
+        numbers = []
+        while len(numbers) < nb:
+            number = random.randint(0, cls._ID_MAX)
+            if not used[number >> 3] & (1 << (number & 7)):
+                used[number >> 3] |= 1 << (number & 7)
+                numbers.append(number)
+        return [cls.make_primary_value(n) for n in numbers]
+
+    @classmethod
+    def bulk_register(cls, secondary_values):
+        """
+        Register a new primary value for each secondary value, with a single bulk insert.
+        The primary key is the uniqueness guard: if another transaction takes one of the allocated values
+        in the meantime, the insert fails instead of registering the value twice.
+        :return: the primary values, in the order of the secondary values
+        """
+        primary_values = cls.allocate_primary_values(len(secondary_values))
+        db.session.bulk_insert_mappings(cls, [
+            {"primary_value": primary_value, "secondary_value": secondary_value}
+            for primary_value, secondary_value in zip(primary_values, secondary_values)
+        ])
+        return primary_values
+
+
+class IndexOutbox(db.Model):
+    """
+    The index operations waiting to be sent to elasticsearch by the index-worker command
+    """
+    __tablename__ = "index_outbox"
+    __table_args__ = (
+        db.Index('ix_index_outbox_document', 'index_name', 'doc_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    index_name = db.Column(db.String(200), nullable=False)
+    doc_id = db.Column(db.String(100), nullable=False)
+    # 'index' or 'delete'
+    op = db.Column(db.String(10), nullable=False)
+    payload = db.Column(db.Text, nullable=True)
+    creation_date = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+    # number of times elasticsearch rejected the operation
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
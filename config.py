@@ -31,6 +31,9 @@ class Config(object):
     DEFAULT_INDEX_NAME = parse_var_env('DEFAULT_INDEX_NAME')
     INDEX_PREFIX = parse_var_env('INDEX_PREFIX')
     SEARCH_RESULT_PER_PAGE =  parse_var_env('SEARCH_RESULT_PER_PAGE')
+    COUNT_CACHE_TIMEOUT = parse_var_env('COUNT_CACHE_TIMEOUT')
+    INDEX_WRITE_BEHIND = parse_var_env('INDEX_WRITE_BEHIND') or False
+    SLOW_QUERY_TIME = parse_var_env('SLOW_QUERY_TIME')
 
     ASSETS_DEBUG = parse_var_env('ASSETS_DEBUG') or False
     #APP_URL_PREFIX = parse_var_env('APP_URL_PREFIX')
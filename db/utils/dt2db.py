@@ -3,6 +3,7 @@ import sqlite3
 from lxml import etree
 from lxml.etree import tostring
 import io
+import os
 import re
 import csv
 from datetime import datetime
@@ -170,9 +171,17 @@ def punctuation_clean(string):
     return string
 
 
+# les bibls des DT, lues depuis ce dossier quel que soit le dossier courant (script ou CLI de l’application)
+BIBL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bibl_gallica.tsv')
+
+
 def insert_bibl(db, cursor, dt_id):
-    """ """
-    with open('bibl_gallica.tsv') as csvfile:
+    """
+    Insérer la (ou les) bibl du DT, sans commit (la transaction est celle du DT)
+    :return: {None: id de la bibl du DT, '1': id du tome 1, '2': id du tome 2} (tomes pour DT72 et DT80 uniquement)
+    """
+    bibl_ids = {None: None}
+    with open(BIBL_PATH) as csvfile:
         reader = csv.DictReader(csvfile, delimiter='\t')
         for row in reader:
             if row['dt_id'] == dt_id:
@@ -192,385 +201,652 @@ def insert_bibl(db, cursor, dt_id):
                      row['gallica_page_one'],
                      row['gallica_IIIF_availability'])
                 )
-                db.commit()
-
-
-def insert_place_values(db, cursor, dt_id, user_id):
-    """ """
-
-    print("** TABLE place, place_comment, place_description, place_feature_type – INSERT")
-
-    #TODO: appeler le bon DT (et non _output7.xml, uniquement en dev)
-    tree = etree.parse('../../../dico-topo/data/'+dt_id+'/output7.xml')
-    # code du dpt
-    dpt = tree.xpath('/DICTIONNAIRE')[0].get('dep')
-
-    # print("INSERT bibl for {0}".format(dt_id))
-    insert_bibl(db, cursor, dt_id)
-    bibl_id = cursor.lastrowid # on sélectionne le tome plus bas pour DT72 et DT80. Très pénible!
+                bibl_ids[None] = cursor.lastrowid
+
+    # on sélectionne le tome selon l’article pour DT72 et DT80. Très pénible!
+    tomes_ark = {'DT72': 'ark:/12148/cb37374247g', 'DT80': 'ark:/12148/cb30482383j'}
+    if dt_id in tomes_ark:
+        for tome in ('1', '2'):
+            cursor.execute("SELECT id FROM bibl WHERE bnf_catalogue_ark = ? and bibl like ?",
+                           (tomes_ark[dt_id], '%tome ' + tome + '%'))
+            bibl_ids[tome] = cursor.fetchone()[0]
+    return bibl_ids
+
+
+# TODO: appeler le bon DT (et non _output7.xml, uniquement en dev)
+DT_DATA_DIR = '../../../dico-topo/data/'
+
+# nombre d’articles dont les lignes sont insérées ensemble (executemany par table)
+BATCH_SIZE = 1000
+
+DT_WITH_INSEE = [
+    "DT01", "DT02", "DT05", "DT07", "DT10",
+    "DT11", "DT14", "DT15", "DT18", "DT21",
+    "DT23", "DT24", "DT26", "DT27", "DT28",
+    "DT30", "DT34", "DT36", "DT41", "DT42",
+    "DT43", "DT44", "DT51", "DT52", "DT54",
+    "DT55", "DT56", "DT57", "DT58", "DT60",
+    "DT62", "DT64", "DT68", "DT71", "DT72",
+    "DT76", "DT77", "DT79", "DT80", "DT86",
+    "DT88", "DT89"]
+
+
+def get_dt_path(dt_id, data_dir=DT_DATA_DIR):
+    return os.path.join(data_dir, dt_id, 'output7.xml')
+
+
+def iter_articles(path):
+    """
+    Parser un DT en flux (iterparse) : les articles sont produits un à un, puis libérés (ainsi que leurs
+    prédécesseurs déjà traités) pour que la mémoire reste bornée par la taille d’un article et non celle du DT.
+    :param path: chemin de la source XML du DT
+    :return: un générateur de (code du dpt, élément article)
+    """
+    dpt = None
+    for event, elem in etree.iterparse(path, events=('start', 'end'), tag=('DICTIONNAIRE', 'article')):
+        if elem.tag == 'DICTIONNAIRE':
+            if event == 'start':
+                # code du dpt, disponible dès l’ouverture de la racine
+                dpt = elem.get('dep')
+            continue
+        if event != 'end' or elem.getparent() is None or elem.getparent().tag != 'DICTIONNAIRE':
+            continue
+        yield dpt, elem
+        elem.clear()
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+# conversion HTML5 de chaque commentaire
+# contient els: p, pg, date, forme_ancienne2, i, sm, sup, note, reference, renvoi
+# TODO: REPRENDRE LA TRANSFORMATION DES RENVOIS POUR LANCER LA RECHERCHE SUR LE BON DPT
+# TODO: certains renvois dans //renvoi/i (et non //renvoi/sm) : normaliser XML ?
+# TODO: voir avec JP si on inscrit le commentaire dans <article>
+# TODO: quid des <dfn> pour les formes anciennes2 ?
+COMMENTAIRE2HTML = '''\
+    <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+        <xsl:output method="text"/>
+        <xsl:template match="/">
+            <xsl:apply-templates/>
+        </xsl:template>
+        <xsl:template match="pg"/>
+        <xsl:template match="p">
+            <xsl:text>&lt;p></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/p></xsl:text>
+        </xsl:template>
+        <xsl:template match="forme_ancienne2">
+            <xsl:apply-templates/>
+        </xsl:template>
+        <xsl:template match="reference">
+            <xsl:text>&lt;cite></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/cite></xsl:text>
+        </xsl:template>
+        <xsl:template match="renvoi">
+            <xsl:apply-templates/>
+        </xsl:template>
+        <xsl:template match="sm[parent::renvoi]">
+            <xsl:text>&lt;a rel="search" data-dpt="</xsl:text>
+            <xsl:value-of select="/DICTIONNAIRE/@dep"/>
+            <xsl:text>"></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/a></xsl:text>
+        </xsl:template>
+        <xsl:template match="note">
+            <xsl:text>&lt;span class="note"></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/span></xsl:text>
+        </xsl:template>
+        <xsl:template match="sup">
+            <xsl:text>&lt;sup></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/sup></xsl:text>
+        </xsl:template>
+        <xsl:template match="sm">
+            <xsl:text>&lt;span class="sc"></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/span></xsl:text>
+        </xsl:template>
+        <xsl:template match="i">
+            <xsl:text>&lt;i></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/i></xsl:text>
+        </xsl:template>
+        <xsl:template match="date">
+            <xsl:text>&lt;time></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/time></xsl:text>
+        </xsl:template>
+        <xsl:template match="ads"/>
+
+    </xsl:stylesheet>'''
+
+# conversion HTML5 de toute l’entrée forme_ancienne
+OLD_LABEL2HTML = '''\
+    <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+        <xsl:output method="text"/>
+        <xsl:template match="/">
+            <xsl:apply-templates/>
+        </xsl:template>
+        <xsl:template match="sup">
+            <xsl:text>&lt;sup></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/sup></xsl:text>
+        </xsl:template>
+        <xsl:template match="sm">
+            <xsl:text>&lt;span class="sc"></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/span></xsl:text>
+        </xsl:template>
+        <xsl:template match="i">
+            <xsl:text>&lt;i></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/i></xsl:text>
+        </xsl:template>
+        <xsl:template match="i[parent::forme_ancienne]">
+            <xsl:text>&lt;dfn></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/dfn></xsl:text>
+        </xsl:template>
+        <xsl:template match="i[parent::reference]">
+            <xsl:text>&lt;cite></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/cite></xsl:text>
+        </xsl:template>
+        <xsl:template match="date">
+            <xsl:text>&lt;time></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/time></xsl:text>
+        </xsl:template>
+        <xsl:template match="comment">
+            <xsl:text>&lt;br/></xsl:text>
+            <xsl:apply-templates/>
+        </xsl:template>
+        <xsl:template match="pg"/>
+    </xsl:stylesheet>'''
+
+# utilitaires pour extraire et nettoyer les formes anciennes
+# relou, support xpath incomplet, on ne peut pas sortir le texte qui suit le dernier élément <i>
+# <xsl:template match="i[position()=last()]/following-sibling::text()"/>
+# On sort les notes, notamment pour DT60
+# On corrige plus loin en traitement de chaîne de chars.
+OLD_LABEL2DFN = '''\
+    <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+        <xsl:output method="text"/>
+        <xsl:template match="/">
+            <xsl:apply-templates/>
+        </xsl:template>
+        <xsl:template match="i">
+            <xsl:text>&lt;dfn></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/dfn></xsl:text>
+        </xsl:template>
+        <xsl:template match="reference"/>
+        <xsl:template match="date"/>
+        <xsl:template match="comment"/>
+        <xsl:template match="pg"/>
+        <xsl:template match="note"/>
+    </xsl:stylesheet>'''
+
+OLD_LABEL2RICH_DATE = '''\
+    <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+        <xsl:output method="text"/>
+        <xsl:template match="/forme_ancienne">
+            <xsl:apply-templates select="date[1]"/>
+        </xsl:template>
+        <xsl:template match="date">
+            <xsl:apply-templates/>
+        </xsl:template>
+        <xsl:template match="sup">
+            <xsl:text>&lt;sup></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/sup></xsl:text>
+        </xsl:template>
+        <xsl:template match="sm">
+            <xsl:text>&lt;span class="sc"></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/span></xsl:text>
+        </xsl:template>
+        <xsl:template match="pg"/>
+    </xsl:stylesheet>'''
+
+OLD_LABEL2RICH_REF = '''\
+    <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
+        <xsl:output method="text"/>
+        <xsl:template match="/forme_ancienne">
+            <xsl:apply-templates select="reference[1]"/>
+        </xsl:template>
+        <xsl:template match="reference">
+            <xsl:apply-templates/>
+        </xsl:template>
+        <xsl:template match="pg"/>
+        <xsl:template match="sup">
+            <xsl:text>&lt;sup></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/sup></xsl:text>
+        </xsl:template>
+        <xsl:template match="i">
+            <xsl:text>&lt;cite></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/cite></xsl:text>
+        </xsl:template>
+        <xsl:template match="sm">
+            <xsl:text>&lt;span class="sc"></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/span></xsl:text>
+        </xsl:template>
+        <xsl:template match="date">
+            <xsl:text>&lt;time></xsl:text>
+            <xsl:apply-templates/>
+            <xsl:text>&lt;/time></xsl:text>
+        </xsl:template>
+    </xsl:stylesheet>'''
+
+# les XSLT compilées, une seule fois par processus (et non à chaque article)
+transforms = {}
+
+
+def get_transform(xslt):
+    if xslt not in transforms:
+        transforms[xslt] = etree.XSLT(etree.parse(io.StringIO(xslt)))
+    return transforms[xslt]
+
+
+# formatage de place_description.content (xml_dt:definition)
+remove_tags = re.compile('</?(definition|localisation|date|renvoi|commune)[^>]*>')
+# on ne matche que les codes insee conformes au motif \[0-9]{5}\
+rename_commune_optag = re.compile('<commune insee="([0-9]{5})"[^>]*>')
+rename_commune_cltag = re.compile('</commune>')
+rename_typo_tag = re.compile('<(/?)typologie[^>]*>')
+description_authorized_tags_set = {'p', 'a', 'i', 'sup', 'span', 'cite'}
+comment_authorized_tags_set = {'p', 'a', 'i', 'sup', 'span', 'cite', 'time'}
+
+# nettoyage typo des formes anciennes, réutilisable
+tags = re.compile('<[^>]+>')
+clean_start = re.compile('^[«—\-  ]+')
+clean_end = re.compile('[»—  .,;]+$')
+clean_markup = re.compile(',(</[^>]+>)')  # sortir la virgule du markup (span, cite, dfn, ?)
+
+
+def parse_article(entry, dt_id, dpt, with_old_labels=True):
+    """
+    Extraire et normaliser les données d’un article du DT (aucun accès à la base)
+    :param entry: élément article
+    :param dpt: code du dpt (/DICTIONNAIRE/@dep)
+    :return: dict des valeurs de la Place, avec ses 'feature_types' et ses 'old_labels'
+    """
+    # stocker les données relatives à chaque Place (article du DT)
+    place = {}
+
+    # id/old-id de l’article (e.g. 'P49443358/DT86-11608')
+    place['id'] = entry.get('id')
+    place['old-id'] = entry.get('old-id')
+
+    # page de début
+    place['num_start_page'] = entry.get('pg')
+
+    # tome de la bibl pour DT72 et DT80 #HONTE
+    place['tome'] = None
     if dt_id == 'DT72':
-        cursor.execute(
-            "SELECT id FROM bibl WHERE bnf_catalogue_ark = 'ark:/12148/cb37374247g' and bibl like '%tome 1%'")
-        tome1_id = cursor.fetchone()[0]
-        cursor.execute(
-            "SELECT id FROM bibl WHERE bnf_catalogue_ark = 'ark:/12148/cb37374247g' and bibl like '%tome 2%'")
-        tome2_id = cursor.fetchone()[0]
-    if dt_id == 'DT80':
-        cursor.execute(
-            "SELECT id FROM bibl WHERE bnf_catalogue_ark = 'ark:/12148/cb30482383j' and bibl like '%tome 1%'")
-        tome1_id = cursor.fetchone()[0]
-        cursor.execute(
-            "SELECT id FROM bibl WHERE bnf_catalogue_ark = 'ark:/12148/cb30482383j' and bibl like '%tome 2%'")
-        tome2_id = cursor.fetchone()[0]
-
-    for entry in tree.xpath('/DICTIONNAIRE/article'):
-        # stocker les données relatives à chaque Place (article du DT)
-        place = {}
-
-        # id/old-id de l’article (e.g. 'P49443358/DT86-11608')
-        place['id'] = entry.get('id')
-        place['old-id'] = entry.get('old-id')
-
-        # page de début
-        place['num_start_page'] = entry.get('pg')
-
-        # on redéfinit bibl_id pour DT72 et DT80 #HONTE
-        if dt_id == 'DT72' and place['num_start_page'] <= '400':
-            bibl_id = tome1_id
-        elif dt_id == 'DT72' and place['num_start_page'] > '400':
-            bibl_id = tome2_id
-        elif dt_id == 'DT80' and entry.get('tm') == '1':
-            bibl_id = tome1_id
-        elif dt_id == 'DT80' and entry.get('tm') == '2':
-            bibl_id = tome2_id
-        #print(place['id'], '=>', bibl_id)
-
-        # code insee (si commune, optionnel)
-        place['commune_insee_code'] = entry.xpath('insee')[0].text if entry.xpath('insee') else None
-
-        # code insee de la commune d’appartenance du lieu (ie. code de la commune dans le champ localisation)
-        place['localization_commune_insee_code'] = entry.xpath('definition/localisation/commune')[0].get('insee') \
-            if entry.xpath('definition/localisation/commune') and place['commune_insee_code'] is None \
-            else None
-        # TODO: déprécié? supprimer? voir avec CF
-        control_vals = ['too_many_insee_codes', 'article_not_found', 'commune_is_empty']
-        if place['localization_commune_insee_code'] in control_vals:
-            place['localization_commune_insee_code'] = None
-
-        # @precision: relation entre le lieu (place_id) et la commune de localisation (localization_commune_insee_code)
-        #   'certain: lieu situé dans la commune, http://vocab.getty.edu/ontology#anchor-28390563
-        #   'approximatif': lieu situé près de la commune, http://vocab.getty.edu/ontology#anchor1075244680
-        #   absence de @precision: cas impossible à trancher -> tgn3000_related_to ?
-        # TODO: des cas où @precision n’est pas renseigné : comment définir le type de relation? voir avec CF
-        localization_commune_relation_type = entry.xpath('definition/localisation/commune')[0].get('precision') \
-            if entry.xpath('definition/localisation/commune') and place['localization_commune_insee_code'] is not None \
-            else None
-        # le lieu est dans les environs de la commune
-        if localization_commune_relation_type == 'approximatif':
-            place['localization_commune_relation_type'] = 'tgn3000_related_to'
-        # le lieu est localisé dans la commune
-        elif localization_commune_relation_type == 'certain':
-            place['localization_commune_relation_type'] = 'broaderPartitive'
-        else:
-            place['localization_commune_relation_type'] = None
-
-        # formatage de place_description.content (xml_dt:definition)
-        # LIENS
-        #   - feature types (FT): html:a, sans @href à ce stade du projet
-        #   - commune d’appartenance: html:a, avec code INSEE en @href
-        #   - renvois: html:a, avec @rel='search' et @data-dpt='{dpt-id}' pour construire les liens de recherche.
-        # TODO: standardiser les liens au FT
-        remove_tags = re.compile('</?(definition|localisation|date|renvoi|commune)[^>]*>')
-        # on ne matche que les codes insee conformes au motif \[0-9]{5}\
-        rename_commune_optag = re.compile('<commune insee="([0-9]{5})"[^>]*>')
-        rename_commune_cltag = re.compile('</commune>')
-        rename_typo_tag = re.compile('<(/?)typologie[^>]*>')
-        if entry.xpath('definition'):
-            description = tostring(entry.xpath('definition')[0], encoding='unicode')
-            description = ' '.join(description.split())
-            # ATTENTION à l’ordre des replace !!! (on réécrit commune avant de la supprimer…)
-            description = re.sub(rename_commune_optag, '<a href="\\1">', description)
-            description = re.sub(rename_commune_cltag, '</a>', description)
-            description = re.sub(rename_typo_tag, '<\\1a>', description)
-            # liens sur les renvois (tordu, car pas en XSLT initialement)
-            description = re.sub(
-                '(<renvoi>.*)<sm>([^<]+)</sm>(.*</renvoi>)',
-                '\\1<a rel="search" data-dpt="'+dpt+'"><span class="sc">\\2</span></a>\\3',
-                description)
-            description = re.sub(remove_tags, '', description)
-            # Tristesse de découvrir que le schéma n’est respecté… et hacks honteux
-            # des small-caps dans les descriptions (principalement les siècles)
-            description = re.sub(re.compile('<sm>([^<]+)</sm>'), '<span class="sc">\\1</span>', description)
-            # erreurs de segmentation dans la source XML
-            description = description.replace('</span> <sup>', '</span><sup>')
-            # sortir les sauts de page
-            description = re.sub(re.compile('<pg>[0-9]+</pg>'), '', description)
-            # des références…
-            description = re.sub(re.compile('<(/?)reference>'), '<\\1cite>', description)
-            # ponctuation très fautive autour des balise TODO: évaluer
-            description = punctuation_clean(description)
-            # ceinture bretelle, on trim()
-            description = description.strip()
-            # uppercase first letter of description (bien compliqué…)
-            re_first_letter = re.compile('(<a>)?([^ ])')
-            first_letter_pos = re.match(re_first_letter, description).start(2)
-            description = ''.join([description[:first_letter_pos],
-                            description[first_letter_pos].upper(),
-                            description[first_letter_pos + 1:]])
-        else:
-            description = None
-
-        # Validation HTM5, sortie d’une erreur sinon
-        description_authorized_tags_set = {'p', 'a', 'i', 'sup', 'span', 'cite'}
-        if description is not None:
-            html_snippet_validator(description, place['id'], description_authorized_tags_set)
-
-        # TODO: on charge la description même si elle n’est pas valide ?
-        place['description'] = description
-
-        # id du département
-        place['dpt'] = dpt
-
-        # VEDETTE (place.label)
-        """
-        2020-07: choix d’abandonner la distinction entre vedette pricipale et vedettes secondaires (alt_label)
-        place['label'] = entry.xpath('vedette/sm[1]')[0].text.rstrip(',')
-        place['label'] = place['label'].strip()
-        place['label'] = place['label'].replace('*', '')
-        # les vedettes secondaires (optionnel, mais fréquent)
-        place['alt_labels'] = []
-        for i in entry.xpath('vedette//sm[position()>1]'):
-            place['alt_labels'].append(i.text.rstrip(','))
-        """
-        place['label'] = tostring(entry.xpath('vedette')[0], method='text', encoding='unicode')
-        # TODO: vérifier toutes les ponctuations en fin de vedette/label (pour tout supprimer)
-        # place['label'] = place['label'].strip().rstrip('.,;')
-        # place['label'] = place['label'].strip().strip('.,;  »«*,')
-        place['label'] = place['label'].strip().strip('.,;» «*,')
-        # SN: le prefixe "*" marque les formes reconstituées/hypothétiques pour les lieux disparus. On supprime ?
-        # parfois à la fin de la vedette (cf DT72)
-        place['label'] = place['label'].replace('*', '')
-
-        # feature types
-        place['feature_types'] = []
-        for i in entry.xpath('definition/typologie'):
-            place['feature_types'].append(i.text.rstrip(','))
-
-        # COMMENTAIRE**S**
-        # possiblement plusieurs commentaires et plusieurs paragraphes par commentaire (//commentaire[2]/p[2])
-        # un html5:article par commentaire, avec html5:p
-        # NB. impossible de déterminer sur quoi porte un commentaire (l’article, la forme ?)
-
-        # conversion HTML5 de chaque commentaire
-        # contient els: p, pg, date, forme_ancienne2, i, sm, sup, note, reference, renvoi
-        # TODO: REPRENDRE LA TRANSFORMATION DES RENVOIS POUR LANCER LA RECHERCHE SUR LE BON DPT
-        # TODO: certains renvois dans //renvoi/i (et non //renvoi/sm) : normaliser XML ?
-        # TODO: voir avec JP si on inscrit le commentaire dans <article>
-        # TODO: quid des <dfn> pour les formes anciennes2 ?
-        commentaire2html = io.StringIO('''\
-            <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
-                <xsl:output method="text"/>
-                <xsl:template match="/">
-                    <xsl:apply-templates/>
-                </xsl:template>
-                <xsl:template match="pg"/>
-                <xsl:template match="p">
-                    <xsl:text>&lt;p></xsl:text>
-                    <xsl:apply-templates/>
-                    <xsl:text>&lt;/p></xsl:text>
-                </xsl:template>
-                <xsl:template match="forme_ancienne2">
-                    <xsl:apply-templates/>
-                </xsl:template>
-                <xsl:template match="reference">
-                    <xsl:text>&lt;cite></xsl:text>
-                    <xsl:apply-templates/>
-                    <xsl:text>&lt;/cite></xsl:text>
-                </xsl:template>
-                <xsl:template match="renvoi">
-                    <xsl:apply-templates/>
-                </xsl:template>
-                <xsl:template match="sm[parent::renvoi]">
-                    <xsl:text>&lt;a rel="search" data-dpt="</xsl:text>
-                    <xsl:value-of select="/DICTIONNAIRE/@dep"/>
-                    <xsl:text>"></xsl:text>
-                    <xsl:apply-templates/>
-                    <xsl:text>&lt;/a></xsl:text>
-                </xsl:template>
-                <xsl:template match="note">
-                    <xsl:text>&lt;span class="note"></xsl:text>
-                    <xsl:apply-templates/>
-                    <xsl:text>&lt;/span></xsl:text>
-                </xsl:template>
-                <xsl:template match="sup">
-                    <xsl:text>&lt;sup></xsl:text>
-                    <xsl:apply-templates/>
-                    <xsl:text>&lt;/sup></xsl:text>
-                </xsl:template>
-                <xsl:template match="sm">
-                    <xsl:text>&lt;span class="sc"></xsl:text>
-                    <xsl:apply-templates/>
-                    <xsl:text>&lt;/span></xsl:text>
-                </xsl:template>
-                <xsl:template match="i">
-                    <xsl:text>&lt;i></xsl:text>
-                    <xsl:apply-templates/>
-                    <xsl:text>&lt;/i></xsl:text>
-                </xsl:template>
-                <xsl:template match="date">
-                    <xsl:text>&lt;time></xsl:text>
-                    <xsl:apply-templates/>
-                    <xsl:text>&lt;/time></xsl:text>
-                </xsl:template>
-                <xsl:template match="ads"/>
-
-            </xsl:stylesheet>''')
-        xslt_commentaire2html = etree.parse(commentaire2html)
-        transform_commentaire2html = etree.XSLT(xslt_commentaire2html)
-
-        place['comment'] = ''
-        if entry.xpath('commentaire'):
-            for commentaire in entry.xpath('commentaire'):
-                comment = str(transform_commentaire2html(commentaire)).strip()
-                # remove multiple spaces
-                comment = " ".join(comment.split())
-                # hack bad XML format (plus à ça près)
-                comment = comment.replace('.</a>', '</a>.')
-                comment = comment.replace('.">', '">')
-                comment = comment.replace(' <sup>', '<sup>')
-                # optimiser append
-                place['comment'] += comment
-
-                # Validation HTML5 (on se contente de tester, on insère tout de même en base)
-                comment_authorized_tags_set = {'p', 'a', 'i', 'sup', 'span', 'cite', 'time'}
-                if description is not None:
-                    html_snippet_validator(place['comment'], place['id'], comment_authorized_tags_set)
-        else:
-            place['comment'] = None
-
-
-        # INSERTIONS
-
-        # bibl, voir plus haut, avant de boucler sur la source XML
-
-        # responsablilty
-        creation_date = datetime.now().isoformat(timespec='seconds')
-        try:
-            cursor.execute(
-                "INSERT INTO responsibility ("
-                    "user_id,"
-                    "bibl_id,"
-                    "num_start_page,"
-                    "creation_date)"
-                "VALUES (?, ?, ?, ?)",
-                    (user_id,
-                     bibl_id,
-                     place['num_start_page'],
-                     creation_date))
-        except sqlite3.IntegrityError as e:
-            print(e, "insert responsability, place %s" % (place['id']))
-        responsability_id = cursor.lastrowid
-        #db.commit()
-
-        # registre
-        try:
-            cursor.execute(
-                "INSERT INTO id_register ("
-                    "primary_value, secondary_value)"
-                "VALUES (?, ?)",
-                    (place['id'], place['old-id']))
-        except sqlite3.IntegrityError as e:
-            print(e,  "insert id_register, place %s" % (place['id']))
-
-        # place
+        place['tome'] = '1' if place['num_start_page'] <= '400' else '2'
+    elif dt_id == 'DT80' and entry.get('tm') in ('1', '2'):
+        place['tome'] = entry.get('tm')
+
+    # code insee (si commune, optionnel)
+    place['commune_insee_code'] = entry.xpath('insee')[0].text if entry.xpath('insee') else None
+
+    # code insee de la commune d’appartenance du lieu (ie. code de la commune dans le champ localisation)
+    place['localization_commune_insee_code'] = entry.xpath('definition/localisation/commune')[0].get('insee') \
+        if entry.xpath('definition/localisation/commune') and place['commune_insee_code'] is None \
+        else None
+    # TODO: déprécié? supprimer? voir avec CF
+    control_vals = ['too_many_insee_codes', 'article_not_found', 'commune_is_empty']
+    if place['localization_commune_insee_code'] in control_vals:
+        place['localization_commune_insee_code'] = None
+
+    # @precision: relation entre le lieu (place_id) et la commune de localisation (localization_commune_insee_code)
+    #   'certain: lieu situé dans la commune, http://vocab.getty.edu/ontology#anchor-28390563
+    #   'approximatif': lieu situé près de la commune, http://vocab.getty.edu/ontology#anchor1075244680
+    #   absence de @precision: cas impossible à trancher -> tgn3000_related_to ?
+    # TODO: des cas où @precision n’est pas renseigné : comment définir le type de relation? voir avec CF
+    localization_commune_relation_type = entry.xpath('definition/localisation/commune')[0].get('precision') \
+        if entry.xpath('definition/localisation/commune') and place['localization_commune_insee_code'] is not None \
+        else None
+    # le lieu est dans les environs de la commune
+    if localization_commune_relation_type == 'approximatif':
+        place['localization_commune_relation_type'] = 'tgn3000_related_to'
+    # le lieu est localisé dans la commune
+    elif localization_commune_relation_type == 'certain':
+        place['localization_commune_relation_type'] = 'broaderPartitive'
+    else:
+        place['localization_commune_relation_type'] = None
+
+    # formatage de place_description.content (xml_dt:definition)
+    # LIENS
+    #   - feature types (FT): html:a, sans @href à ce stade du projet
+    #   - commune d’appartenance: html:a, avec code INSEE en @href
+    #   - renvois: html:a, avec @rel='search' et @data-dpt='{dpt-id}' pour construire les liens de recherche.
+    # TODO: standardiser les liens au FT
+    if entry.xpath('definition'):
+        description = tostring(entry.xpath('definition')[0], encoding='unicode')
+        description = ' '.join(description.split())
+        # ATTENTION à l’ordre des replace !!! (on réécrit commune avant de la supprimer…)
+        description = re.sub(rename_commune_optag, '<a href="\\1">', description)
+        description = re.sub(rename_commune_cltag, '</a>', description)
+        description = re.sub(rename_typo_tag, '<\\1a>', description)
+        # liens sur les renvois (tordu, car pas en XSLT initialement)
+        description = re.sub(
+            '(<renvoi>.*)<sm>([^<]+)</sm>(.*</renvoi>)',
+            '\\1<a rel="search" data-dpt="'+dpt+'"><span class="sc">\\2</span></a>\\3',
+            description)
+        description = re.sub(remove_tags, '', description)
+        # Tristesse de découvrir que le schéma n’est respecté… et hacks honteux
+        # des small-caps dans les descriptions (principalement les siècles)
+        description = re.sub(re.compile('<sm>([^<]+)</sm>'), '<span class="sc">\\1</span>', description)
+        # erreurs de segmentation dans la source XML
+        description = description.replace('</span> <sup>', '</span><sup>')
+        # sortir les sauts de page
+        description = re.sub(re.compile('<pg>[0-9]+</pg>'), '', description)
+        # des références…
+        description = re.sub(re.compile('<(/?)reference>'), '<\\1cite>', description)
+        # ponctuation très fautive autour des balise TODO: évaluer
+        description = punctuation_clean(description)
+        # ceinture bretelle, on trim()
+        description = description.strip()
+        # uppercase first letter of description (bien compliqué…)
+        re_first_letter = re.compile('(<a>)?([^ ])')
+        first_letter_pos = re.match(re_first_letter, description).start(2)
+        description = ''.join([description[:first_letter_pos],
+                        description[first_letter_pos].upper(),
+                        description[first_letter_pos + 1:]])
+    else:
+        description = None
+
+    # Validation HTM5, sortie d’une erreur sinon
+    if description is not None:
+        html_snippet_validator(description, place['id'], description_authorized_tags_set)
+
+    # TODO: on charge la description même si elle n’est pas valide ?
+    place['description'] = description
+
+    # id du département
+    place['dpt'] = dpt
+
+    # VEDETTE (place.label)
+    # 2020-07: choix d’abandonner la distinction entre vedette pricipale et vedettes secondaires (alt_label)
+    place['label'] = tostring(entry.xpath('vedette')[0], method='text', encoding='unicode')
+    # TODO: vérifier toutes les ponctuations en fin de vedette/label (pour tout supprimer)
+    place['label'] = place['label'].strip().strip('.,;» «*,')
+    # SN: le prefixe "*" marque les formes reconstituées/hypothétiques pour les lieux disparus. On supprime ?
+    # parfois à la fin de la vedette (cf DT72)
+    place['label'] = place['label'].replace('*', '')
+
+    # feature types
+    place['feature_types'] = []
+    for i in entry.xpath('definition/typologie'):
+        place['feature_types'].append(i.text.rstrip(','))
+
+    # COMMENTAIRE**S**
+    # possiblement plusieurs commentaires et plusieurs paragraphes par commentaire (//commentaire[2]/p[2])
+    # un html5:article par commentaire, avec html5:p
+    # NB. impossible de déterminer sur quoi porte un commentaire (l’article, la forme ?)
+    transform_commentaire2html = get_transform(COMMENTAIRE2HTML)
+    place['comment'] = ''
+    if entry.xpath('commentaire'):
+        for commentaire in entry.xpath('commentaire'):
+            comment = str(transform_commentaire2html(commentaire)).strip()
+            # remove multiple spaces
+            comment = " ".join(comment.split())
+            # hack bad XML format (plus à ça près)
+            comment = comment.replace('.</a>', '</a>.')
+            comment = comment.replace('.">', '">')
+            comment = comment.replace(' <sup>', '<sup>')
+            place['comment'] += comment
+
+            # Validation HTML5 (on se contente de tester, on insère tout de même en base)
+            if description is not None:
+                html_snippet_validator(place['comment'], place['id'], comment_authorized_tags_set)
+    else:
+        place['comment'] = None
+
+    place['old_labels'] = parse_old_labels(entry, place['id']) if with_old_labels else []
+    return place
+
+
+def parse_old_labels(entry, place_id):
+    """
+    Extraire et normaliser les formes anciennes d’un article
+    :return: liste des lignes (old_label_id, rich_label, rich_date, text_date, rich_reference), '' remplacé par None
+    """
+    transform_old_label2html = get_transform(OLD_LABEL2HTML)
+    transform_old_label2dfn = get_transform(OLD_LABEL2DFN)
+    transform_old_label2rich_date = get_transform(OLD_LABEL2RICH_DATE)
+    transform_old_label2rich_ref = get_transform(OLD_LABEL2RICH_REF)
+
+    # formes anciennes et attestations
+    # jusqu’à 47 formes anciennes pour une vedette, dans l’Aisne: `distinct-values(//article/count(forme_ancienne)`
+    # des formes anciennes sans forme !!!, ex: DT02-04777
+    # On garde 1 date et 1 ref par forme ancienne ; on place les rares exceptions dans le champs texte qu’on publiera
+
+    # Source XML :
+    #   <forme_ancienne>Inter <i>Estran</i> et <i>Abugniez</i> et <i>Gerigniez,</i>
+    #       <date>1168</date>
+    #       <reference>(cart. de l’abb. de Thenailles, f<sup>os</sup> 15, 20, 36)</reference>.
+    #   </forme_ancienne>
+    #
+    # Variables
+    #   * old_label_id
+    #       identifiant calculé de la forme ancienne
+    #       DT02-00043-03
+    #   * old_label_xml_str
+    #       élément <forme_ancienne> dans la source XML
+    #       <forme_ancienne>Inter <i>Estran</i> et <i>Abugniez</i> et <i>Gerigniez,</i> <date>1168</date> <reference>(cart. de l’abb. de Thenailles, f<sup>os</sup> 15, 20, 36)</reference>.</forme_ancienne>
+    #   * old_label_html_str
+    #       élément <forme_ancienne> converti en HTML
+    #       <p>Inter <dfn>Estran</dfn> et <dfn>Abugniez</dfn> et <dfn>Gerigniez</dfn>, <time>1168</time> (cart. de l’abb. de Thenailles, f<sup>os</sup> 15, 20, 36)</p>
+    #   * dfn
+    #       la/les forme(s) d’une entrée forme ancienne, en HTML
+    #       Inter <dfn>Estran</dfn> et <dfn>Abugniez</dfn> et <dfn>Gerigniez</dfn>
+    #   * rich_ref
+    #       la référence d’une entrée forme ancienne avec enrichissement typo, en HTML
+    #       cart. de l’abb. de Thenailles, f<sup>os</sup> 15, 20, 36
+    #   * rich_date
+    #       la date avec enrichissement typo, en HTML
+    #       <span class='sc">xiii</span><sup>e</sup> siècle (cf DT02-00048-03)
+    #   * date
+    #       la date sans enrichissement typo
+    #       xiiie siècle (idem)
+    old_labels = []
+    n = 1
+    for old_label in entry.xpath('forme_ancienne'):
+        # ATTENTION: on ne conserve pas les formes anciennes sans label (not(i)),
+        # sauf si la forme ancienne est la première de la liste des formes anciennes (ou unique).
+        # Dans ce cas on reprend le label de l’article.
+        if old_label.xpath('not(i)') and n > 1:
+            continue
+        old_label_id = place_id+'-0'+str(n) if n < 10 else place_id+'-'+str(n)
+        old_label_xml_str = tostring(old_label, encoding='unicode')
+        old_label_xml_str = ' '.join(old_label_xml_str.split())
+        tree = etree.fromstring(old_label_xml_str)
+        # tout le contenu de l’élément forme_ancienne, formaté en HTML
+        old_label_html_str = str(transform_old_label2html(tree))
+        old_label_html_str = re.sub(clean_start, '', old_label_html_str)
+        old_label_html_str = re.sub(clean_markup, '\\1,', old_label_html_str) # sortir les virgules des balises
+        old_label_html_str = re.sub(clean_end, '', old_label_html_str)
+        old_label_html_str = "<p>%s</p>" % (old_label_html_str) # on encapsule dans un <p> ? dans <li> ? Todo: à (re)voir
+        # sortir les préfixes "*" des formes anciennes et les conserver dans les références (moche)
+        old_label_html_str = old_label_html_str.replace('<dfn>*', '<dfn>')
+
+        # DFN
+        dfn = str(transform_old_label2dfn(tree))
+        dfn = re.sub(clean_start, '', dfn)
+        dfn = dfn.replace('<dfn>*', '<dfn>') # déprime de la gestion de l’"*" initiale (cf plus haut aussi)
+        # sortir la ponctuation des élements <dfn> avant normalisation de la fin de la chaîne complète (dfn)
+        dfn = re.sub('([, .; :]+)</dfn>', '</dfn>\\1', dfn)
+        dfn = re.sub(clean_end, '', dfn)
+        dfn = dfn.rstrip()  # ceintures bretelles
+        # On vire le texte qui suit le dernier élément <dfn> (support xpath insuffisant avec lxml)
+        pos = dfn.rfind('</dfn>')
+        # rfind retourne -1 si la chaîne n’est pas trouvée…
+        if pos != -1:
+            dfn = dfn[:pos+6]
+        # des ponctuations illogiques du fait des traitement précédents, on standardise à la hache
+        dfn = re.sub('[, ;][, ;.:]{3,}', '. ', dfn)
+        # 7201 formes anciennes font plus de 100 chars : on coupe !
+        # TODO: corriger XML ou le code de chargement pour repositionner les balises dans la chaîne conservée
+        if len(dfn) > 100:
+            # on vire les balises, pour rien risquer…
+            dfn = re.sub(tags, '', dfn)
+            dfn = dfn[:100].strip() + '…'
+        # quand label du toponyme ancien est vide, on reprend celui de la vedette
+        # TODO: essayer d’affiner cette logique avec OC et SN
+        if not dfn:
+            dfn = entry.xpath('vedette/sm[1]')[0].text.rstrip(',')
+            dfn = dfn.strip()
+
+        # Date des formes anciennes
+        # Parfois plusieurs dates pour une forme ancienne ; on n’inscrit en base que la première (cf XLST).
+        # Attention au mauvais formatage des dates dans les XML (des sauts de lignes intempestifs…)
+        rich_date = str(transform_old_label2rich_date(tree)).lstrip()
+        date = re.sub(tags, '', rich_date)
+        # remove multiple spaces
+        date = " ".join(date.split())
+        date = date2iso(date)
+
+        # Ref (référence de la forme ancienne) ; 1 forme_ancienne avec plus d’une réf ! (pour l’instant, on les vire = choix du prestataire d’ailleurs…)
+        # contenu riche : i, sup, pg (on les sort en XSLT), date, sm
+        rich_ref = str(transform_old_label2rich_ref(tree)).strip()
+        rich_ref = rich_ref.lstrip('(').rstrip(')') # suppression des parenthèses
+        rich_ref = rich_ref.replace(',</cite>', '</cite>,')  # sortir la ponctuation du titre
+        n += 1
+        # les valeurs vides à NULL (auparavant par un UPDATE de toute la table après insertion)
+        old_labels.append((old_label_id, dfn, rich_date or None, date or None, rich_ref or None))
+    return old_labels
+
+
+# les insertions, par table, dans l’ordre des clés étrangères
+# (table, requête, position de l’id de la place (ou de la ligne) dans les valeurs, pour les messages d’erreur)
+INSERTS = (
+    ('responsibility',
+     "INSERT INTO responsibility (id, user_id, bibl_id, num_start_page, creation_date) VALUES (?, ?, ?, ?, ?)", 0),
+    ('id_register', "INSERT INTO id_register (primary_value, secondary_value) VALUES (?, ?)", 0),
+    ('place',
+     "INSERT INTO place (place_id, label, country, dpt, commune_insee_code, localization_commune_insee_code, "
+     "localization_commune_relation_type, responsibility_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", 0),
+    ('place_comment', "INSERT INTO place_comment (content, responsibility_id, place_id) VALUES (?, ?, ?)", 2),
+    ('place_description', "INSERT INTO place_description (content, responsibility_id, place_id) VALUES (?, ?, ?)", 2),
+    ('place_feature_type', "INSERT INTO place_feature_type (term, responsibility_id, place_id) VALUES (?, ?, ?)", 2),
+    ('place_old_label',
+     "INSERT INTO place_old_label (old_label_id, rich_label, rich_date, text_date, rich_reference, "
+     "responsibility_id, place_id) VALUES (?, ?, ?, ?, ?, ?, ?)", 6),
+)
+
+
+def new_batches():
+    return {table: [] for table, insert, key in INSERTS}
+
+
+def add_place_rows(batches, place, user_id, bibl_id, responsibility_id):
+    """
+    Ajouter les lignes d’une Place (et de ses éléments) aux lots à insérer
+    """
+    creation_date = datetime.now().isoformat(timespec='seconds')
+    batches['responsibility'].append((responsibility_id, user_id, bibl_id, place['num_start_page'], creation_date))
+    batches['id_register'].append((place['id'], place['old-id']))
+    batches['place'].append((place['id'], place['label'], 'FR', place['dpt'], place['commune_insee_code'],
+                             place['localization_commune_insee_code'], place['localization_commune_relation_type'],
+                             responsibility_id))
+    if place['comment']:
+        batches['place_comment'].append((place['comment'], responsibility_id, place['id']))
+    if place['description']:
+        batches['place_description'].append((place['description'], responsibility_id, place['id']))
+    for feature_type in place['feature_types']:
+        batches['place_feature_type'].append((feature_type, responsibility_id, place['id']))
+    add_old_label_rows(batches, place['id'], place['old_labels'], responsibility_id)
+
+
+def add_old_label_rows(batches, place_id, old_labels, responsibility_id):
+    for old_label in old_labels:
+        batches['place_old_label'].append(old_label + (responsibility_id, place_id))
+
+
+def insert_batches(db, cursor, batches):
+    """
+    Insérer les lots (un executemany par table), puis les vider.
+    Si une ligne viole une contrainte, le lot de sa table est annulé et inséré ligne à ligne : les lignes fautives
+    sont signalées et ignorées, comme auparavant.
+    """
+    if not db.in_transaction:
+        # le SAVEPOINT ne doit pas ouvrir (puis valider) sa propre transaction
+        cursor.execute("BEGIN")
+    for table, insert, key in INSERTS:
+        rows = batches[table]
+        if not rows:
+            continue
+        cursor.execute("SAVEPOINT batch")
         try:
-            cursor.execute(
-                "INSERT INTO place ("
-                    "place_id,"
-                    "label,"
-                    "country,"
-                    "dpt,"
-                    "commune_insee_code,"
-                    "localization_commune_insee_code,"
-                    "localization_commune_relation_type,"
-                    "responsibility_id)"
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                    (place['id'],
-                     place['label'],
-                     'FR',
-                     place['dpt'],
-                     place['commune_insee_code'],
-                     place['localization_commune_insee_code'],
-                     place['localization_commune_relation_type'],
-                     responsability_id))
-        except sqlite3.IntegrityError as e:
-            print(e, "insert place, place %s" % (place['id']))
-        #db.commit()
-
-        """ 2020-07: abandon de l’insertion des alt_label
-        # place_alt_label
-        if place['alt_labels']:
-            for alt_label in place['alt_labels']:
-                cursor.execute(
-                    "INSERT INTO place_alt_label ("
-                        "label,"
-                        "responsibility_id,"
-                        "place_id)"
-                    "VALUES (?, ?, ?)",
-                        (alt_label,
-                         responsability_id,
-                         place['id']))
-                db.commit()
-        """
-
-        # place_comment
-        if place['comment']:
-            try:
-                cursor.execute(
-                    "INSERT INTO place_comment ("
-                        "content,"
-                        "responsibility_id,"
-                        "place_id)"
-                    "VALUES (?, ?, ?);",
-                        (place['comment'],
-                         responsability_id,
-                         place['id']))
-            except sqlite3.IntegrityError as e:
-                print(e, "insert place_comment, place %s" % (place['id']))
-            #db.commit()
-
-        # place_description
-        if place['description']:
-            try:
-                cursor.execute(
-                    "INSERT INTO place_description ("
-                        "content,"
-                        "responsibility_id,"
-                        "place_id)"
-                    "VALUES (?, ?, ?);",
-                        (place['description'],
-                         responsability_id,
-                         place['id']))
-            except sqlite3.IntegrityError as e:
-                print(e, "insert place_description, place %s" % (place['id']))
-            #db.commit()
-
-        # place_feature_type
-        if place['feature_types']:
-            for feature_type in place['feature_types']:
+            cursor.executemany(insert, rows)
+        except sqlite3.IntegrityError:
+            cursor.execute("ROLLBACK TO batch")
+            for row in rows:
                 try:
-                    cursor.execute(
-                        "INSERT INTO place_feature_type ("
-                            "term,"
-                            "responsibility_id,"
-                            "place_id)"
-                        "VALUES (?, ?, ?);",
-                            (feature_type,
-                             responsability_id,
-                             place['id']))
+                    cursor.execute(insert, row)
                 except sqlite3.IntegrityError as e:
-                    print(e, ("insert place_feature_type: place %s – FT '%s'" % (place['id'], feature_type)))
-    db.commit()
+                    print(e, "insert %s, place %s" % (table, row[key]))
+        cursor.execute("RELEASE batch")
+        rows.clear()
+
+
+def next_responsibility_id(cursor):
+    # les ids sont attribués ici pour pouvoir insérer par lots (pas de lastrowid avec executemany)
+    cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM responsibility")
+    return cursor.fetchone()[0]
+
+
+def write_dt(db, cursor, dt_id, user_id, places, batch_size=BATCH_SIZE):
+    """
+    Insérer un DT dans une seule transaction : bibl, puis les Places par lots de batch_size articles
+    :param places: itérable des Places produites par parse_article (dans l’ordre du DT)
+    :return: nombre de (places, formes anciennes) lues
+    """
+    nb_places, nb_old_labels = 0, 0
+    try:
+        bibl_ids = insert_bibl(db, cursor, dt_id)
+        responsibility_id = next_responsibility_id(cursor)
+        batches = new_batches()
+        for place in places:
+            add_place_rows(batches, place, user_id, bibl_ids.get(place['tome'], bibl_ids[None]), responsibility_id)
+            responsibility_id += 1
+            nb_places += 1
+            nb_old_labels += len(place['old_labels'])
+            if nb_places % batch_size == 0:
+                insert_batches(db, cursor, batches)
+        insert_batches(db, cursor, batches)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return nb_places, nb_old_labels
+
+
+def insert_dt(db, cursor, dt_id, user_id, path=None, batch_size=BATCH_SIZE):
+    """
+    Charger un DT en un seul passage sur la source XML : bibl, place, place_comment, place_description,
+    place_feature_type, place_old_label (et responsibility, id_register)
+    :return: nombre de (places, formes anciennes) lues
+    """
+    print("** TABLE place, place_comment, place_description, place_feature_type, place_old_label – INSERT")
+    places = (parse_article(entry, dt_id, dpt) for dpt, entry in iter_articles(path or get_dt_path(dt_id)))
+    return write_dt(db, cursor, dt_id, user_id, places, batch_size)
+
+
+def insert_place_values(db, cursor, dt_id, user_id, path=None, batch_size=BATCH_SIZE):
+    """ Charger un DT sans ses formes anciennes (voir insert_place_old_label) """
+    print("** TABLE place, place_comment, place_description, place_feature_type – INSERT")
+    places = (parse_article(entry, dt_id, dpt, with_old_labels=False)
+              for dpt, entry in iter_articles(path or get_dt_path(dt_id)))
+    return write_dt(db, cursor, dt_id, user_id, places, batch_size)
 
 
 # Enregistrer le place_id de la commune de localisation dans place.localization_place_id
@@ -615,294 +891,35 @@ def update_localization_place_id(db, cursor, dpt_code):
     db.commit()
 
 
-def insert_place_old_label(db, cursor, dt_id):
-    """ """
+def insert_place_old_label(db, cursor, dt_id, path=None, batch_size=BATCH_SIZE):
+    """
+    Charger les formes anciennes d’un DT dont les Places sont déjà en base, dans une seule transaction
+    :return: nombre de formes anciennes insérées
+    """
     print("** TABLE place_old_label – INSERT")
-    tags = re.compile('<[^>]+>')
-    # TODO: appeler le bon DT (et non _output7.xml, uniquement en dev)
-    tree = etree.parse('../../../dico-topo/data/'+dt_id+'/output7.xml')
-    # tree = etree.parse('../../../dico-topo/data/'+dt_id+'/'+dt_id+'.xml')
-
-    # conversion HTML5 de toute l’entrée forme_ancienne
-    old_label2html = io.StringIO('''\
-        <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
-            <xsl:output method="text"/>
-            <xsl:template match="/">
-                <xsl:apply-templates/>
-            </xsl:template>
-            <xsl:template match="sup">
-                <xsl:text>&lt;sup></xsl:text>
-                <xsl:apply-templates/>
-                <xsl:text>&lt;/sup></xsl:text>
-            </xsl:template>
-            <xsl:template match="sm">
-                <xsl:text>&lt;span class="sc"></xsl:text>
-                <xsl:apply-templates/>
-                <xsl:text>&lt;/span></xsl:text>
-            </xsl:template>
-            <xsl:template match="i">
-                <xsl:text>&lt;i></xsl:text>
-                <xsl:apply-templates/>
-                <xsl:text>&lt;/i></xsl:text>
-            </xsl:template>
-            <xsl:template match="i[parent::forme_ancienne]">
-                <xsl:text>&lt;dfn></xsl:text>
-                <xsl:apply-templates/>
-                <xsl:text>&lt;/dfn></xsl:text>
-            </xsl:template>
-            <xsl:template match="i[parent::reference]">
-                <xsl:text>&lt;cite></xsl:text>
-                <xsl:apply-templates/>
-                <xsl:text>&lt;/cite></xsl:text>
-            </xsl:template>
-            <xsl:template match="date">
-                <xsl:text>&lt;time></xsl:text>
-                <xsl:apply-templates/>
-                <xsl:text>&lt;/time></xsl:text>
-            </xsl:template>
-            <xsl:template match="comment">
-                <xsl:text>&lt;br/></xsl:text>
-                <xsl:apply-templates/>
-            </xsl:template>
-            <xsl:template match="pg"/>
-        </xsl:stylesheet>''')
-    xslt_old_label2html = etree.parse(old_label2html)
-    transform_old_label2html = etree.XSLT(xslt_old_label2html)
-    # nettoyage typo, réutilisable
-    clean_start = re.compile('^[«—\-  ]+')
-    clean_end = re.compile('[»—  .,;]+$')
-    clean_markup = re.compile(',(</[^>]+>)') # sortir la virgule du markup (span, cite, dfn, ?)
-
-    # utilitaires pour extraire et nettoyer les formes anciennes
-    # relou, support xpath incomplet, on ne peut pas sortir le texte qui suit le dernier élément <i>
-    # <xsl:template match="i[position()=last()]/following-sibling::text()"/>
-    # On sort les notes, notamment pour DT60
-    # On corrige plus loin en traitement de chaîne de chars.
-    get_old_label = io.StringIO('''\
-        <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
-            <xsl:output method="text"/>
-            <xsl:template match="/">
-                <xsl:apply-templates/>
-            </xsl:template>
-            <xsl:template match="i">
-                <xsl:text>&lt;dfn></xsl:text>
-                <xsl:apply-templates/>
-                <xsl:text>&lt;/dfn></xsl:text>
-            </xsl:template>
-            <xsl:template match="reference"/>
-            <xsl:template match="date"/>
-            <xsl:template match="comment"/>
-            <xsl:template match="pg"/>
-            <xsl:template match="note"/>
-        </xsl:stylesheet>''')
-    xslt_get_old_label = etree.parse(get_old_label)
-    transform_old_label2dfn = etree.XSLT(xslt_get_old_label)
-
-    get_old_label_rich_date = io.StringIO('''\
-        <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
-            <xsl:output method="text"/>
-            <xsl:template match="/forme_ancienne">
-                <xsl:apply-templates select="date[1]"/>
-            </xsl:template>
-            <xsl:template match="date">
-                <xsl:apply-templates/>
-            </xsl:template>
-            <xsl:template match="sup">
-                <xsl:text>&lt;sup></xsl:text>
-                <xsl:apply-templates/>
-                <xsl:text>&lt;/sup></xsl:text>
-            </xsl:template>
-            <xsl:template match="sm">
-                <xsl:text>&lt;span class="sc"></xsl:text>
-                <xsl:apply-templates/>
-                <xsl:text>&lt;/span></xsl:text>
-            </xsl:template>
-            <xsl:template match="pg"/>
-        </xsl:stylesheet>''')
-    xslt_get_old_label_rich_date = etree.parse(get_old_label_rich_date)
-    transform_old_label2rich_date = etree.XSLT(xslt_get_old_label_rich_date)
-
-    get_old_label_rich_ref = io.StringIO('''\
-        <xsl:stylesheet version="1.0" xmlns:xsl="http://www.w3.org/1999/XSL/Transform">
-            <xsl:output method="text"/>
-            <xsl:template match="/forme_ancienne">
-                <xsl:apply-templates select="reference[1]"/>
-            </xsl:template>
-            <xsl:template match="reference">
-                <xsl:apply-templates/>
-            </xsl:template>
-            <xsl:template match="pg"/>
-            <xsl:template match="sup">
-                <xsl:text>&lt;sup></xsl:text>
-                <xsl:apply-templates/>
-                <xsl:text>&lt;/sup></xsl:text>
-            </xsl:template>
-            <xsl:template match="i">
-                <xsl:text>&lt;cite></xsl:text>
-                <xsl:apply-templates/>
-                <xsl:text>&lt;/cite></xsl:text>
-            </xsl:template>
-            <xsl:template match="sm">
-                <xsl:text>&lt;span class="sc"></xsl:text>
-                <xsl:apply-templates/>
-                <xsl:text>&lt;/span></xsl:text>
-            </xsl:template>
-            <xsl:template match="date">
-                <xsl:text>&lt;time></xsl:text>
-                <xsl:apply-templates/>
-                <xsl:text>&lt;/time></xsl:text>
-            </xsl:template>
-        </xsl:stylesheet>''')
-    xslt_get_old_label_rich_ref = etree.parse(get_old_label_rich_ref)
-    transform_old_label2rich_ref = etree.XSLT(xslt_get_old_label_rich_ref)
-
-    i = 0
-    for entry in tree.xpath('/DICTIONNAIRE/article'):
-        # un dictionnaire pour stocker les données relative à chaque article
-        place = {}
-        # id de l’article
-        place['id'] = entry.get('id')
-
-        # récupérer la mention de responsabilité attachée à la création du lieu
-        cursor.execute("SELECT responsibility_id FROM place WHERE place_id = '%s'" % place['id'])
-        responsibility_id = cursor.fetchone()[0]
-
-        # formes anciennes et attestations
-        # jusqu’à 47 formes anciennes pour une vedette, dans l’Aisne: `distinct-values(//article/count(forme_ancienne)`
-        # des formes anciennes sans forme !!!, ex: DT02-04777
-        # On garde 1 date et 1 ref par forme ancienne ; on place les rares exceptions dans le champs texte qu’on publiera
-
-        # Source XML :
-        #   <forme_ancienne>Inter <i>Estran</i> et <i>Abugniez</i> et <i>Gerigniez,</i>
-        #       <date>1168</date>
-        #       <reference>(cart. de l’abb. de Thenailles, f<sup>os</sup> 15, 20, 36)</reference>.
-        #   </forme_ancienne>
-        #
-        # Variables
-        #   * old_label_id
-        #       identifiant calculé de la forme ancienne
-        #       DT02-00043-03
-        #   * old_label_xml_str
-        #       élément <forme_ancienne> dans la source XML
-        #       <forme_ancienne>Inter <i>Estran</i> et <i>Abugniez</i> et <i>Gerigniez,</i> <date>1168</date> <reference>(cart. de l’abb. de Thenailles, f<sup>os</sup> 15, 20, 36)</reference>.</forme_ancienne>
-        #   * old_label_html_str
-        #       élément <forme_ancienne> converti en HTML
-        #       <p>Inter <dfn>Estran</dfn> et <dfn>Abugniez</dfn> et <dfn>Gerigniez</dfn>, <time>1168</time> (cart. de l’abb. de Thenailles, f<sup>os</sup> 15, 20, 36)</p>
-        #   * dfn
-        #       la/les forme(s) d’une entrée forme ancienne, en HTML
-        #       Inter <dfn>Estran</dfn> et <dfn>Abugniez</dfn> et <dfn>Gerigniez</dfn>
-        #   * rich_ref
-        #       la référence d’une entrée forme ancienne avec enrichissement typo, en HTML
-        #       cart. de l’abb. de Thenailles, f<sup>os</sup> 15, 20, 36
-        #   * rich_date
-        #       la date avec enrichissement typo, en HTML
-        #       <span class='sc">xiii</span><sup>e</sup> siècle (cf DT02-00048-03)
-        #   * date
-        #       la date sans enrichissement typo
-        #       xiiie siècle (idem)
-        if entry.xpath('forme_ancienne'):
-            n = 1
-            for old_label in entry.xpath('forme_ancienne'):
-                # ATTENTION: on ne conserve pas les formes anciennes sans label (not(i)),
-                # sauf si la forme ancienne est la première de la liste des formes anciennes (ou unique).
-                # Dans ce cas on reprend le label de l’article.
-                if old_label.xpath('not(i)') and n > 1:
-                    continue
-                old_label_id = place['id']+'-0'+str(n) if n < 10 else place['id']+'-'+str(n)
-                old_label_xml_str = tostring(old_label, encoding='unicode')
-                old_label_xml_str = ' '.join(old_label_xml_str.split())
-                tree = etree.fromstring(old_label_xml_str)
-                # tout le contenu de l’élément forme_ancienne, formaté en HTML
-                old_label_html_str = str(transform_old_label2html(tree))
-                old_label_html_str = re.sub(clean_start, '', old_label_html_str)
-                old_label_html_str = re.sub(clean_markup, '\\1,', old_label_html_str) # sortir les virgules des balises
-                old_label_html_str = re.sub(clean_end, '', old_label_html_str)
-                old_label_html_str = "<p>%s</p>" % (old_label_html_str) # on encapsule dans un <p> ? dans <li> ? Todo: à (re)voir
-                # sortir les préfixes "*" des formes anciennes et les conserver dans les références (moche)
-                old_label_html_str = old_label_html_str.replace('<dfn>*', '<dfn>')
-
-                # DFN
-                dfn = str(transform_old_label2dfn(tree))
-                dfn = re.sub(clean_start, '', dfn)
-                dfn = dfn.replace('<dfn>*', '<dfn>') # déprime de la gestion de l’"*" initiale (cf plus haut aussi)
-                # sortir la ponctuation des élements <dfn> avant normalisation de la fin de la chaîne complète (dfn)
-                # dfn = dfn.replace(',</dfn>', '</dfn>,')
-                dfn = re.sub('([, .; :]+)</dfn>', '</dfn>\\1', dfn)
-                dfn = re.sub(clean_end, '', dfn)
-                dfn = dfn.rstrip()  # ceintures bretelles
-                # On vire le texte qui suit le dernier élément <dfn> (support xpath insuffisant avec lxml)
-                pos = dfn.rfind('</dfn>')
-                # rfind retourne -1 si la chaîne n’est pas trouvée…
-                if pos != -1:
-                    dfn = dfn[:pos+6]
-                # des ponctuations illogiques du fait des traitement précédents, on standardise à la hache
-                dfn = re.sub('[, ;][, ;.:]{3,}', '. ', dfn)
-                # 7201 formes anciennes font plus de 100 chars : on coupe !
-                # TODO: corriger XML ou le code de chargement pour repositionner les balises dans la chaîne conservée
-                # use iterator: re.finditer('</dfn>', dfn)
-                if len(dfn) > 100:
-                    # on vire les balises, pour rien risquer…
-                    dfn = re.sub(tags, '', dfn)
-                    dfn = dfn[:100].strip() + '…'
-                # quand label du toponyme ancien est vide, on reprend celui de la vedette
-                # TODO: essayer d’affiner cette logique avec OC et SN
-                if not dfn:
-                    dfn = entry.xpath('vedette/sm[1]')[0].text.rstrip(',')
-                    dfn = dfn.strip()
-                    # print(placename['id']+' forme_ancienne sans label => '+dfn)
-
-                # Date des formes anciennes
-                # Parfois plusieurs dates pour une forme ancienne ; on n’inscrit en base que la première (cf XLST).
-                # Attention au mauvais formatage des dates dans les XML (des sauts de lignes intempestifs…)
-                rich_date = str(transform_old_label2rich_date(tree)).lstrip()
-                date = re.sub(tags, '', rich_date)
-                # remove multiple spaces
-                date = " ".join(date.split())
-                date = date2iso(date)
-
-                # print(rich_date + ' = ' + date)
-                # Ref (référence de la forme ancienne) ; 1 forme_ancienne avec plus d’une réf ! (pour l’instant, on les vire = choix du prestataire d’ailleurs…)
-                # contenu riche : i, sup, pg (on les sort en XSLT), date, sm
-                rich_ref = str(transform_old_label2rich_ref(tree)).strip()
-                rich_ref = rich_ref.lstrip('(').rstrip(')') # suppression des parenthèses
-                rich_ref = rich_ref.replace(',</cite>', '</cite>,')  # sortir la ponctuation du titre
-                # ref = re.sub(tags, '', rich_ref)
-                n += 1
-                i += 1
-                try:
-                    cursor.execute(
-                        "INSERT INTO place_old_label ("
-                            "old_label_id,"
-                            "rich_label,"
-                            "rich_date,"
-                            "text_date,"
-                            "rich_reference,"
-                            "responsibility_id,"
-                            "place_id)"
-                        "VALUES(?, ?, ?, ?, ?, ?, ?)",
-                            (old_label_id,
-                             dfn,
-                             rich_date,
-                             date,
-                             rich_ref,
-                             responsibility_id,
-                             place['id']))
-                except sqlite3.IntegrityError as e:
-                    print(e, "place %s" % (place['id']))
-                # db.commit()
-
-        else:
-            continue
-    db.commit()
-
-    # Remettre les valeurs vides à NULL… honteux et efficace:
-    cursor.execute("""
-        UPDATE place_old_label
-        SET
-        rich_date = CASE rich_date WHEN '' THEN NULL ELSE rich_date END,
-        text_date = CASE text_date WHEN '' THEN NULL ELSE text_date END,
-        rich_reference = CASE rich_reference WHEN '' THEN NULL ELSE rich_reference END
-    """)
-    db.commit()
-    # db.close()
-
+    # la mention de responsabilité attachée à la création de chaque lieu, lue une fois pour tout le dpt
+    responsibility_ids = None
+    batches = new_batches()
+    nb_articles, nb_old_labels = 0, 0
+    try:
+        for dpt, entry in iter_articles(path or get_dt_path(dt_id)):
+            if responsibility_ids is None:
+                cursor.execute("SELECT place_id, responsibility_id FROM place WHERE dpt = ?", (dpt,))
+                responsibility_ids = dict(cursor.fetchall())
+
+            place_id = entry.get('id')
+            if place_id not in responsibility_ids:
+                print("place %s not found" % place_id)
+                continue
+            old_labels = parse_old_labels(entry, place_id)
+            add_old_label_rows(batches, place_id, old_labels, responsibility_ids[place_id])
+            nb_articles += 1
+            nb_old_labels += len(old_labels)
+            if nb_articles % batch_size == 0:
+                insert_batches(db, cursor, batches)
+        insert_batches(db, cursor, batches)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return nb_old_labels
@@ -186,6 +186,15 @@ def update_insee_ref(db, cursor):
             db.commit()
 
 
+# set insee_commune.longitude and insee_commune.latitude from the '(long, lat)' longlat strings
+SET_COORDINATES_FROM_LONGLAT = """
+    UPDATE insee_commune SET
+      longitude = CAST(trim(substr(longlat, 2, instr(longlat, ',') - 2)) AS REAL),
+      latitude = CAST(trim(substr(longlat, instr(longlat, ',') + 1, length(longlat) - instr(longlat, ',') - 1)) AS REAL)
+    WHERE longlat IS NOT NULL
+"""
+
+
 def insert_longlat(db, cursor, method):
     """ """
     print("BUILD INSEE REF: set insee_commune.longlat\n==========================================")
@@ -214,6 +223,9 @@ def insert_longlat(db, cursor, method):
     else:
         return
 
+    cursor.execute(SET_COORDINATES_FROM_LONGLAT)
+    db.commit()
+
 
 def get_longlat(insee_code):
     """ """
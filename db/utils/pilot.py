@@ -47,27 +47,9 @@ insee.insert_longlat(db, cursor, 'tsv')
 # si on charge la liste de toutes les communes depuis 1943 (`france{AAAA}.txt`), appeler insee.update_insee_ref()
 # insee.update_insee_ref(db, cursor)
 
-DT_with_insee = [
-    "DT01", "DT02", "DT05", "DT07", "DT10",
-    "DT11", "DT14", "DT15", "DT18", "DT21",
-    "DT23", "DT24", "DT26", "DT27", "DT28",
-    "DT30", "DT34", "DT36", "DT41", "DT42",
-    "DT43", "DT44", "DT51", "DT52", "DT54",
-    "DT55", "DT56", "DT57", "DT58", "DT60",
-    "DT62", "DT64", "DT68", "DT71", "DT72",
-    "DT76", "DT77", "DT79", "DT80", "DT86",
-    "DT88", "DT89"]
-
-DT_with_insee = ["DT68"]
-
-for dt_id in DT_with_insee:
-    dpt_code = dt_id[-2:]
-    print("===%s processing===" % dt_id)
-    # bibl, place, place_alt_label, place_comment, place_description, place_feature_type
-    dt2db.insert_place_values(db, cursor, dt_id, u1["id"])
-    # place_old_labels
-    dt2db.insert_place_old_label(db, cursor, dt_id)
-    # debug.get_old_label(db, cursor, dt_id)
+# 2. Insertion des DT : par la CLI de l’application, qui parse les DT en parallèle (dt2db.DT_WITH_INSEE par défaut)
+#   python manage.py import-dt --data-dir=../dico-topo/data --workers=4
+#   python manage.py import-dt --data-dir=../dico-topo/data --dt=DT68
 
 db.close()
 print("--- %s seconds ---" % (time.time() - start_time))
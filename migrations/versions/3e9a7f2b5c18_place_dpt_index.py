@@ -0,0 +1,23 @@
+"""index the departement of the places, filtered by filter[dpt]
+
+Revision ID: 3e9a7f2b5c18
+Revises: 8b2f4c6d1e37
+Create Date: 2026-10-16 22:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3e9a7f2b5c18'
+down_revision = '8b2f4c6d1e37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_place_dpt', 'place', ['dpt'])
+
+
+def downgrade():
+    op.drop_index('ix_place_dpt', table_name='place')
@@ -0,0 +1,76 @@
+"""store the commune coordinates as floats indexed by an R*Tree
+
+Revision ID: 5d3c1e2a7b90
+Revises:
+Create Date: 2026-10-16 10:00:00.000000
+
+Databases made by db-create already have the columns and the index: stamp them with
+`flask db stamp 5d3c1e2a7b90` instead of upgrading them.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d3c1e2a7b90'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+RTREE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS insee_commune_rtree "
+    "USING rtree(id, min_lon, max_lon, min_lat, max_lat, +insee_code)",
+
+    "CREATE TRIGGER IF NOT EXISTS insee_commune_rtree_insert AFTER INSERT ON insee_commune "
+    "WHEN new.longitude IS NOT NULL AND new.latitude IS NOT NULL "
+    "BEGIN "
+    "INSERT INTO insee_commune_rtree (min_lon, max_lon, min_lat, max_lat, insee_code) "
+    "VALUES (new.longitude, new.longitude, new.latitude, new.latitude, new.insee_code); "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS insee_commune_rtree_update "
+    "AFTER UPDATE OF insee_code, longitude, latitude ON insee_commune "
+    "BEGIN "
+    "DELETE FROM insee_commune_rtree WHERE insee_code = old.insee_code; "
+    "INSERT INTO insee_commune_rtree (min_lon, max_lon, min_lat, max_lat, insee_code) "
+    "SELECT new.longitude, new.longitude, new.latitude, new.latitude, new.insee_code "
+    "WHERE new.longitude IS NOT NULL AND new.latitude IS NOT NULL; "
+    "END",
+
+    "CREATE TRIGGER IF NOT EXISTS insee_commune_rtree_delete AFTER DELETE ON insee_commune "
+    "BEGIN "
+    "DELETE FROM insee_commune_rtree WHERE insee_code = old.insee_code; "
+    "END",
+)
+
+
+def upgrade():
+    op.add_column('insee_commune', sa.Column('longitude', sa.Float(), nullable=True))
+    op.add_column('insee_commune', sa.Column('latitude', sa.Float(), nullable=True))
+
+    # backfill the coordinates from the '(long, lat)' strings
+    op.execute("""
+        UPDATE insee_commune SET
+          longitude = CAST(trim(substr(longlat, 2, instr(longlat, ',') - 2)) AS REAL),
+          latitude = CAST(trim(substr(longlat, instr(longlat, ',') + 1, length(longlat) - instr(longlat, ',') - 1)) AS REAL)
+        WHERE longlat IS NOT NULL
+    """)
+
+    for statement in RTREE_DDL:
+        op.execute(statement)
+    op.execute("""
+        INSERT INTO insee_commune_rtree (min_lon, max_lon, min_lat, max_lat, insee_code)
+        SELECT longitude, longitude, latitude, latitude, insee_code FROM insee_commune
+        WHERE longitude IS NOT NULL AND latitude IS NOT NULL
+    """)
+
+
+def downgrade():
+    for trigger in ('insee_commune_rtree_insert', 'insee_commune_rtree_update', 'insee_commune_rtree_delete'):
+        op.execute("DROP TRIGGER IF EXISTS %s" % trigger)
+    op.execute("DROP TABLE IF EXISTS insee_commune_rtree")
+
+    with op.batch_alter_table('insee_commune') as batch_op:
+        batch_op.drop_column('latitude')
+        batch_op.drop_column('longitude')
@@ -0,0 +1,36 @@
+"""add the outbox of the index operations sent by the index-worker command
+
+Revision ID: 8b2f4c6d1e37
+Revises: 5d3c1e2a7b90
+Create Date: 2026-10-16 21:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2f4c6d1e37'
+down_revision = '5d3c1e2a7b90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'index_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('index_name', sa.String(length=200), nullable=False),
+        sa.Column('doc_id', sa.String(length=100), nullable=False),
+        sa.Column('op', sa.String(length=10), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=True),
+        sa.Column('creation_date', sa.DateTime(), nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_index_outbox_document', 'index_outbox', ['index_name', 'doc_id'])
+
+
+def downgrade():
+    op.drop_index('ix_index_outbox_document', table_name='index_outbox')
+    op.drop_table('index_outbox')
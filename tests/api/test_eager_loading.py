@@ -0,0 +1,127 @@
+from sqlalchemy import event
+
+from app.models import Bibl, Responsibility, User
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+
+class TestEagerLoading(TestBaseServer):
+    """
+    The number of SQL queries made to serve a page must not depend on the number of resources in the page
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.db.drop_all()
+        self.db.create_all()
+        load_fixtures(self.db, nb_places=6)
+
+    def count_queries(self, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        # the objects still in the session from a previous request would not be loaded again
+        self.db.session.expunge_all()
+        event.listen(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            r, status, res = self.api_get(url)
+        finally:
+            event.remove(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        self.assert200(r)
+        return len(statements), res
+
+    def assertConstantQueryCount(self, url, small=2, large=6):
+        sep = "&" if "?" in url else "?"
+        nb_small, res_small = self.count_queries("{0}{1}page[size]={2}".format(url, sep, small))
+        nb_large, res_large = self.count_queries("{0}{1}page[size]={2}".format(url, sep, large))
+        self.assertGreater(len(res_large["data"]), len(res_small["data"]))
+        self.assertEqual(nb_small, nb_large, url)
+
+    def test_place_facades(self):
+        self.assertConstantQueryCount("/places?with-relationships=links")
+        self.assertConstantQueryCount("/places?with-relationships=links&include=commune,old-labels,descriptions")
+        self.assertConstantQueryCount("/places?facade=search")
+        self.assertConstantQueryCount("/places?facade=map")
+        self.assertConstantQueryCount("/places?facade=lp")
+
+    def test_linked_places(self):
+        self.assertConstantQueryCount("/places?include=linked-places")
+        _, res = self.count_queries("/places?include=linked-places&page[size]=20")
+        linked_places = {obj["id"]: sorted(lp["id"] for lp in obj["relationships"]["linked-places"]["data"])
+                         for obj in res["data"]}
+        self.assertEqual(["DT99-00101"], linked_places["DT99-00001"])
+        self.assertEqual([], linked_places["DT99-00002"])
+        self.assertEqual([], linked_places["DT99-00101"])
+
+    def test_place_old_label_facades(self):
+        self.assertConstantQueryCount("/place-old-labels")
+        self.assertConstantQueryCount("/place-old-labels?include=place,responsibility")
+        self.assertConstantQueryCount("/place-old-labels?facade=search")
+        self.assertConstantQueryCount("/place-old-labels?facade=map")
+        self.assertConstantQueryCount("/place-old-labels?facade=flat-old-label")
+
+    def test_commune_facade(self):
+        self.assertConstantQueryCount("/communes")
+        self.assertConstantQueryCount("/communes?include=canton,place")
+
+    def test_insee_ref_facades(self):
+        self.assertConstantQueryCount("/insee-refs")
+        self.assertConstantQueryCount("/insee-refs?facade=search&filter[type]=CT")
+
+    def test_citable_content_facades(self):
+        self.assertConstantQueryCount("/place-descriptions")
+        self.assertConstantQueryCount("/place-descriptions?facade=flat-place-desc")
+        self.assertConstantQueryCount("/place-comments")
+        self.assertConstantQueryCount("/place-comments?facade=flat-place-comment")
+        self.assertConstantQueryCount("/place-feature-types?include=place")
+
+    def test_responsibility_facades(self):
+        self.assertConstantQueryCount("/responsibilities?include=bibl,user")
+        self.assertConstantQueryCount("/responsibilities?facade=flat-resp")
+
+    def add_bibls_and_users(self):
+        for i in range(1, 7):
+            user = User(username="User%s" % i)
+            bibl = Bibl(abbr="DT%s" % str(i).zfill(2), bibl="DT %s" % i)
+            self.db.session.add_all([Responsibility(user=user, bibl=bibl, num_start_page=n) for n in range(i)])
+        self.db.session.commit()
+
+    def test_bibl_facade(self):
+        self.add_bibls_and_users()
+        self.assertConstantQueryCount("/bibls")
+
+    def test_user_facade(self):
+        self.add_bibls_and_users()
+        self.assertConstantQueryCount("/users")
+        self.assertConstantQueryCount("/users?include=responsibilities")
+        self.assertConstantQueryCount("/users?without-relationships")
+
+    def test_relationship_endpoints(self):
+        nb_small, res = self.count_queries("/insee-refs/DEP_99/children")
+        self.assertEqual(1, len(res["data"]))
+        nb_large, res = self.count_queries("/insee-refs/AR_99_1/children")
+        self.assertEqual(6, len(res["data"]))
+        self.assertEqual(nb_small, nb_large)
+        # the pages are loaded with what their resources read
+        self.assertConstantQueryCount("/insee-refs/AR_99_1/children")
+        self.assertConstantQueryCount("/insee-refs/AR_99_1/relationships/children")
+
+        self.assertConstantQueryCount("/places/DT99-00002/relationships/old-labels?include=place,responsibility",
+                                      small=1, large=2)
+        self.assertConstantQueryCount("/insee-refs/AR_99_1/relationships/children?include=parent,children")
+
+    def test_related_resources_inclusion(self):
+        # the included resources are made from the related objects loaded with the resource
+        nb_small, res = self.count_queries("/insee-refs/DEP_99/children?include=parent,children")
+        self.assertEqual(1, len(res["data"]))
+        nb_large, res = self.count_queries("/insee-refs/AR_99_1/children?include=parent,children")
+        self.assertEqual(6, len(res["data"]))
+        self.assertEqual(["AR_99_1"], [r["id"] for r in res["included"]])
+        self.assertEqual(nb_small, nb_large)
+        # or with a query by type for a page
+        self.assertConstantQueryCount("/insee-refs/AR_99_1/children?include=parent")
+        self.assertConstantQueryCount("/places/DT99-00002/old-labels?include=place,responsibility", small=1, large=2)
+        _, res = self.count_queries("/places/DT99-00002/old-labels?include=place,responsibility&page[size]=1")
+        self.assertEqual({"place", "responsibility"}, {r["type"] for r in res["included"]})
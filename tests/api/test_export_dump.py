@@ -0,0 +1,94 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+from click.testing import CliRunner
+
+from app.cli import make_cli, split_id_space
+from app.models import Place
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+
+class TestExportDump(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.cli = make_cli(self.app)
+        self.cli_runner = CliRunner()
+        self.dump_dir = tempfile.mkdtemp()
+
+        self.db.drop_all()
+        self.db.create_all()
+        load_fixtures(self.db, nb_places=6)
+
+    def tearDown(self):
+        shutil.rmtree(self.dump_dir)
+        super().tearDown()
+
+    def dump(self, filename, *args):
+        path = os.path.join(self.dump_dir, filename)
+        result = self.cli_runner.invoke(self.cli, ["export-dump", "--output", path, "--host", "http://localhost",
+                                                   "--batch-size", "2", *args])
+        self.assertIsNone(result.exception, result.output)
+        self.assertNotIn("NOT OK", result.output)
+        return path, result.output
+
+    @staticmethod
+    def read_lines(path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+    def test_ndjson(self):
+        path, output = self.dump("places.ndjson.gz")
+        self.assertIn("9 places dumped", output)
+        features = self.read_lines(path)
+        self.assertEqual(9, len(features))
+        # the features are the ones of the API export, in the id order
+        r, status, expected = self.api_get("/places?export=linkedplaces&page[size]=20")
+        self.assertEqual(sorted(expected["features"], key=lambda f: f["@id"]), features)
+        self.assertEqual([], [name for name in os.listdir(self.dump_dir) if name.endswith(".tmp")])
+
+    def test_feature_collection(self):
+        path, output = self.dump("places.json", "--format", "linkedplaces")
+        with open(path, "r", encoding="utf-8") as f:
+            collection = json.load(f)
+        self.assertEqual("FeatureCollection", collection["type"])
+        self.assertIn("@context", collection)
+        self.assertEqual(9, len(collection["features"]))
+
+    def test_filters(self):
+        path, output = self.dump("between.ndjson.gz", "--between", "DT99-00002,DT99-00004")
+        self.assertEqual(["Commune 2", "Commune 3", "Commune 4"],
+                         [f["properties"]["title"] for f in self.read_lines(path)])
+        path, output = self.dump("dpt.ndjson.gz", "--dpt", "01,02")
+        self.assertEqual([], self.read_lines(path))
+
+    def test_workers(self):
+        path, output = self.dump("places.ndjson.gz")
+        expected = self.read_lines(path)
+        path, output = self.dump("places.workers.ndjson.gz", "--workers", "3")
+        self.assertIn("9 places dumped", output)
+        self.assertEqual(expected, sorted(self.read_lines(path), key=lambda f: f["@id"]))
+
+    def test_workers_split_the_filtered_places(self):
+        with self.app.app_context():
+            for place in Place.query.filter(Place.id.in_(["DT99-00001", "DT99-00002", "DT99-00101"])):
+                place.dpt = "01"
+            self.db.session.commit()
+            self.assertEqual(["DT99-00001,DT99-00002", "DT99-00101,DT99-00101"],
+                             split_id_space(Place, None, 2, filters=[Place.dpt.in_(["01"])]))
+
+        path, output = self.dump("dpt.ndjson.gz", "--dpt", "01")
+        expected = self.read_lines(path)
+        self.assertEqual(3, len(expected))
+        path, output = self.dump("dpt.workers.ndjson.gz", "--dpt", "01", "--workers", "2")
+        self.assertEqual(expected, sorted(self.read_lines(path), key=lambda f: f["@id"]))
+
+    def test_failure(self):
+        result = self.cli_runner.invoke(self.cli, ["export-dump", "--output", os.path.join(self.dump_dir, "no", "dump"),
+                                                   "--host", "http://localhost"])
+        self.assertIn("NOT OK", result.output)
+        self.assertEqual(1, result.exit_code)
@@ -0,0 +1,98 @@
+import json
+from collections import namedtuple
+from unittest import mock
+
+from sqlalchemy import event
+
+from app.api.search import SearchIndexManager
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+Hit = namedtuple("Hit", ("type", "id"))
+
+
+class TestExports(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.db.drop_all()
+        self.db.create_all()
+        load_fixtures(self.db, nb_places=6)
+
+    def export(self, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            r, status, res = self.api_get(url)
+        finally:
+            event.remove(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        self.assert200(r)
+        return len(statements), res
+
+    def test_collection_export(self):
+        nb_queries, res = self.export("/places?export=linkedplaces&page[size]=20")
+        self.assertEqual("FeatureCollection", res["type"])
+        features = {f["@id"].rsplit("/", 1)[-1]: f for f in res["features"]}
+        self.assertEqual(9, len(features))
+
+        feature = features["DT99-00001"]
+        self.assertEqual("Commune 1", feature["properties"]["title"])
+        self.assertEqual([4.1, 46.1], feature["geometry"]["geometries"][0]["coordinates"])
+        self.assertEqual(["Vieux nom 1.1", "Vieux nom 1.2"], sorted(n["toponym"] for n in feature["names"]))
+        self.assertEqual({"earliest": "1201", "latest": "1202"}, feature["when"]["timespans"][0]["start"])
+        self.assertEqual([{"label": "commune"}], feature["types"])
+        self.assertEqual(["Commune du canton 1"], [d["value"] for d in feature["descriptions"]])
+        self.assertEqual([("http://id.insee.fr/geo/region/99", "région de Région de test"),
+                          ("http://id.insee.fr/geo/departement/99", "département de Département de test"),
+                          ("http://localhost/api/1.0/places/DT99-00101", "Ferme 1")],
+                         [(r["relationTo"], r["label"]) for r in feature["relations"]])
+
+        feature = features["DT99-00101"]
+        self.assertEqual([4.1, 46.1], feature["geometry"]["geometries"][0]["coordinates"])
+        self.assertIn(("http://localhost/api/1.0/communes/99001", "Commune 1"),
+                      [(r["relationTo"], r["label"]) for r in feature["relations"]])
+
+        # the export reads the objects of the page, loaded once for the whole page
+        nb_small, res = self.export("/places?export=linkedplaces&page[size]=2")
+        self.assertEqual(2, len(res["features"]))
+        self.assertEqual(nb_small, nb_queries)
+
+    def test_ndjson_export(self):
+        nb_queries, expected = self.export("/places?export=linkedplaces&page[size]=4")
+        r = self.get("/places?export=inline-linkedplaces&page[size]=4")
+        self.assert200(r)
+        self.assertEqual("application/x-ndjson", r.mimetype)
+        lines = r.data.decode("utf-8").splitlines()
+        # one compact feature per line
+        self.assertEqual(4, len(lines))
+        self.assertNotIn(": ", lines[0])
+        self.assertEqual(expected["features"], [json.loads(line) for line in lines])
+
+        hits = [Hit("place", "DT99-00004"), Hit("place", "DT99-00002")]
+        query_index = mock.patch.object(SearchIndexManager, "query_index", return_value=(hits, [], None, len(hits)))
+        with query_index:
+            r = self.get("/search?query=*&export=inline-linkedplaces")
+        self.assertEqual("application/x-ndjson", r.mimetype)
+        self.assertEqual(["Commune 4", "Commune 2"],
+                         [json.loads(line)["properties"]["title"] for line in r.data.decode("utf-8").splitlines()])
+
+    def test_single_export(self):
+        nb_queries, res = self.export("/places/DT99-00003?export=linkedplaces")
+        self.assertEqual(["Commune 3"], [f["properties"]["title"] for f in res["features"]])
+
+    def test_unknown_format(self):
+        r, status, res = self.api_get("/places?export=geojson")
+        self.assert400(r)
+        self.assertIn("linkedplaces", res["errors"]["detail"])
+
+    def test_search_export(self):
+        hits = [Hit("place", "DT99-00004"), Hit("place-old-label", "1"), Hit("place", "DT99-00002")]
+        query_index = mock.patch.object(SearchIndexManager, "query_index", return_value=(hits, [], None, len(hits)))
+        with query_index:
+            nb_queries, res = self.export("/search?query=*&export=linkedplaces")
+        # the old labels are not exported and the search engine order is kept
+        self.assertEqual(["Commune 4", "Commune 2"], [f["properties"]["title"] for f in res["features"]])
@@ -0,0 +1,86 @@
+from sqlalchemy import event
+
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+
+class TestFilters(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.db.drop_all()
+        self.db.create_all()
+        load_fixtures(self.db, nb_places=6)
+
+    def get_ids(self, url):
+        r, status, res = self.api_get(url)
+        self.assert200(r)
+        return sorted(obj["id"] for obj in res["data"])
+
+    def test_equality(self):
+        self.assertEqual(9, len(self.get_ids("/places?without-relationships&filter[dpt]=99")))
+        self.assertEqual([], self.get_ids("/places?without-relationships&filter[dpt]=01"))
+        self.assertEqual(["DT99-00002"], self.get_ids("/places?without-relationships&filter[commune-insee-code]=99002"))
+        self.assertEqual(["REG_99"], self.get_ids("/insee-refs?without-relationships&filter[level]=1"))
+        # the values are bound parameters
+        self.assertEqual([], self.get_ids("/places?without-relationships&filter[dpt]=99' OR '1'='1"))
+
+    def test_null(self):
+        self.assertEqual(["DT99-00101", "DT99-00103", "DT99-00105"],
+                         self.get_ids("/places?without-relationships&filter[commune-insee-code]"))
+        self.assertEqual(6, len(self.get_ids("/places?without-relationships&filter[!commune-insee-code]")))
+
+    def test_operators(self):
+        self.assertEqual(["DT99-00001", "DT99-00003"],
+                         self.get_ids("/places?without-relationships&filter[commune-insee-code][in]=99001,99003"))
+        self.assertEqual(["DT99-00101", "DT99-00103", "DT99-00105"],
+                         self.get_ids("/places?without-relationships&filter[id][prefix]=DT99-001"))
+        self.assertEqual(["AR_99_1", "DEP_99"],
+                         self.get_ids("/insee-refs?without-relationships&filter[level][between]=2,3"))
+        self.assertEqual(["AR_99_1", "DEP_99", "REG_99"],
+                         self.get_ids("/insee-refs?without-relationships&filter[level][lt]=4"))
+        self.assertEqual(6, len(self.get_ids("/insee-refs?without-relationships&filter[level][gte]=4")))
+        self.assertEqual(["DT99-00005", "DT99-00006"],
+                         self.get_ids("/places?without-relationships&filter[commune-insee-code][gt]=99004"))
+
+    def test_wrong_operators(self):
+        for url in ("/places?filter[dpt][like]=9", "/places?filter[dpt][between]=1",
+                    "/places?filter[dpt][gt]=1,2", "/insee-refs?filter[level][gt]=one",
+                    "/places?filter[commune]=99001", "/insee-refs?filter[level][prefix]=2"):
+            r, status, res = self.api_get(url)
+            self.assert400(r, url)
+
+    def test_uses_the_indexes(self):
+        self.app.debug = True
+        try:
+            r, status, res = self.api_get("/places?without-relationships&filter[dpt][in]=98,99&explain")
+            self.assertIn("USING INDEX ix_place_dpt", r.headers["X-Query-Plan"])
+            r, status, res = self.api_get("/insee-refs?without-relationships&filter[type][prefix]=C&explain")
+            self.assertIn("USING INDEX ix_insee_ref_type", r.headers["X-Query-Plan"])
+        finally:
+            self.app.debug = False
+        r, status, res = self.api_get("/places?without-relationships&filter[dpt][in]=98,99&explain")
+        self.assertNotIn("X-Query-Plan", r.headers)
+
+    def test_slow_query_plan(self):
+        self.app.config["SLOW_QUERY_TIME"] = "0"
+        try:
+            r, status, res = self.api_get("/places?without-relationships&filter[commune-insee-code][in]=99001")
+            self.assertIn("X-Query-Plan", r.headers)
+        finally:
+            self.app.config["SLOW_QUERY_TIME"] = None
+
+    def test_statement_cache(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            self.get_ids("/places?without-relationships&without-count&filter[commune-insee-code]=99001")
+            self.get_ids("/places?without-relationships&without-count&filter[commune-insee-code]=99002")
+        finally:
+            event.remove(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        # the same statement is prepared for both values
+        self.assertEqual(statements[:len(statements) // 2], statements[len(statements) // 2:])
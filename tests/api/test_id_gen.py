@@ -92,6 +92,99 @@ class TestIdGen(TestBaseServer):
         with self.assertRaises(ValueError):
             result.output.rindex('There is (probably) no room anymore!')
 
+    def test_allocate_primary_values(self):
+        used = [IdRegister.make_primary_value(n) for n in range(0, IdRegister._ID_MAX + 1, 997)]
+        self.db.session.bulk_insert_mappings(IdRegister, [{"primary_value": v} for v in used])
+        self.db.session.commit()
+
+        values = IdRegister.allocate_primary_values(1000)
+        self.assertEqual(1000, len(set(values)))
+        self.assertEqual(set(), set(values) & set(used))
+        for value in values:
+            self.assertEqual(value, IdRegister.make_primary_value(IdRegister.parse_primary_value(value)))
+        self.assertIsNone(IdRegister.parse_primary_value("DT01-0000000001"))
+
+    def test_bulk_register(self):
+        primary_values = IdRegister.bulk_register(["DT01-1", "DT01-2"])
+        self.db.session.commit()
+        self.assertEqual(["DT01-1", "DT01-2"], [IdRegister.query.get(v).secondary_value for v in primary_values])
+
+    def test_append(self):
+        result = self.cli_runner.invoke(self.cli, ['id-register', '--append'], input='y')
+        self.assertEqual(0, result.exit_code)
+        self.assertIn("999 new ids", result.output)
+        reg = IdRegister.query.all()
+        self.assertEqual(sorted(p.id for p in Place.query.all()), sorted(r.secondary_value for r in reg))
+        self.assertTrue(all(IdRegister.parse_primary_value(r.primary_value) is not None for r in reg))
+
+    def test_register_force(self):
+        self.db.session.add_all([
+            IdRegister("DT01-0000000001", "P00000011"),
+            IdRegister("DT01-9999999999", "DT01-0000000002"),
+        ])
+        self.db.session.commit()
+
+        result = self.cli_runner.invoke(self.cli, ['id-register', '--register', '--force', '--auto-commit'])
+        self.assertEqual(0, result.exit_code)
+        self.assertIn("2 entries reset to their place id", result.output)
+        self.assertIn("997 registrations", result.output)
+        self.db.session.expire_all()
+        reg = IdRegister.query.all()
+        self.assertEqual(sorted(p.id for p in Place.query.all()), sorted(r.primary_value for r in reg))
+        self.assertTrue(all(r.primary_value == r.secondary_value for r in reg))
+
+    def test_append_twice(self):
+        self.db.session.add(Place(id="P00000001", country="fr", dpt="99", label="Metz",
+                                  responsibility_id=Place.query.first().responsibility_id))
+        self.db.session.commit()
+        result = self.cli_runner.invoke(self.cli, ['id-register', '--append', '--auto-commit'])
+        self.assertIn("999 new ids", result.output)
+        self.assertIn("1 unregistered ids already in the new format", result.output)
+        # the appended place ids are secondary values: they are not appended again
+        result = self.cli_runner.invoke(self.cli, ['id-register', '--append', '--auto-commit'])
+        self.assertIn("no ids from Place to append", result.output)
+        self.assertEqual(999, IdRegister.query.count())
+
+    def test_dry_run(self):
+        result = self.cli_runner.invoke(self.cli, ['id-register', '--register', '--update-app', '--dry-run'])
+        self.assertEqual(0, result.exit_code)
+        self.assertIn("999 registrations", result.output)
+        self.assertIn("[register.dry-run]", result.output)
+        self.assertEqual(0, IdRegister.query.count())
+
+    def test_update_app(self):
+        place = Place.query.get("DT01-0000000001")
+        for i in range(3):
+            self.db.session.add(PlaceOldLabel(old_label_id="DT01-1-%s" % (3 - i), place=place,
+                                              responsibility_id=place.responsibility_id, rich_label="Mes %s" % i))
+        self.db.session.add_all([
+            # the place ids registered as they are are kept
+            IdRegister("DT01-0000000002", "DT01-0000000002"),
+            # the first registered id is used
+            IdRegister("DT01-0000000001", "P00000011"),
+            IdRegister("DT01-0000000001", "P00000022"),
+            IdRegister("DT01-0000000003", "P00000033"),
+            # not a place id
+            IdRegister("DT01-9999999999", "P00000044"),
+        ])
+        self.db.session.commit()
+
+        result = self.cli_runner.invoke(self.cli, ['id-register', '--update-app'])
+        self.assertEqual(0, result.exit_code)
+        self.assertIn("2 ids from the register", result.output)
+        self.assertIn("place_description: 1 rows", result.output)
+
+        self.db.session.expire_all()
+        self.assertIsNone(Place.query.get("DT01-0000000001"))
+        self.assertIsNotNone(Place.query.get("DT01-0000000002"))
+        place = Place.query.get("P00000011")
+        self.assertEqual(["Ferme en partie détruite par le feu"], [d.content for d in place.descriptions])
+        self.assertEqual(1, len(place.comments))
+        self.assertEqual([("P00000011-1", "Mes 0"), ("P00000011-2", "Mes 1"), ("P00000011-3", "Mes 2")],
+                         [(o.old_label_id, o.rich_label) for o in sorted(place.old_labels, key=lambda o: o.id)])
+        self.assertEqual("Metz", Place.query.get("P00000033").label)
+        self.assertEqual(999, Place.query.count())
+
     def test_append_from_scratch(self):
         result = self.cli_runner.invoke(self.cli, ['id-register', '--clear', '--append'], input='y')
         #assert result.exit_code == 0
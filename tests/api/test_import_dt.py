@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+
+from click.testing import CliRunner
+
+from app.cli import make_cli, imap_unordered_bounded
+from app.models import Place, PlaceOldLabel, PlaceFeatureType, IdRegister, User
+from tests.base_server import TestBaseServer
+
+DT = """<?xml version="1.0" encoding="UTF-8"?>
+<DICTIONNAIRE dep="{dpt}">
+<article id="P{dpt}000011" old-id="DT{dpt}-00001" pg="12">
+<vedette><sm>Abbeville</sm>,</vedette>
+<definition>hameau. <typologie>hameau</typologie></definition>
+<forme_ancienne><i>Abbatis villa,</i> <date>1100</date> <reference>(cart. de <i>Saint-Riquier</i>)</reference>.</forme_ancienne>
+<forme_ancienne><i>Abevile,</i> <date>xiii<sup>e</sup> siècle</date>.</forme_ancienne>
+<commentaire><p>Un commentaire.</p></commentaire>
+</article>
+<article id="P{dpt}000022" old-id="DT{dpt}-00002" pg="13">
+<vedette><sm>La Ferme</sm>,</vedette>
+<forme_ancienne><i>Firma,</i> <date>vers 1300</date>.</forme_ancienne>
+</article>
+</DICTIONNAIRE>
+"""
+
+
+class TestImportDT(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.cli = make_cli(self.app)
+        self.cli_runner = CliRunner()
+        self.data_dir = tempfile.mkdtemp()
+        for dpt in ("97", "98", "99"):
+            os.mkdir(os.path.join(self.data_dir, "DT%s" % dpt))
+            with open(os.path.join(self.data_dir, "DT%s" % dpt, "output7.xml"), "w", encoding="utf-8") as f:
+                f.write(DT.format(dpt=dpt))
+
+        self.db.drop_all()
+        self.db.create_all()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+        super().tearDown()
+
+    def import_dt(self, *args):
+        return self.cli_runner.invoke(self.cli, ["import-dt", "--data-dir", self.data_dir, *args])
+
+    def test_import(self):
+        result = self.import_dt("--dt", "DT99", "--batch-size", "1")
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn("[1/1] DT99: 2 places, 3 old labels", result.output)
+
+        place = Place.query.get("P99000011")
+        self.assertEqual("Abbeville", place.label)
+        self.assertEqual("99", place.dpt)
+        self.assertEqual("delisle", place.responsibility.user.username)
+        self.assertEqual(["Hameau. <a>hameau</a>"], [d.content for d in place.descriptions])
+        self.assertEqual(["hameau"], [f.term for f in PlaceFeatureType.query.filter_by(place_id=place.id)])
+        self.assertEqual([("P99000011-01", "<dfn>Abbatis villa</dfn>", "1100", place.responsibility_id),
+                          ("P99000011-02", "<dfn>Abevile</dfn>", "13", place.responsibility_id)],
+                         [(o.old_label_id, o.rich_label, o.text_date, o.responsibility_id)
+                          for o in sorted(place.old_labels, key=lambda o: o.old_label_id)])
+        self.assertEqual("DT99-00002", IdRegister.query.get("P99000022").secondary_value)
+        # the empty values are NULL
+        self.assertIsNone(PlaceOldLabel.query.filter_by(old_label_id="P99000022-01").one().rich_reference)
+        self.assertEqual([], Place.query.get("P99000022").descriptions)
+
+    def test_workers(self):
+        result = self.import_dt("--dt", "DT97,DT98,DT99,DT96", "--workers", "2")
+        self.assertEqual(1, result.exit_code, result.output)
+        self.assertIn("3 DTs imported: 6 places, 9 old labels", result.output)
+        self.assertIn("DT96: NOT OK", result.output)
+        self.assertEqual(6, Place.query.count())
+        self.assertEqual(1, User.query.count())
+        # the rows breaking a constraint are reported and skipped
+        result = self.import_dt("--dt", "DT99")
+        self.assertIn("UNIQUE constraint failed: place.place_id insert place, place P99000011", result.output)
+        self.assertEqual(6, Place.query.count())
+        self.assertEqual(9, PlaceOldLabel.query.count())
+
+    def test_bounded_submissions(self):
+        lock = threading.Lock()
+        submitted = []
+
+        def parse(item):
+            with lock:
+                submitted.append(item)
+            return item
+
+        pool = ThreadPool(2)
+        try:
+            consumed = []
+            for result in imap_unordered_bounded(pool, parse, range(10), 3):
+                # the items are only submitted when the results are consumed
+                self.assertLessEqual(len(submitted), len(consumed) + 3)
+                consumed.append(result)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(list(range(10)), sorted(consumed))
@@ -0,0 +1,69 @@
+import json
+import os
+
+from click.testing import CliRunner
+
+from app.cli import make_cli
+from app.models import User
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "fixtures", "dt")
+# the rows inserted by the importer which read the whole DT with etree.parse, one article at a time
+EXPECTED_PATH = os.path.join(DATA_DIR, "DT01", "expected.json")
+
+# the imported rows, without the generated ids and dates
+DT_ROWS = {
+    "bibl": "SELECT abbr, bibl, bnf_catalogue_ark, gallica_ark, gallica_page_one, gallica_IIIF_availability "
+            "FROM bibl WHERE id IN (SELECT r.bibl_id FROM responsibility r "
+            "JOIN place p ON p.responsibility_id = r.id WHERE p.place_id LIKE 'P%')",
+    "id_register": "SELECT primary_value, secondary_value FROM id_register WHERE secondary_value LIKE 'DT01-%' "
+                   "ORDER BY primary_value",
+    "place": "SELECT p.place_id, p.label, p.country, p.dpt, p.commune_insee_code, p.localization_commune_insee_code, "
+             "p.localization_commune_relation_type, u.username, b.abbr, r.num_start_page FROM place p "
+             "JOIN responsibility r ON r.id = p.responsibility_id JOIN user u ON u.id = r.user_id "
+             "LEFT JOIN bibl b ON b.id = r.bibl_id WHERE p.place_id LIKE 'P%' ORDER BY p.place_id",
+    "place_comment": "SELECT c.place_id, c.content, c.responsibility_id = p.responsibility_id FROM place_comment c "
+                     "JOIN place p ON p.place_id = c.place_id WHERE p.place_id LIKE 'P%' ORDER BY c.place_id",
+    "place_description": "SELECT d.place_id, d.content, d.responsibility_id = p.responsibility_id "
+                         "FROM place_description d JOIN place p ON p.place_id = d.place_id "
+                         "WHERE p.place_id LIKE 'P%' ORDER BY d.place_id",
+    "place_feature_type": "SELECT f.place_id, f.term, f.responsibility_id = p.responsibility_id "
+                          "FROM place_feature_type f JOIN place p ON p.place_id = f.place_id "
+                          "WHERE p.place_id LIKE 'P%' ORDER BY f.place_id, f.term",
+    "place_old_label": "SELECT o.old_label_id, o.rich_label, o.rich_date, o.text_date, o.rich_reference, o.place_id, "
+                       "o.responsibility_id = p.responsibility_id FROM place_old_label o "
+                       "JOIN place p ON p.place_id = o.place_id WHERE p.place_id LIKE 'P%' ORDER BY o.old_label_id",
+}
+
+
+def dump_dt_rows(connection):
+    """
+    :return: the rows of each table imported from the DT01 fixture
+    """
+    return {table: [list(row) for row in connection.execute(query)] for table, query in DT_ROWS.items()}
+
+
+class TestImportDTOutput(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.cli = make_cli(self.app)
+        self.cli_runner = CliRunner()
+        self.db.drop_all()
+        self.db.create_all()
+        # the communes of the insee codes of the DT
+        load_fixtures(self.db, nb_places=2)
+
+    def test_same_rows_as_the_previous_importer(self):
+        result = self.cli_runner.invoke(self.cli, ["import-dt", "--data-dir", DATA_DIR, "--dt", "DT01",
+                                                   "--batch-size", "2"])
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn("DT01: 4 places, 6 old labels", result.output)
+
+        with open(EXPECTED_PATH, encoding="utf-8") as f:
+            expected = json.load(f)
+        rows = dump_dt_rows(self.db.session)
+        for table in DT_ROWS.keys():
+            self.assertEqual(expected[table], rows[table], table)
+        self.assertEqual(1, User.query.filter(User.username == "delisle").count())
@@ -0,0 +1,95 @@
+from sqlalchemy import event
+
+from app.api.place.facade import PlaceFacade
+from app.api.place_old_label.facade import PlaceOldLabelFacade
+from app.models import Place, PlaceOldLabel
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+
+class InMemoryIndex(object):
+    """
+    Answer every search with all the indexed documents, by descending label
+    """
+
+    def __init__(self, documents):
+        self.documents = sorted(documents, key=lambda d: (d["payload"]["label"], str(d["id"])), reverse=True)
+
+    @staticmethod
+    def filter_source(payload, fields):
+        source = {}
+        for field in fields:
+            value, target = payload, source
+            *parents, name = field.split(".")
+            for parent in parents:
+                value = value[parent]
+                target = target.setdefault(parent, {})
+            target[name] = value[name]
+        return source
+
+    def search(self, index, body):
+        page = self.documents[body["from"]:body["from"] + body["size"]]
+        return {
+            "hits": {
+                "total": {"value": len(self.documents)},
+                "hits": [{"_index": index, "_id": str(d["id"]), "_score": 1.0,
+                          "_source": self.filter_source(d["payload"], body["_source"])}
+                         for d in page]
+            }
+        }
+
+
+class TestIndexOnlySearch(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.db.drop_all()
+        self.db.create_all()
+        load_fixtures(self.db, nb_places=4)
+
+        documents = []
+        with self.app.test_request_context():
+            for obj in Place.query.all():
+                documents.extend(PlaceFacade("", obj).get_data_to_index_when_added(False))
+            for obj in PlaceOldLabel.query.all():
+                documents.extend(PlaceOldLabelFacade("", obj).get_data_to_index_when_added(False))
+
+        self.elasticsearch = self.app.elasticsearch
+        self.app.elasticsearch = InMemoryIndex(documents)
+
+    def tearDown(self):
+        self.app.elasticsearch = self.elasticsearch
+        super().tearDown()
+
+    def search(self, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            r, status, res = self.api_get(url)
+        finally:
+            event.remove(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        return r, res, statements
+
+    def test_same_resources_without_database(self):
+        for facade in ("search", "map"):
+            url = "/search?query=*&page[size]=7&page[number]=2&facade=%s" % facade
+            r, expected, statements = self.search(url)
+            self.assert200(r)
+            self.assertGreater(len(statements), 0)
+
+            r, res, statements = self.search(url + "&index-only")
+            self.assert200(r)
+            self.assertEqual(0, len(statements))
+            self.assertEqual(7, len(res["data"]))
+            self.assertEqual(expected["data"], res["data"])
+            self.assertEqual(expected["meta"]["total-count"], res["meta"]["total-count"])
+
+    def test_unsupported_requests(self):
+        r, res, statements = self.search("/search?query=*&index-only&filter[dpt]=99")
+        self.assert400(r)
+        r, res, statements = self.search("/search?query=*&index-only&facade=lp")
+        self.assert400(r)
@@ -0,0 +1,229 @@
+import json
+
+from click.testing import CliRunner
+from elasticsearch import NotFoundError
+
+from app.api.place.facade import PlaceFacade
+from app.api.place_description.facade import PlaceDescriptionFacade
+from app.api.place_old_label.facade import PlaceOldLabelFacade
+from app.api.search import SearchIndexManager
+from app.cli import make_cli
+from app.models import IndexOutbox, Place, PlaceOldLabel
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+
+class BulkRecorder(object):
+    """
+    Record the index and delete actions sent with the bulk API.
+    The rejected actions are given by document id, or by (index, document id).
+    The indexes in building are versions being built, the actions on them are versioned; those on the
+    ids in conflicts are older than the indexed documents.
+    """
+
+    def __init__(self, fail=False, rejected=(), building=(), conflicts=()):
+        self.fail = fail
+        self.rejected = rejected
+        self.building = building
+        self.conflicts = conflicts
+        self.actions = []
+        self.versioned_actions = []
+        self.indices = self
+
+    def get_alias(self, name):
+        if not self.building:
+            raise NotFoundError("alias [{0}] missing".format(name), None, None)
+        return {index: {} for index in self.building}
+
+    def bulk(self, body, request_timeout):
+        if self.fail:
+            raise ConnectionError("the cluster went away")
+        lines = iter(body.decode("utf-8").splitlines())
+        items = []
+        for line in lines:
+            action = json.loads(line)
+            op, target = next(iter(action.items()))
+            payload = json.loads(next(lines)) if op == "index" else None
+            if target["_index"] in self.building:
+                self.versioned_actions.append((op, target["_id"], target["version"], target["version_type"]))
+                items.append({op: self.make_result(target["_index"], target["_id"], versioned=True)})
+            else:
+                self.actions.append((op, target["_id"], payload))
+                items.append({op: self.make_result(target["_index"], target["_id"])})
+        return {"errors": any("error" in r for item in items for r in item.values()), "items": items}
+
+    def make_result(self, index, id, versioned=False):
+        if id in self.rejected or (index, id) in self.rejected:
+            return {"_id": id, "status": 400, "error": {"type": "mapper_parsing_exception"}}
+        if versioned and id in self.conflicts:
+            return {"_id": id, "status": 409, "error": {"type": "version_conflict_engine_exception"}}
+        return {"_id": id, "status": 200}
+
+
+class TestIndexQueue(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.cli = make_cli(self.app)
+        self.cli_runner = CliRunner()
+
+        self.db.drop_all()
+        self.db.create_all()
+        load_fixtures(self.db, nb_places=2)
+        self.elasticsearch = self.app.elasticsearch
+        self.app.config["INDEX_WRITE_BEHIND"] = True
+
+    def tearDown(self):
+        self.app.config["INDEX_WRITE_BEHIND"] = False
+        self.app.elasticsearch = self.elasticsearch
+        super().tearDown()
+
+    def work(self):
+        result = self.cli_runner.invoke(self.cli, ["index-worker", "--once"])
+        self.assertIsNone(result.exception, result.output)
+        return result.output
+
+    def test_queues_and_coalesces(self):
+        self.app.elasticsearch = BulkRecorder(fail=True)
+        with self.app.test_request_context():
+            old_label = PlaceOldLabel.query.filter(PlaceOldLabel.old_label_id == "DT99-00001-1").one()
+            old_label_id = str(old_label.id)
+            PlaceOldLabelFacade("", old_label).reindex("delete", commit=False)
+            self.db.session.delete(old_label)
+            self.db.session.commit()
+            place = Place.query.get("DT99-00001")
+            for label in ("Commune un", "Commune 1"):
+                place.label = label
+                self.db.session.commit()
+                PlaceFacade("", place).reindex("update")
+            self.assertEqual(3, IndexOutbox.query.count())
+
+        # nothing is lost while the cluster is down
+        self.assertIn("NOT OK!", self.work())
+        with self.app.app_context():
+            self.assertEqual(3, IndexOutbox.query.count())
+
+        self.app.elasticsearch = BulkRecorder()
+        # only the last operation of each document is sent
+        self.assertIn("3 queued operations, 2 documents sent, 0 errors", self.work())
+        actions = {(op, id): payload for op, id, payload in self.app.elasticsearch.actions}
+        self.assertEqual({("index", "DT99-00001"), ("delete", old_label_id)}, set(actions.keys()))
+        self.assertEqual("Commune 1", actions[("index", "DT99-00001")]["label"])
+        with self.app.app_context():
+            self.assertEqual(0, IndexOutbox.query.count())
+
+    def test_keeps_the_rejected_operations(self):
+        with self.app.test_request_context():
+            for place in Place.query.all():
+                PlaceFacade("", place).reindex("update")
+
+        self.app.elasticsearch = BulkRecorder(rejected=("DT99-00002",))
+        self.assertIn("3 queued operations, 3 documents sent, 1 errors", self.work())
+        with self.app.app_context():
+            self.assertEqual([("DT99-00002", 1)], [(row.doc_id, row.attempts) for row in IndexOutbox.query])
+            # the operation is dropped after the last attempt
+            for _ in range(2):
+                self.assertEqual((1, 1), SearchIndexManager.flush_outbox(max_attempts=3)[:2])
+            self.assertEqual(0, IndexOutbox.query.count())
+
+        self.app.elasticsearch = BulkRecorder()
+        self.assertNotIn("queued operations", self.work())
+
+    def test_keeps_the_rejected_operations_by_index(self):
+        with self.app.app_context():
+            SearchIndexManager.enqueue("places", "1", {"label": "Commune 1"})
+            SearchIndexManager.enqueue("old-labels", "1", {"label": "Vieux nom 1"})
+            self.db.session.commit()
+
+        self.app.elasticsearch = BulkRecorder(rejected=(("old-labels", "1"),))
+        self.assertIn("2 queued operations, 2 documents sent, 1 errors", self.work())
+        with self.app.app_context():
+            self.assertEqual([("old-labels", "1")], [(row.index_name, row.doc_id) for row in IndexOutbox.query])
+
+    def test_writes_to_the_versions_being_built(self):
+        with self.app.test_request_context():
+            for place in Place.query.all():
+                PlaceFacade("", place).reindex("update")
+            index = PlaceFacade.get_index_name()
+
+        # the rebuild has already read a newer DT99-00002
+        self.app.elasticsearch = BulkRecorder(building=(index + "__20200101000000",), conflicts=("DT99-00002",))
+        self.assertIn("3 queued operations, 3 documents sent, 0 errors", self.work())
+        ids = {id for op, id, payload in self.app.elasticsearch.actions}
+        self.assertEqual(ids, {id for op, id, version, version_type in self.app.elasticsearch.versioned_actions})
+        self.assertEqual({"external"}, {version_type for op, id, version, version_type
+                                        in self.app.elasticsearch.versioned_actions})
+        with self.app.app_context():
+            self.assertEqual(0, IndexOutbox.query.count())
+
+    def test_propagates_to_the_documents_made_from_the_children(self):
+        with self.app.test_request_context():
+            place = Place.query.get("DT99-00001")
+            old_label = place.old_labels[0]
+            old_label.rich_label = "<dfn>Vieux nom</dfn>"
+            self.db.session.commit()
+            # the place lists its old labels, the old labels carry the label of the place
+            PlaceOldLabelFacade("", old_label).reindex("update", propagate=True)
+            self.assertEqual({place.id} | {str(o.id) for o in place.old_labels},
+                             {row.doc_id for row in IndexOutbox.query})
+            payload = json.loads(IndexOutbox.query.filter(IndexOutbox.doc_id == place.id).one().payload)
+            self.assertIn("<dfn>Vieux nom</dfn> (1201)", payload["facades"]["search"]["old-labels"])
+            IndexOutbox.query.delete()
+
+            # the place lists its descriptions, the old labels carry them
+            description = place.descriptions[0]
+            description.content = "Nouvelle description"
+            self.db.session.commit()
+            PlaceDescriptionFacade("", description).reindex("update", propagate=True)
+            payloads = {row.doc_id: json.loads(row.payload) for row in IndexOutbox.query}
+            self.assertEqual({place.id} | {str(o.id) for o in place.old_labels}, set(payloads.keys()))
+            self.assertEqual(["Nouvelle description"], payloads[place.id]["facades"]["search"]["descriptions"])
+            for old_label in place.old_labels:
+                self.assertEqual(["Nouvelle description"],
+                                 payloads[str(old_label.id)]["facades"]["search"]["place-desc"])
+            self.assertEqual([place.id], [f.obj.id for f in PlaceDescriptionFacade("", description).get_parent_facades()])
+
+    def test_rollback_drops_the_queued_operations(self):
+        with self.app.test_request_context():
+            place = Place.query.get("DT99-00002")
+            PlaceFacade("", place).reindex("delete", commit=False)
+            self.db.session.rollback()
+            self.assertEqual(0, IndexOutbox.query.count())
+
+    def test_resource_committed_with_the_queued_operations(self):
+        with self.app.test_request_context():
+            place = Place.query.get("DT99-00002")
+            resource, errors = PlaceFacade.update_resource(place, PlaceFacade.TYPE, {"label": "Nouveau"}, {},
+                                                           commit=False)
+            self.assertIsNone(errors)
+            # neither the update nor its index operation are committed on their own
+            self.db.session.rollback()
+            self.assertNotEqual("Nouveau", Place.query.get("DT99-00002").label)
+            self.assertEqual(0, IndexOutbox.query.count())
+
+            place = Place.query.get("DT99-00002")
+            PlaceFacade.update_resource(place, PlaceFacade.TYPE, {"label": "Nouveau"}, {}, commit=False)
+            PlaceFacade("", place).reindex("update")
+            self.db.session.rollback()
+            self.assertEqual("Nouveau", Place.query.get("DT99-00002").label)
+            self.assertEqual(["DT99-00002"], [row.doc_id for row in IndexOutbox.query])
+
+    def test_queue_status(self):
+        with self.app.test_request_context():
+            for place in Place.query.all():
+                PlaceFacade("", place).reindex("update")
+
+        r, status, resource = self.api_get("/admin/index-queue")
+        self.assert200(r)
+        self.assertEqual(len(resource["data"]), 1)
+        self.assertEqual(Place.query.count(), resource["data"][0]["attributes"]["depth"])
+        self.assertEqual(Place.query.count(), resource["meta"]["total-count"])
+        self.assertTrue(resource["meta"]["write-behind"])
+        self.assertGreaterEqual(resource["meta"]["lag"], 0)
+
+        self.app.elasticsearch = BulkRecorder()
+        self.work()
+        r, status, resource = self.api_get("/admin/index-queue")
+        self.assertEqual([], resource["data"])
+        self.assertEqual(0, resource["meta"]["lag"])
+        self.assertIsNone(resource["meta"]["oldest"])
@@ -0,0 +1,100 @@
+from sqlalchemy import event
+
+from app.models import InseeCommune, Place
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+
+class TestLocationFilters(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.db.drop_all()
+        self.db.create_all()
+        # the commune 9900i is located at (4.i, 46.i)
+        load_fixtures(self.db, nb_places=6)
+
+    def get_ids(self, url):
+        r, status, res = self.api_get(url)
+        self.assert200(r)
+        return sorted(obj["id"] for obj in res["data"])
+
+    def test_coordinates(self):
+        co = InseeCommune.query.get("99003")
+        self.assertEqual((4.3, 46.3), co.coordinates)
+        co.longlat = "(5.5, 47.5)"
+        self.db.session.commit()
+        self.assertEqual(["99003"], self.get_ids("/communes?without-relationships&filter[bbox]=5,47,6,48"))
+
+    def test_bbox(self):
+        self.assertEqual(["99002", "99003"],
+                         self.get_ids("/communes?without-relationships&filter[bbox]=4.15,46.15,4.35,46.35"))
+        # the communes and the places localized in them
+        self.assertEqual(["DT99-00002", "DT99-00003", "DT99-00103"],
+                         self.get_ids("/places?without-relationships&filter[bbox]=4.15,46.15,4.35,46.35"))
+        # points on the edges of the box are inside
+        self.assertEqual(["99002"], self.get_ids("/communes?without-relationships&filter[bbox]=4.2,46.2,4.2,46.2"))
+
+    def test_near(self):
+        # 0.1° of latitude is about 11km
+        self.assertEqual(["99002"], self.get_ids("/communes?without-relationships&filter[near]=4.2,46.2,5"))
+        self.assertEqual(["99001", "99002", "99003"],
+                         self.get_ids("/communes?without-relationships&filter[near]=4.2,46.2,15"))
+        self.assertEqual(["DT99-00001", "DT99-00002", "DT99-00003", "DT99-00101", "DT99-00103"],
+                         self.get_ids("/places?without-relationships&filter[near]=4.2,46.2,15&filter[country]=FR"))
+
+    def test_near_is_answered_in_sql(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, *args):
+            statements.append((statement, parameters))
+
+        event.listen(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            self.get_ids("/places?without-relationships&filter[near]=4.2,46.2,15")
+        finally:
+            event.remove(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        # the insee codes are not bound one by one
+        self.assertTrue(all(len(parameters) < 30 for statement, parameters in statements))
+        self.assertTrue(any("distance_km(" in statement for statement, parameters in statements))
+
+    def test_wrong_filters(self):
+        r, status, res = self.api_get("/communes?filter[bbox]=4.15,46.15")
+        self.assert400(r)
+        r, status, res = self.api_get("/place-comments?filter[near]=4.2,46.2,5")
+        self.assert400(r)
+
+    def test_answered_by_the_index(self):
+        query = InseeCommune.select_insee_codes_in_bbox(4.15, 46.15, 4.35, 46.35).compile(
+            compile_kwargs={"literal_binds": True})
+        plan = " ".join(str(row) for row in self.db.session.execute("EXPLAIN QUERY PLAN %s" % query))
+        self.assertIn("insee_commune_rtree VIRTUAL TABLE INDEX", plan)
+        self.assertNotIn("SCAN insee_commune ", plan)
+
+    def test_property_filters(self):
+        p = Place.query.get("DT99-00002")
+        self.db.session.add(Place(id="DT99-00200", country="FR", dpt="99", label="Lieu perdu",
+                                  responsibility=p.responsibility))
+        self.db.session.commit()
+
+        self.assertEqual(["DT99-00200"], self.get_ids("/places?without-relationships&filter[!longlat]"))
+        self.assertEqual(9, len(self.get_ids("/places?without-relationships&filter[longlat]")))
+        self.assertEqual(["DT99-00003", "DT99-00103"],
+                         self.get_ids("/places?without-relationships&filter[related-commune]=99003"))
+        self.assertEqual(["DT99-00200"], self.get_ids("/places?without-relationships&filter[!related-commune]"))
+        self.assertEqual([], self.get_ids("/place-old-labels?without-relationships&filter[!longlat]"))
+        self.assertEqual(12, len(self.get_ids("/place-old-labels?without-relationships&filter[longlat]")))
+
+    def test_property_filters_are_answered_in_sql(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            self.get_ids("/places?without-relationships&filter[!longlat]&page[size]=2")
+        finally:
+            event.remove(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        # no statement lists the ids of the filtered places
+        self.assertFalse(any("place.place_id IN" in statement for statement in statements))
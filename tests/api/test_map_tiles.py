@@ -0,0 +1,78 @@
+from app.api.place.facade import PlaceFacade
+from app.api.search import SearchIndexManager
+from app.models import Place
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+
+class GeotileIndex(object):
+    """
+    Record the search bodies and answer with a single cell
+    """
+
+    def __init__(self):
+        self.bodies = []
+
+    def search(self, index, body):
+        self.bodies.append(body)
+        return {
+            "hits": {"total": {"value": 3}, "hits": []},
+            "aggregations": {"cells": {"buckets": [
+                {"key": "3/4/2", "doc_count": 3, "centroid": {"location": {"lat": 46.2, "lon": 4.2}, "count": 3}}
+            ]}}
+        }
+
+
+class TestMapTiles(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.elasticsearch = self.app.elasticsearch
+        self.app.elasticsearch = GeotileIndex()
+
+    def tearDown(self):
+        self.app.elasticsearch = self.elasticsearch
+        super().tearDown()
+
+    def test_tile_bounds(self):
+        west, south, east, north = SearchIndexManager.get_tile_bounds(0, 0, 0)
+        self.assertEqual((-180, 180), (west, east))
+        self.assertAlmostEqual(-85.0511, south, places=4)
+        self.assertAlmostEqual(85.0511, north, places=4)
+
+        # the tile of Paris at zoom level 10
+        west, south, east, north = SearchIndexManager.get_tile_bounds(10, 518, 352)
+        self.assertTrue(west < 2.35 < east and south < 48.85 < north)
+
+    def test_one_aggregation_per_tile(self):
+        r, status, res = self.api_get("/map/tiles/0/0/0?query=type:place&precision=3")
+        self.assert200(r)
+        self.assertEqual(1, len(self.app.elasticsearch.bodies))
+        body = self.app.elasticsearch.bodies[0]
+        self.assertEqual(0, body["size"])
+        self.assertEqual(3, body["aggregations"]["cells"]["geotile_grid"]["precision"])
+        self.assertIn("geo_bounding_box", body["query"]["bool"]["filter"][0])
+
+        self.assertEqual([{"type": "map-cell", "id": "3/4/2",
+                           "attributes": {"count": 3, "centroid": {"lat": 46.2, "lon": 4.2}}}], res["data"])
+        self.assertEqual(3, res["meta"]["total-count"])
+
+    def test_buckets_limit(self):
+        r, status, res = self.api_get("/map/tiles/1/0/0?precision=9")
+        self.assert200(r)
+        # 4 ** 8 cells, one more than the buckets elasticsearch accepts
+        self.assertEqual(65535, self.app.elasticsearch.bodies[0]["aggregations"]["cells"]["geotile_grid"]["size"])
+
+    def test_wrong_tiles(self):
+        r, status, res = self.api_get("/map/tiles/1/2/0")
+        self.assert400(r)
+        r, status, res = self.api_get("/map/tiles/1/0/0?precision=10")
+        self.assert400(r)
+
+    def test_indexed_location(self):
+        self.db.drop_all()
+        self.db.create_all()
+        load_fixtures(self.db, nb_places=3)
+        with self.app.test_request_context():
+            payload = PlaceFacade("", Place.query.get("DT99-00101")).get_data_to_index_when_added(False)[0]["payload"]
+        self.assertEqual({"lon": 4.1, "lat": 46.1}, payload["location"])
@@ -0,0 +1,149 @@
+from sqlalchemy import event
+
+from app.models import Place
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+
+class TestPagination(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.db.drop_all()
+        self.db.create_all()
+        load_fixtures(self.db, nb_places=6)
+
+    def walk(self, url):
+        """
+        Follow the next links from url and return the ids of the resources seen along the way
+        """
+        ids = []
+        pages = 0
+        while url:
+            r, status, res = self.api_get(url[url.index("/places"):])
+            self.assert200(r)
+            ids.extend(obj["id"] for obj in res["data"])
+            url = res["links"].get("next")
+            pages += 1
+            self.assertLess(pages, 10)
+        return ids
+
+    def test_keyset_pagination(self):
+        r, status, res = self.api_get("/places?without-relationships&sort=id")
+        all_ids = [obj["id"] for obj in res["data"]]
+        self.assertEqual(9, len(all_ids))
+
+        ids = self.walk("/places?without-relationships&page[size]=2&page[after]=")
+        self.assertEqual(all_ids, ids)
+
+        r, status, res = self.api_get("/places?without-relationships&page[size]=2&page[after]=DT99-00002")
+        self.assertEqual(["DT99-00003", "DT99-00004"], [obj["id"] for obj in res["data"]])
+        self.assertIn("page%5Bafter%5D=DT99-00004", res["links"]["next"])
+        self.assertNotIn("last", res["links"])
+        self.assertEqual(9, res["meta"]["total-count"])
+
+    def test_keyset_pagination_with_sort(self):
+        for sort in ("label", "-label", "localization-commune-insee-code", "-localization-commune-insee-code"):
+            r, status, res = self.api_get("/places?without-relationships&sort=%s" % sort)
+            sorted_ids = [obj["id"] for obj in res["data"]]
+            ids = self.walk("/places?without-relationships&page[size]=2&page[after]=&sort=%s" % sort)
+            self.assertEqual(sorted_ids, ids, sort)
+
+    def test_keyset_pagination_unknown_cursor(self):
+        r, status, res = self.api_get("/places?page[after]=DT00-00000&sort=label")
+        self.assert400(r)
+
+    def test_without_count(self):
+        r, status, res = self.api_get("/places?without-relationships&without-count&page[size]=4&page[number]=2")
+        self.assertEqual(4, len(res["data"]))
+        self.assertNotIn("total-count", res.get("meta", {}))
+        self.assertNotIn("last", res["links"])
+        self.assertIn("prev", res["links"])
+        self.assertIn("page%5Bnumber%5D=3", res["links"]["next"])
+
+        ids = self.walk("/places?without-relationships&without-count&page[size]=4")
+        self.assertEqual(9, len(set(ids)))
+
+    def test_count_cache(self):
+        self.app.config["COUNT_CACHE_TIMEOUT"] = 60
+        try:
+            r, status, res = self.api_get("/places?filter[country]=FR")
+            self.assertEqual(9, res["meta"]["total-count"])
+
+            Place.query.filter(Place.id == "DT99-00101").delete()
+            self.db.session.commit()
+            r, status, res = self.api_get("/places?filter[country]=FR")
+            self.assertEqual(9, res["meta"]["total-count"])
+            r, status, res = self.api_get("/places?filter[dpt]=99")
+            self.assertEqual(8, res["meta"]["total-count"])
+        finally:
+            self.app.config["COUNT_CACHE_TIMEOUT"] = None
+            self.app.api_url_registrar.count_cache.clear()
+
+    def test_count_cache_bounds(self):
+        registrar = self.app.api_url_registrar
+        self.app.config["COUNT_CACHE_TIMEOUT"] = 60
+        registrar.COUNT_CACHE_SIZE = 2
+        try:
+            for dpt in ("97", "98", "99"):
+                self.api_get("/places?filter[dpt]=%s" % dpt)
+            # the oldest count is dropped
+            self.assertEqual([(("filter[dpt]", "98"),), (("filter[dpt]", "99"),)],
+                             [filters for tablename, filters in registrar.count_cache.keys()])
+
+            # the expired counts are dropped on the next count
+            for key, (timestamp, count) in list(registrar.count_cache.items()):
+                registrar.count_cache[key] = (timestamp - 60, count)
+            self.api_get("/places?filter[country]=FR")
+            self.assertEqual([(("filter[country]", "FR"),)],
+                             [filters for tablename, filters in registrar.count_cache.keys()])
+
+            # the relationship writes clear the counts of both sides
+            self.api_get("/communes?filter[DEP-id]=DEP_99")
+            self.assertEqual(2, len(registrar.count_cache))
+            with self.app.test_request_context():
+                registrar.clear_relationship_count_cache(Place, "commune")
+            self.assertEqual(0, len(registrar.count_cache))
+        finally:
+            self.app.config["COUNT_CACHE_TIMEOUT"] = None
+            del registrar.COUNT_CACHE_SIZE
+            registrar.count_cache.clear()
+
+    def test_relationship_pages(self):
+        r, status, res = self.api_get("/insee-refs/AR_99_1/children")
+        all_ids = sorted(obj["id"] for obj in res["data"])
+        self.assertEqual(6, len(all_ids))
+
+        ids = []
+        for num_page in (1, 2, 3):
+            r, status, res = self.api_get("/insee-refs/AR_99_1/children?page[size]=2&page[number]=%s" % num_page)
+            self.assert200(r)
+            self.assertEqual(6, res["meta"]["total-count"])
+            ids.extend(obj["id"] for obj in res["data"])
+        self.assertEqual(all_ids, ids)
+        self.assertNotIn("next", res["links"])
+        self.assertIn("page%5Bnumber%5D=3", res["links"]["last"])
+
+        r, status, res = self.api_get("/insee-refs/AR_99_1/relationships/children?page[size]=4&page[number]=2")
+        self.assertEqual(all_ids[4:], [obj["id"] for obj in res["data"]])
+        self.assertEqual(6, res["meta"]["total-count"])
+
+        r, status, res = self.api_get("/communes/99001/localized-places?page[size]=1")
+        self.assertEqual(["DT99-00101"], [obj["id"] for obj in res["data"]])
+        self.assertEqual(1, res["meta"]["total-count"])
+
+    def test_relationship_page_is_queried(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            r, status, res = self.api_get("/insee-refs/AR_99_1/children?page[size]=2&page[number]=2")
+        finally:
+            event.remove(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        self.assertEqual(2, len(res["data"]))
+        # the children are counted, then only the page is loaded
+        self.assertTrue(any("count(" in statement.lower() for statement in statements))
+        self.assertTrue(any("LIMIT" in statement for statement in statements))
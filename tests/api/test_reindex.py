@@ -0,0 +1,273 @@
+import glob
+import json
+import os
+import shutil
+import tempfile
+
+from click.testing import CliRunner
+from elasticsearch import NotFoundError
+
+from app.cli import make_cli, read_checkpoint, read_elastic_conf
+from app.api.place_old_label.facade import PlaceOldLabelFacade
+from app.api.search import SearchIndexManager
+from app.models import PlaceOldLabel
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+
+class BulkRecorder(object):
+    """
+    Record the documents sent with the bulk API.
+    The fail_at-th request raises a connection error, the documents whose ids are in rejected_ids are rejected
+    """
+
+    def __init__(self, fail_at=None, rejected_ids=()):
+        self.fail_at = fail_at
+        self.rejected_ids = set(rejected_ids)
+        self.requests = []
+        self.documents = {}
+
+    def bulk(self, body, request_timeout):
+        self.requests.append(body)
+        if len(self.requests) == self.fail_at:
+            raise ConnectionError("the cluster went away")
+
+        lines = body.decode("utf-8").splitlines()
+        items = []
+        for action, payload in zip(lines[::2], lines[1::2]):
+            id = str(json.loads(action)["index"]["_id"])
+            if id in self.rejected_ids:
+                items.append({"index": {"_id": id, "status": 400, "error": {"type": "mapper_parsing_exception"}}})
+            else:
+                self.documents[id] = json.loads(payload)
+                items.append({"index": {"_id": id, "status": 201}})
+        return {"errors": any("error" in item["index"] for item in items), "items": items}
+
+
+class IndicesRecorder(object):
+    """
+    Record the index versions and the aliases of a cluster, as (index, alias) pairs
+    """
+
+    def __init__(self, indexes=(), aliases=()):
+        self.indexes = {index: {} for index in indexes}
+        self.aliases = set(aliases)
+
+    def create(self, index, settings, mappings):
+        self.indexes[index] = settings["index"]
+
+    def put_settings(self, index, settings):
+        self.indexes[index].update(settings["index"])
+
+    def refresh(self, index):
+        pass
+
+    def exists_alias(self, name):
+        return any(alias == name for index, alias in self.aliases)
+
+    def get_alias(self, name):
+        if not self.exists_alias(name):
+            raise NotFoundError("alias [{0}] missing".format(name), None, None)
+        return {index: {} for index, alias in self.aliases if alias == name}
+
+    def exists(self, index):
+        return index in self.indexes
+
+    def update_aliases(self, actions):
+        for action in actions:
+            if "add" in action:
+                self.aliases.add((action["add"]["index"], action["add"]["alias"]))
+            elif "remove" in action:
+                self.aliases.discard((action["remove"]["index"], action["remove"]["alias"]))
+            else:
+                self.indexes.pop(action["remove_index"]["index"])
+
+    def get(self, index):
+        prefix = index.rstrip("*")
+        return {name: {} for name in self.indexes if name.startswith(prefix)}
+
+    def delete(self, index):
+        self.indexes.pop(index)
+
+
+class ClusterRecorder(BulkRecorder):
+    """
+    Also record the documents written one at a time, as (index, id, version) by their index
+    """
+
+    def __init__(self, indices, **kwargs):
+        super().__init__(**kwargs)
+        self.indices = indices
+        self.cluster = self
+        self.writes = []
+
+    def health(self, index, wait_for_status, timeout):
+        pass
+
+    def index(self, index, id, body, version=None, version_type=None):
+        self.writes.append((index, id, version))
+
+    def delete(self, index, id, version=None, version_type=None):
+        self.writes.append((index, id, version))
+
+
+class TestReindex(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.cli = make_cli(self.app)
+        self.cli_runner = CliRunner()
+        self.checkpoint_dir = tempfile.mkdtemp()
+
+        self.db.drop_all()
+        self.db.create_all()
+        load_fixtures(self.db, nb_places=6)
+        self.elasticsearch = self.app.elasticsearch
+
+    def tearDown(self):
+        self.app.elasticsearch = self.elasticsearch
+        shutil.rmtree(self.checkpoint_dir)
+        super().tearDown()
+
+    def reindex(self, *args):
+        result = self.cli_runner.invoke(self.cli, ["db-reindex", "--indexes", "old-labels", "--host", "http://localhost",
+                                                   "--checkpoint-dir", self.checkpoint_dir,
+                                                   "--batch-size", "5", "--chunk-size", "0.002", *args])
+        self.assertIsNone(result.exception, result.output)
+        return result.output
+
+    def rebuild(self, *args):
+        return self.reindex("--indexes", "all", *args)
+
+    def test_streams_by_chunks(self):
+        self.app.elasticsearch = BulkRecorder()
+        output = self.reindex()
+        self.assertGreater(len(self.app.elasticsearch.requests), 1)
+        for body in self.app.elasticsearch.requests:
+            self.assertLessEqual(len(body), 0.002 * 1024 * 1024)
+        with self.app.app_context():
+            ids = {str(label.id) for label in PlaceOldLabel.query.all()}
+        self.assertEqual(ids, set(self.app.elasticsearch.documents.keys()))
+        self.assertIn("12 documents indexed, 0 errors", output)
+
+    def test_resume(self):
+        self.app.elasticsearch = BulkRecorder(fail_at=2)
+        output = self.reindex()
+        self.assertIn("--resume", output)
+        sent = set(self.app.elasticsearch.documents.keys())
+        self.assertGreater(len(sent), 0)
+
+        recorder = BulkRecorder()
+        self.app.elasticsearch = recorder
+        self.reindex("--resume")
+        # the documents of the failed request are sent again, the others are not
+        self.assertEqual(set(), sent & set(recorder.documents.keys()))
+        self.assertEqual(12, len(sent) + len(recorder.documents))
+
+        # nothing left to do
+        recorder = BulkRecorder()
+        self.app.elasticsearch = recorder
+        self.assertIn("already done", self.reindex("--resume"))
+        self.assertEqual([], recorder.requests)
+
+    def test_reports_errors(self):
+        self.app.elasticsearch = BulkRecorder(rejected_ids=("3",))
+        output = self.reindex()
+        self.assertIn("3: {'type': 'mapper_parsing_exception'}", output)
+        self.assertIn("12 documents indexed, 1 errors", output)
+        checkpoint_files = glob.glob(os.path.join(self.checkpoint_dir, "*.old-labels.checkpoint.json"))
+        self.assertEqual(1, len(checkpoint_files))
+        checkpoint = read_checkpoint(checkpoint_files[0])
+        self.assertEqual(1, checkpoint["errors"])
+        self.assertTrue(checkpoint["done"])
+
+    def test_workers(self):
+        self.app.elasticsearch = BulkRecorder()
+        self.reindex()
+        expected = self.app.elasticsearch.documents
+
+        self.app.elasticsearch = BulkRecorder()
+        output = self.reindex("--workers", "3")
+        self.assertIn("12 documents indexed, 0 errors", output)
+        self.assertEqual(expected, self.app.elasticsearch.documents)
+        self.assertEqual(4, len(glob.glob(os.path.join(self.checkpoint_dir, "*.checkpoint.json"))))
+
+    def test_workers_resume(self):
+        self.app.elasticsearch = BulkRecorder(fail_at=3)
+        output = self.reindex("--workers", "3")
+        self.assertIn("--resume", output)
+        sent = set(self.app.elasticsearch.documents.keys())
+
+        # the slices are kept, whatever the number of workers
+        recorder = BulkRecorder()
+        self.app.elasticsearch = recorder
+        self.assertIn("12 documents indexed", self.reindex("--resume"))
+        self.assertEqual(set(), sent & set(recorder.documents.keys()))
+        self.assertEqual(12, len(sent) + len(recorder.documents))
+
+    def test_builds_a_new_version(self):
+        with self.app.app_context():
+            alias = PlaceOldLabelFacade.get_index_name()
+        previous = alias + "__20200101000000"
+        indices = IndicesRecorder(indexes=[alias + "__20190101000000", previous], aliases=[(previous, alias)])
+        self.app.elasticsearch = ClusterRecorder(indices)
+        self.rebuild("--keep-versions", "1")
+
+        versions = sorted(indices.indexes.keys())
+        self.assertEqual(previous, versions[0])
+        self.assertEqual(2, len(versions))
+        current = versions[1]
+        self.assertEqual({(current, alias)}, indices.aliases)
+        # the replicas and refreshes are restored once the version is filled
+        conf = read_elastic_conf("places")
+        replicas = conf["settings"]["index"]["number_of_replicas"]
+        self.assertEqual(replicas, indices.indexes[current]["number_of_replicas"])
+        self.assertEqual("1s", indices.indexes[current]["refresh_interval"])
+        self.assertEqual("60s", indices.indexes[current]["gc_deletes"])
+        for body in self.app.elasticsearch.requests:
+            self.assertNotIn(alias + '"', body.decode("utf-8"))
+            for action in body.decode("utf-8").splitlines()[::2]:
+                self.assertEqual("external", json.loads(action)["index"]["version_type"])
+
+    def test_keeps_the_alias_if_the_rebuild_fails(self):
+        with self.app.app_context():
+            alias = PlaceOldLabelFacade.get_index_name()
+        previous = alias + "__20200101000000"
+        indices = IndicesRecorder(indexes=[previous], aliases=[(previous, alias)])
+        self.app.elasticsearch = ClusterRecorder(indices, fail_at=2)
+        self.assertIn("--resume", self.rebuild())
+        building = max(indices.indexes.keys())
+        self.assertEqual({(previous, alias), (building, alias + "__building")}, indices.aliases)
+
+        # the resumed rebuild fills the same version
+        self.app.elasticsearch = ClusterRecorder(indices)
+        self.rebuild("--resume")
+        self.assertEqual({(building, alias)}, indices.aliases)
+
+    def test_writes_reach_the_building_version(self):
+        with self.app.app_context():
+            alias = PlaceOldLabelFacade.get_index_name()
+        previous = alias + "__20200101000000"
+        indices = IndicesRecorder(indexes=[previous], aliases=[(previous, alias)])
+        self.app.elasticsearch = ClusterRecorder(indices, fail_at=2)
+        self.assertIn("--resume", self.rebuild())
+        building = max(indices.indexes.keys())
+
+        # until the swap, the writes go to the live version and to the version being built
+        with self.app.app_context():
+            SearchIndexManager.add_to_index(alias, "1", {"id": "1"})
+            SearchIndexManager.remove_from_index(alias, "2")
+        writes = self.app.elasticsearch.writes
+        self.assertEqual([(alias, "1", None), (building, "1"), (alias, "2", None), (building, "2")],
+                         [write if write[0] == alias else write[:2] for write in writes])
+        # the rebuild cannot overwrite them with the rows it read earlier
+        self.assertLess(int(json.loads(self.app.elasticsearch.requests[0].splitlines()[0])["index"]["version"]),
+                        writes[1][2])
+        self.assertLessEqual(writes[1][2], writes[3][2])
+        self.assertEqual(SearchIndexManager.BUILDING_GC_DELETES, indices.indexes[building]["gc_deletes"])
+
+        self.app.elasticsearch = ClusterRecorder(indices)
+        self.rebuild("--resume")
+        with self.app.app_context():
+            SearchIndexManager.add_to_index(alias, "1", {"id": "1"})
+        self.assertEqual([(alias, "1", None)], self.app.elasticsearch.writes)
@@ -0,0 +1,39 @@
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+
+class TestStreaming(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.db.drop_all()
+        self.db.create_all()
+        load_fixtures(self.db, nb_places=6)
+
+    def assertSameDocument(self, url):
+        sep = "&" if "?" in url else "?"
+        r, status, expected = self.api_get(url)
+        r_streamed, status_streamed, actual = self.api_get(url + sep + "stream")
+        self.assert200(r_streamed)
+        self.assertNotIn(b"\n", r_streamed.data)
+        self.assertSameContent(expected, actual)
+
+    def assertSameContent(self, expected, actual):
+        # the links refer to the streamed url
+        self.assertEqual(expected.keys(), actual.keys())
+        self.assertEqual(expected["links"].keys(), actual["links"].keys())
+        expected.pop("links")
+        actual.pop("links")
+        self.assertEqual(expected, actual)
+
+    def test_stream_collection(self):
+        self.assertSameDocument("/places")
+        self.assertSameDocument("/places?page[size]=2&page[number]=2")
+        self.assertSameDocument("/places?facade=search&filter[dpt]=00")
+        self.assertSameDocument("/place-old-labels?include=place,responsibility")
+
+    def test_stream_pretty(self):
+        r, status, expected = self.api_get("/places?include=commune")
+        r, status, actual = self.api_get("/places?include=commune&stream=pretty")
+        self.assertIn(b'\n  "id": "DT99-00001"', r.data)
+        self.assertSameContent(expected, actual)
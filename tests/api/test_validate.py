@@ -0,0 +1,88 @@
+import io
+import json
+import os
+import tempfile
+from unittest import mock
+
+from click.testing import CliRunner
+
+from app.api.place.decorators.exports.linkedplaces import LinkedPlacesFeatureFacade, get_lpf_validator
+from app.cli import make_cli
+from app.models import Place, PlaceOldLabel
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+
+class TestValidate(TestBaseServer):
+
+    def setUp(self):
+        super().setUp()
+        self.cli = make_cli(self.app)
+        self.cli_runner = CliRunner()
+
+        self.db.drop_all()
+        self.db.create_all()
+        load_fixtures(self.db, nb_places=6)
+
+    def validate(self, *args):
+        return self.cli_runner.invoke(self.cli, ["db-validate", "--batch-size", "2", *args])
+
+    def break_places(self):
+        Place.query.get("DT99-00002").label = ""
+        for old_label in PlaceOldLabel.query.filter(PlaceOldLabel.place_id.in_(["DT99-00002", "DT99-00005"])):
+            old_label.rich_label = ""
+        self.db.session.commit()
+
+    def test_the_exported_features_are_valid(self):
+        validator = get_lpf_validator()
+        with self.app.test_request_context():
+            for place in Place.query.all():
+                self.assertEqual([], list(validator.iter_errors(LinkedPlacesFeatureFacade("", place).resource)))
+
+        result = self.validate()
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertIn("9 places validated, 0 not valid", result.output)
+
+    def test_reports_by_error_type(self):
+        self.break_places()
+        result = self.validate()
+        self.assertEqual(1, result.exit_code, result.output)
+        self.assertIn("9 places validated, 2 not valid", result.output)
+        self.assertIn("4 x minLength properties/names/items/properties/toponym/minLength", result.output)
+        self.assertIn("1 x minLength properties/properties/properties/title/minLength (eg. DT99-00002",
+                      result.output)
+
+    def test_workers(self):
+        self.break_places()
+        result = self.validate("--workers", "3", "--between", "DT99-00003")
+        self.assertEqual(1, result.exit_code, result.output)
+        self.assertIn("7 places validated, 1 not valid", result.output)
+        self.assertIn("2 x minLength properties/names/items/properties/toponym/minLength (eg. DT99-00005",
+                      result.output)
+
+    def test_update_schema(self):
+        schema = {"$schema": "http://json-schema.org/draft-07/schema#", "type": "object",
+                  "required": ["@id", "type"]}
+        content = json.dumps(schema, indent=1).encode("utf-8")
+        with tempfile.TemporaryDirectory() as schema_dir:
+            path = os.path.join(schema_dir, "lpf-schema.json")
+            with mock.patch("urllib.request.urlopen", return_value=io.BytesIO(content)) as urlopen:
+                result = self.cli_runner.invoke(self.cli, ["update-lpf-schema", "--revision", "abc123",
+                                                           "--schema", path])
+            self.assertEqual(0, result.exit_code, result.output)
+            url = "https://raw.githubusercontent.com/LinkedPasts/linked-places-format/abc123/lpf-schema.json"
+            self.assertEqual(url, urlopen.call_args[0][0])
+            # the schema is written unchanged, along with its source
+            with open(path, "rb") as f:
+                self.assertEqual(content, f.read())
+            with open(path + ".source") as f:
+                self.assertEqual("{0}\nrevision: abc123\n".format(url), f.read())
+
+            # an invalid schema is not written
+            invalid = json.dumps({"type": "nothing"}).encode("utf-8")
+            with mock.patch("urllib.request.urlopen", return_value=io.BytesIO(invalid)):
+                result = self.cli_runner.invoke(self.cli, ["update-lpf-schema", "--revision", "def456",
+                                                           "--schema", path])
+            self.assertNotEqual(0, result.exit_code)
+            with open(path, "rb") as f:
+                self.assertEqual(content, f.read())
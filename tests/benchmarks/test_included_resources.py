@@ -0,0 +1,54 @@
+import timeit
+import unittest
+
+from app.api.response_factory import JSONAPIIncludedResources
+
+
+def make_page_inclusions(nb_places):
+    """
+    The included resources of a page of places asked with ?include=commune,old-labels:
+    a commune shared by 4 places and 2 old labels per place
+    """
+    inclusions = []
+    for i in range(nb_places):
+        inclusions.append([
+            {"type": "commune", "id": str(i // 4), "attributes": {}},
+            {"type": "place-old-label", "id": 2 * i, "attributes": {}},
+            {"type": "place-old-label", "id": 2 * i + 1, "attributes": {}},
+        ])
+    return inclusions
+
+
+def merge(inclusions):
+    included_resources = JSONAPIIncludedResources()
+    for resources in inclusions:
+        included_resources.extend(resources)
+    return included_resources
+
+
+class TestIncludedResourcesBenchmark(unittest.TestCase):
+
+    SIZES = (1000, 4000, 16000)
+
+    def test_merge_is_linear(self):
+        timings = {}
+        for size in self.SIZES:
+            inclusions = make_page_inclusions(size)
+            self.assertEqual(len(merge(inclusions)), size // 4 + 2 * size)
+            timings[size] = min(timeit.repeat(lambda: merge(inclusions), number=3, repeat=5)) / 3
+            print("merging the inclusions of {0} places: {1:.2f}ms ({2:.3f}µs per place)".format(
+                size, timings[size] * 1000, timings[size] * 1000000 / size))
+
+        smallest, largest = self.SIZES[0], self.SIZES[-1]
+        # a quadratic merge would cost 16 times more per place
+        self.assertLess(timings[largest] / largest, 4 * timings[smallest] / smallest)
+
+    def test_keeps_first_occurrence_order(self):
+        included_resources = JSONAPIIncludedResources([
+            {"type": "commune", "id": "1"},
+            {"type": "place", "id": "1"},
+            {"type": "commune", "id": "1"},
+            {"type": "commune", "id": "2"},
+        ])
+        self.assertEqual([("commune", "1"), ("place", "1"), ("commune", "2")],
+                         [(r["type"], r["id"]) for r in included_resources])
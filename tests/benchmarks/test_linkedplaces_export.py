@@ -0,0 +1,83 @@
+import time
+
+from sqlalchemy import event
+
+from app.models import InseeRef, InseeCommune, Place, PlaceOldLabel, PlaceDescription, Responsibility, User, Bibl
+from tests.base_server import TestBaseServer
+
+
+class TestLinkedPlacesExportBenchmark(TestBaseServer):
+    """
+    Time the Linked Places export of a page of places
+    """
+
+    SIZES = (100, 1000)
+
+    def setUp(self):
+        super().setUp()
+        self.db.drop_all()
+        self.db.create_all()
+        resp = Responsibility(user=User(username="Conservator57"), bibl=Bibl(abbr="DT99", bibl="DT de test"))
+        self.db.session.add_all([
+            resp,
+            InseeRef(id="REG_99", type="REG", insee_code="99", level=1, label="Région de test"),
+            InseeRef(id="DEP_99", type="DEP", insee_code="99", level=2, label="Département de test"),
+        ])
+        self.db.session.flush()
+
+        # as many communes as sub-communal places, each with 2 old labels and a description (and every page has both)
+        nb = self.SIZES[-1] // 2
+        self.db.session.bulk_insert_mappings(InseeCommune, [
+            {"id": "99%s" % str(i).zfill(3), "REG_id": "REG_99", "DEP_id": "DEP_99", "NCCENR": "Commune %s" % i,
+             "longlat": "(4.%s, 46.%s)" % (i, i), "longitude": float("4.%s" % i), "latitude": float("46.%s" % i)}
+            for i in range(nb)
+        ])
+        places = []
+        for i in range(nb):
+            places.append({"id": "DT99-%s" % str(2 * i).zfill(5), "label": "Commune %s" % i, "country": "FR",
+                           "dpt": "99", "commune_insee_code": "99%s" % str(i).zfill(3),
+                           "responsibility_id": resp.id})
+            places.append({"id": "DT99-%s" % str(2 * i + 1).zfill(5), "label": "Ferme %s" % i, "country": "FR",
+                           "dpt": "99", "localization_commune_insee_code": "99%s" % str(i).zfill(3),
+                           "localization_commune_relation_type": "tgn3000_related_to", "responsibility_id": resp.id})
+        self.db.session.bulk_insert_mappings(Place, places)
+        self.db.session.bulk_insert_mappings(PlaceOldLabel, [
+            {"old_label_id": "%s-%s" % (p["id"], j), "place_id": p["id"], "rich_label": "Vieux nom %s" % j,
+             "text_date": str(1200 + j), "responsibility_id": resp.id}
+            for p in places for j in range(2)
+        ])
+        self.db.session.bulk_insert_mappings(PlaceDescription, [
+            {"place_id": p["id"], "content": "Description de %s" % p["label"], "responsibility_id": resp.id}
+            for p in places
+        ])
+        self.db.session.commit()
+
+    def export(self, size):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            start = time.perf_counter()
+            r, status, res = self.api_get("/places?export=linkedplaces&page[size]=%s" % size)
+            duration = time.perf_counter() - start
+        finally:
+            event.remove(self.db.engine, "before_cursor_execute", before_cursor_execute)
+        self.assert200(r)
+        self.assertEqual(size, len(res["features"]))
+        return duration, len(statements)
+
+    def test_export_is_batched(self):
+        timings, nb_queries = {}, {}
+        for size in self.SIZES:
+            timings[size], nb_queries[size] = self.export(size)
+            print("exporting {0} places: {1:.2f}ms ({2:.3f}ms per place, {3} queries)".format(
+                size, timings[size] * 1000, timings[size] * 1000 / size, nb_queries[size]))
+
+        smallest, largest = self.SIZES[0], self.SIZES[-1]
+        # the page is loaded with a query per relationship (and per 500 objects, the selectin loads batch size)
+        self.assertLessEqual(nb_queries[largest], 2 * nb_queries[smallest])
+        # a query per place would cost 10 times more per place
+        self.assertLess(timings[largest] / largest, 4 * timings[smallest] / smallest)
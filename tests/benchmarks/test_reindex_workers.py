@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import time
+
+from app.api.place.facade import PlaceFacade
+from app.cli import reindex_model, reindex_model_in_parallel
+from app.models import Place, InseeCommune, InseeRef
+from tests.base_server import TestBaseServer
+from tests.data.fixtures.gazetteer import load_fixtures
+
+
+class BulkCounter(object):
+
+    def __init__(self):
+        self.ids = []
+
+    def bulk(self, body, request_timeout):
+        self.ids.extend(line.split(b'"_id": ')[1].split(b"}")[0] for line in body.splitlines()[::2])
+        return {"errors": False, "items": []}
+
+
+class TestReindexWorkersBenchmark(TestBaseServer):
+    """
+    Time db-reindex of the places with 1, 2, 4 and 8 workers
+    """
+
+    WORKERS = (1, 2, 4, 8)
+    NB_PLACES = 4000
+
+    def setUp(self):
+        super().setUp()
+        self.db.drop_all()
+        self.db.create_all()
+        load_fixtures(self.db, nb_places=1)
+
+        # every place is a commune of its own canton
+        self.db.session.bulk_insert_mappings(InseeRef, [
+            {"id": "CT_98_%s" % i, "type": "CT", "insee_code": str(i), "level": 4, "label": "Canton %s" % i,
+             "parent_id": "AR_99_1"}
+            for i in range(self.NB_PLACES)
+        ])
+        self.db.session.bulk_insert_mappings(InseeCommune, [
+            {"id": "8%s" % str(i).zfill(4), "REG_id": "REG_99", "DEP_id": "DEP_99", "AR_id": "AR_99_1",
+             "CT_id": "CT_98_%s" % i, "NCCENR": "Commune %s" % i, "longlat": "(4.%s, 46.%s)" % (i, i)}
+            for i in range(self.NB_PLACES)
+        ])
+        self.db.session.bulk_insert_mappings(Place, [
+            {"id": "DT98-%s" % str(i).zfill(5), "label": "Commune %s" % i, "country": "FR", "dpt": "98",
+             "commune_insee_code": "8%s" % str(i).zfill(4), "responsibility_id": 1}
+            for i in range(self.NB_PLACES)
+        ])
+        self.db.session.commit()
+
+        self.checkpoint_dir = tempfile.mkdtemp()
+        self.elasticsearch = self.app.elasticsearch
+
+    def tearDown(self):
+        self.app.elasticsearch = self.elasticsearch
+        shutil.rmtree(self.checkpoint_dir)
+        super().tearDown()
+
+    def reindex(self, workers):
+        self.app.elasticsearch = BulkCounter()
+        checkpoint_path = os.path.join(self.checkpoint_dir, "places.%s.checkpoint.json" % workers)
+        with self.app.app_context():
+            if workers == 1:
+                stats = reindex_model(Place, PlaceFacade, "", "places", checkpoint_path, batch_size=500,
+                                      max_chunk_bytes=512 * 1024)
+            else:
+                stats = reindex_model_in_parallel(Place, PlaceFacade, "", "places", checkpoint_path, workers,
+                                                  batch_size=500, max_chunk_bytes=512 * 1024)
+        return stats, self.app.elasticsearch.ids
+
+    def test_workers(self):
+        with self.app.app_context():
+            nb_places = Place.query.count()
+        timings = {}
+        for workers in self.WORKERS:
+            start = time.perf_counter()
+            stats, ids = self.reindex(workers)
+            timings[workers] = time.perf_counter() - start
+
+            self.assertEqual(nb_places, stats["count"])
+            self.assertEqual(nb_places, len(set(ids)))
+            print("reindexing {0} places with {1} workers: {2:.2f}s ({3:.2f}x)".format(
+                nb_places, workers, timings[workers], timings[1] / timings[workers]))
@@ -0,0 +1,79 @@
+import random
+import time
+from collections import namedtuple
+from unittest import mock
+
+from app.api.facade_manager import JSONAPIFacadeManager
+from app.api.route_registrar import JSONAPIRouteRegistrar
+from app.api.search import SearchIndexManager
+from app.models import Place, PlaceOldLabel, Responsibility, User, Bibl
+from tests.base_server import TestBaseServer
+
+Hit = namedtuple("Hit", ("type", "id"))
+
+
+class TestSearchHydrationBenchmark(TestBaseServer):
+    """
+    Time the search path from the search engine hits to the sorted facades
+    """
+
+    SIZES = (100, 1000, 10000)
+
+    def setUp(self):
+        super().setUp()
+        self.db.drop_all()
+        self.db.create_all()
+        resp = Responsibility(user=User(username="Conservator57"), bibl=Bibl(abbr="DT99", bibl="DT de test"))
+        self.db.session.add(resp)
+        self.db.session.flush()
+
+        nb = self.SIZES[-1]
+        self.db.session.bulk_insert_mappings(Place, [
+            {"id": "DT99-%s" % str(i).zfill(5), "label": "Lieu %s" % i, "country": "FR", "dpt": "99",
+             "responsibility_id": resp.id}
+            for i in range(nb)
+        ])
+        self.db.session.bulk_insert_mappings(PlaceOldLabel, [
+            {"id": i + 1, "old_label_id": "DT99-%s-01" % str(i).zfill(5), "place_id": "DT99-%s" % str(i).zfill(5),
+             "rich_label": "Lieu", "responsibility_id": resp.id}
+            for i in range(nb)
+        ])
+        self.db.session.commit()
+
+    def hydrate(self, hits):
+        registrar = self.app.api_url_registrar
+        query_index = mock.patch.object(SearchIndexManager, "query_index",
+                                        return_value=(hits, [], None, len(hits)))
+        with self.app.test_request_context(), query_index:
+            ranks, res, meta = registrar.search(index=None, query="*", ranges=[], groupby=None,
+                                                sort_criteriae=None, page_id=1, page_size=len(hits),
+                                                page_after=None)
+            facade_objs = []
+            for idx, objs in res.items():
+                for obj in objs.all():
+                    facade_class = JSONAPIFacadeManager.get_facade_class(obj, "search")
+                    facade_objs.append((idx, facade_class("", obj, False, False)))
+            return JSONAPIRouteRegistrar.sort_by_rank(facade_objs, ranks)
+
+    @staticmethod
+    def make_hits(size):
+        # half places, half old labels (the search engine gives their integer ids as strings), in a random order
+        hits = [Hit("place", "DT99-%s" % str(i).zfill(5)) for i in range(size // 2)]
+        hits += [Hit("place-old-label", str(i + 1)) for i in range(size - size // 2)]
+        random.Random(size).shuffle(hits)
+        return hits
+
+    def test_hydration_is_linear(self):
+        timings = {}
+        for size in self.SIZES:
+            hits = self.make_hits(size)
+            start = time.perf_counter()
+            sorted_facade_objs = self.hydrate(hits)
+            timings[size] = time.perf_counter() - start
+
+            self.assertEqual([h.id for h in hits], [str(f.obj.id) for f in sorted_facade_objs])
+            print("hydrating {0} hits: {1:.2f}ms ({2:.3f}µs per hit)".format(
+                size, timings[size] * 1000, timings[size] * 1000000 / size))
+
+        # an index() lookup per hit would cost 10 times more per hit
+        self.assertLess(timings[10000] / 10000, 4 * timings[1000] / 1000)
@@ -0,0 +1,42 @@
+from app.models import InseeRef, InseeCommune, Place, PlaceOldLabel, PlaceDescription, PlaceComment, \
+    PlaceFeatureType, User, Bibl, Responsibility
+
+
+def load_fixtures(db, nb_places=6):
+    """
+    A small but complete gazetteer: every place is a commune of the same canton and has old labels,
+    a description, a comment and a feature type. Each odd place also has a sub-communal place localized
+    in its commune.
+    """
+    user = User(username="Conservator57")
+    bibl = Bibl(abbr="DT99", bibl="DT de test")
+
+    reg = InseeRef(id="REG_99", type="REG", insee_code="99", level=1, label="Région de test")
+    dep = InseeRef(id="DEP_99", type="DEP", insee_code="99", level=2, label="Département de test", parent=reg)
+    ar = InseeRef(id="AR_99_1", type="AR", insee_code="1", level=3, label="Arrondissement de test", parent=dep)
+    db.session.add_all([user, bibl, reg, dep, ar])
+
+    for i in range(1, nb_places + 1):
+        ct = InseeRef(id="CT_99_%s" % i, type="CT", insee_code=str(i), level=4, label="Canton %s" % i, parent=ar)
+        co = InseeCommune(id="99%s" % str(i).zfill(3), region=reg, departement=dep, arrondissement=ar, canton=ct,
+                          NCCENR="Commune %s" % i, longlat="(4.%s, 46.%s)" % (i, i))
+        resp = Responsibility(user=user, bibl=bibl, num_start_page=i)
+
+        p = Place(id="DT99-%s" % str(i).zfill(5), country="FR", dpt="99", label="Commune %s" % i,
+                  commune=co, responsibility=resp)
+        db.session.add_all([ct, co, resp, p])
+
+        PlaceDescription(place=p, responsibility=resp, content="Commune du canton %s" % i)
+        PlaceComment(place=p, responsibility=resp, content="Commentaire %s" % i)
+        PlaceFeatureType(place=p, responsibility=resp, term="commune")
+        for j in range(1, 3):
+            PlaceOldLabel(old_label_id="DT99-%s-%s" % (str(i).zfill(5), j), place=p, responsibility=resp,
+                          rich_label="Vieux nom %s.%s" % (i, j), rich_date="%s" % (1200 + j), text_date="%s" % (1200 + j))
+
+        if i % 2:
+            lp = Place(id="DT99-%s" % str(100 + i).zfill(5), country="FR", dpt="99", label="Ferme %s" % i,
+                       localization_commune=co, localization_commune_relation_type="tgn3000_related_to",
+                       responsibility=resp)
+            db.session.add(lp)
+
+    db.session.commit()